@@ -0,0 +1,93 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Persistent state of the incremental analysis of key_detector.
+
+A sqlite database keeps the result of every track analysed, under the hash
+of the content of the track and the hash of the settings it was analysed
+with (see key_detector.settings_hash). A later run with the same settings
+only analyses the tracks that are new or were modified, and takes the
+results of all the others from the database.
+
+The content hash of a file is only computed again when its size or
+modification time change, so that unchanged tracks are not read at all.
+"""
+
+import os
+import json
+import sqlite3
+import numpy as np
+from corpus_manifest import content_hash
+
+
+class AnalysisState(object):
+    """results of previous runs stored in a sqlite file."""
+
+    def __init__(self, path, commit_every=256):
+        self.path = os.path.expanduser(path)
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tracks '
+                                '(filename TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(track TEXT, settings TEXT, key TEXT, confidence REAL, chroma BLOB, '
+                                'frames TEXT, segments TEXT, PRIMARY KEY (track, settings))')
+        self.connection.commit()
+        self.commit_every = commit_every
+        self.pending = 0
+
+    def track_hash(self, filename):
+        """returns the content hash of an audio file, reusing the stored one
+        if the size and mtime of the file did not change."""
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        row = self.connection.execute('SELECT size, mtime, hash FROM tracks WHERE filename = ?',
+                                      (filename,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == int(stat.st_mtime):
+            return row[2]
+        track = content_hash(filename)
+        self.connection.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)',
+                                (filename, stat.st_size, int(stat.st_mtime), track))
+        self.changed()
+        return track
+
+    def get(self, track, settings_hashes):
+        """returns the stored result of a track for every settings hash as a
+        tuple (chroma, estimations, frames, segments), in the format of
+        key_detector.analyse_track, or None if any of them is missing."""
+        estimations = []
+        segments = []
+        for settings in settings_hashes:
+            row = self.connection.execute('SELECT key, confidence, chroma, frames, segments FROM results '
+                                          'WHERE track = ? AND settings = ?', (track, settings)).fetchone()
+            if row is None:
+                return None
+            estimations.append((str(row[0]), row[1]))
+            chroma = np.frombuffer(bytes(row[2]), dtype=np.float64)
+            frames = tuple(json.loads(row[3]))
+            if row[4] is not None:
+                segments.append([tuple(segment) for segment in json.loads(row[4])])
+        return chroma, estimations, frames, segments
+
+    def put(self, track, settings_hashes, chroma, estimations, frames, segments):
+        """stores the result of a track for every settings hash."""
+        chroma = sqlite3.Binary(np.asarray(chroma, dtype=np.float64).tostring())
+        for c, settings in enumerate(settings_hashes):
+            key, confidence = estimations[c]
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (track, settings, key, float(confidence), chroma, json.dumps(list(frames)),
+                                     json.dumps(segments[c]) if segments else None))
+        self.changed()
+
+    def changed(self):
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
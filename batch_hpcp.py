@@ -0,0 +1,197 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Vectorized HPCP front-end.
+
+Computes the same chain as essentia's FrameCutter -> Windowing -> Spectrum
+-> SpectralPeaks -> SpectralWhitening -> HPCP, but over a whole block of
+frames at once: the signal is framed as a strided 2-D view, all frames are
+windowed and transformed with a single call to numpy.fft.rfft, and peak
+picking, whitening and the hpcp weighting are array operations over the
+frame matrix. Results match the essentia chain within a small tolerance
+(see benchmarks/batch_frontend.py).
+"""
+
+import numpy as np
+
+BPF_RESOLUTION = 100.0  # Hz between the breakpoints of the whitening envelope.
+
+
+def frame_signal(audio, frame_size, hop_size, number_of_frames=None):
+    """returns a (number_of_frames x frame_size) strided view of the audio.
+    As in essentia's FrameCutter, the first frame is centred on sample 0."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if number_of_frames is None:
+        number_of_frames = len(audio) / hop_size
+    half = frame_size / 2
+    needed = (number_of_frames - 1) * hop_size + frame_size
+    padded = np.zeros(max(needed, half + len(audio)), dtype=np.float32)
+    padded[half:half + len(audio)] = audio
+    stride = padded.strides[0]
+    return np.lib.stride_tricks.as_strided(padded,
+                                           shape=(number_of_frames, frame_size),
+                                           strides=(hop_size * stride, stride))
+
+
+def window_function(window_type, size):
+    """returns a window normalised as essentia's Windowing (area = 2)."""
+    n = np.arange(size)
+    if window_type == 'hann':
+        window = 0.5 - 0.5 * np.cos(2 * np.pi * n / (size - 1.0))
+    elif window_type == 'hamming':
+        window = 0.53836 - 0.46164 * np.cos(2 * np.pi * n / (size - 1.0))
+    elif window_type == 'square':
+        window = np.ones(size)
+    else:
+        raise ValueError("Unsupported window type: " + window_type)
+    return (2 * window / np.sum(window)).astype(np.float32)
+
+
+def spectral_peaks(spectra, sample_rate, min_frequency, max_frequency,
+                   max_peaks, magnitude_threshold):
+    """finds the max_peaks strongest local maxima of every spectrum, with
+    parabolic interpolation. Returns two (frames x max_peaks) arrays with
+    frequencies and magnitudes; missing peaks have zero magnitude."""
+    n_frames, n_bins = spectra.shape
+    scale = (sample_rate / 2.0) / (n_bins - 1)  # Hz per bin
+    lo = max(int(np.ceil(min_frequency / scale)), 1)
+    hi = min(int(np.floor(max_frequency / scale)), n_bins - 2)
+    mid = spectra[:, lo:hi + 1]
+    left = spectra[:, lo - 1:hi]
+    right = spectra[:, lo + 1:hi + 2]
+    is_peak = (mid > left) & (mid >= right) & (mid > magnitude_threshold)
+    denominator = left - 2 * mid + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(denominator != 0, 0.5 * (left - right) / denominator, 0)
+    frequencies = (np.arange(lo, hi + 1) + delta) * scale
+    magnitudes = np.where(is_peak, mid - 0.25 * (left - right) * delta, 0)
+    k = min(max_peaks, magnitudes.shape[1])
+    if k < magnitudes.shape[1]:
+        index = np.argpartition(-magnitudes, k - 1, axis=1)[:, :k]
+        rows = np.arange(n_frames)[:, np.newaxis]
+        frequencies = frequencies[rows, index]
+        magnitudes = magnitudes[rows, index]
+    return frequencies, magnitudes
+
+
+def whiten_peaks(spectra, frequencies, magnitudes, sample_rate, max_frequency):
+    """divides the peak magnitudes by a spectral envelope made of the maxima
+    of the spectrum in bands of BPF_RESOLUTION Hz, linearly interpolated in
+    dB, as essentia's SpectralWhitening does up to 1.2 * max_frequency."""
+    n_frames, n_bins = spectra.shape
+    scale = (sample_rate / 2.0) / (n_bins - 1)
+    whitening_range = max_frequency * 1.2
+    n_bands = min(int(whitening_range / BPF_RESOLUTION),
+                  int((n_bins - 1) * scale / BPF_RESOLUTION))
+    if n_bands < 1:
+        return magnitudes
+    edges = np.ceil(np.arange(n_bands + 1) * BPF_RESOLUTION / scale).astype(int)
+    band_max = np.maximum.reduceat(spectra[:, :edges[-1]], edges[:-1], axis=1)
+    envelope = np.where(band_max < 1e-10, -200.0,
+                        20 * np.log10(np.maximum(band_max, 1e-10)))
+    position = frequencies / BPF_RESOLUTION - 0.5
+    i0 = np.clip(np.floor(position).astype(int), 0, n_bands - 1)
+    i1 = np.minimum(i0 + 1, n_bands - 1)
+    fraction = np.clip(position - i0, 0, 1)
+    rows = np.arange(n_frames)[:, np.newaxis]
+    envelope = envelope[rows, i0] * (1 - fraction) + envelope[rows, i1] * fraction
+    whitened = magnitudes * 10 ** (-envelope / 20.0)
+    return np.where(frequencies < whitening_range, whitened, magnitudes)
+
+
+def harmonic_peaks(harmonics):
+    """semitone offsets and strengths of the harmonic contributions, as in
+    essentia's HPCP (subharmonics folded into the octave around 0)."""
+    peaks = []
+    for i in range(harmonics + 1):
+        semitone = 12 * np.log2(i + 1.0)
+        octweight = max(1.0, (semitone / 12.0) * 0.5)
+        while semitone >= 12.0 - 0.5:
+            semitone -= 12.0
+        for peak in peaks:
+            if peak[0] == semitone:
+                peak[1] += 1.0 / octweight
+                break
+        else:
+            peaks.append([semitone, 1.0 / octweight])
+    return peaks
+
+
+def hpcp(frequencies, magnitudes, size=36, reference_frequency=440,
+         min_frequency=25, max_frequency=3500, harmonics=4,
+         weight_type='squaredCosine', weight_window_size=1,
+         normalize=True, non_linear=True):
+    """computes a (frames x size) hpcp matrix from the spectral peaks of
+    every frame, accumulating all contributions with a single bincount
+    per harmonic and window offset."""
+    n_frames = frequencies.shape[0]
+    result = np.zeros(n_frames * size)
+    valid = (frequencies >= min_frequency) & (frequencies <= max_frequency) & (magnitudes > 0)
+    rows = np.nonzero(valid)[0] * size
+    f = frequencies[valid]
+    m2 = magnitudes[valid] ** 2
+    resolution = size / 12.0
+    half_window = resolution * weight_window_size / 2.0
+    for semitone, strength in harmonic_peaks(harmonics):
+        bin_f = np.log2(f * 2 ** (-semitone / 12.0) / reference_frequency) * size
+        weights = m2 * strength * strength
+        if weight_type == 'none':
+            bins = np.round(bin_f).astype(int) % size
+            result += np.bincount(rows + bins, weights=weights, minlength=len(result))
+            continue
+        reach = int(np.ceil(half_window))
+        for offset in range(-reach, reach + 1):
+            bins = np.floor(bin_f).astype(int) + offset
+            distance = np.abs(bin_f - bins)
+            inside = distance <= half_window
+            w = np.cos(np.pi * distance / resolution / weight_window_size)
+            if weight_type == 'squaredCosine':
+                w = w * w
+            elif weight_type != 'cosine':
+                raise ValueError("Unsupported weight type: " + weight_type)
+            result += np.bincount(rows[inside] + bins[inside] % size,
+                                  weights=(w * weights)[inside],
+                                  minlength=len(result))
+    result = result.reshape(n_frames, size)
+    if normalize:
+        max_val = np.max(result, axis=1)[:, np.newaxis]
+        result = np.divide(result, np.where(max_val > 0, max_val, 1))
+    if non_linear:
+        result = np.sin(result * np.pi * 0.5) ** 2
+        result = np.where(result < 0.6, result * result / 0.6 * result / 0.6, result)
+    return result.astype(np.float32)
+
+
+def hpcp_frames(audio, window_size=4096, hop_size=16384, **settings):
+    """returns the (frames x hpcp_size) hpcp matrix of an audio signal."""
+    return frames_hpcp(frame_signal(audio, window_size, hop_size),
+                       window_size=window_size, **settings)
+
+
+def frames_hpcp(frames, sample_rate=44100, window_size=4096, window_type='hann',
+                min_frequency=25, max_frequency=3500, spectral_whitening=True,
+                magnitude_threshold=0.0001, max_peaks=60, band_preset=False,
+                harmonics=4, non_linear=True, normalize=True,
+                reference_frequency=440, hpcp_size=36,
+                weight_type='squaredCosine', weight_window_size=1,
+                block_size=256, **ignored):
+    """returns the (frames x hpcp_size) hpcp matrix of a matrix of audio
+    frames of window_size samples, not necessarily contiguous (see
+    frame_selection). Frames are processed in blocks of block_size to bound
+    memory usage."""
+    if band_preset:
+        raise ValueError("The batch front-end does not support band_preset.")
+    window = window_function(window_type, window_size)
+    chroma = np.zeros((len(frames), hpcp_size), dtype=np.float32)
+    for start in range(0, len(frames), block_size):
+        spectra = np.abs(np.fft.rfft(frames[start:start + block_size] * window, axis=1))
+        p1, p2 = spectral_peaks(spectra, sample_rate, min_frequency,
+                                max_frequency, max_peaks, magnitude_threshold)
+        if spectral_whitening:
+            p2 = whiten_peaks(spectra, p1, p2, sample_rate, max_frequency)
+        chroma[start:start + block_size] = hpcp(p1, p2, hpcp_size, reference_frequency,
+                                                min_frequency, max_frequency, harmonics,
+                                                weight_type, weight_window_size,
+                                                normalize, non_linear)
+    return chroma
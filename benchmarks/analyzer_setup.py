@@ -0,0 +1,46 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Micro-benchmark of the per-track setup cost of the analysis chain.
+
+Compares instantiating the essentia algorithms for every track (as the
+scripts used to do) with reusing a single KeyAnalyzer and resetting it
+between tracks. Short synthetic clips are used, so that the setup cost
+is not hidden by the analysis itself.
+"""
+
+clip_duration = 5   # seconds
+clips         = 200
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from time import time as tiempo
+from key_analyzer import KeyAnalyzer
+from synthetic import synthetic_clip
+
+
+def analyse(analyzer, audio):
+    return analyzer.key(np.mean(analyzer.hpcp_frames(audio), axis=0))
+
+
+audio_clips = [synthetic_clip(48 + (i % 12), clip_duration) for i in range(clips)]
+
+start = tiempo()
+for audio in audio_clips:
+    analyse(KeyAnalyzer(), audio)
+per_track = tiempo() - start
+
+start = tiempo()
+analyzer = KeyAnalyzer()
+for audio in audio_clips:
+    analyzer.reset()
+    analyse(analyzer, audio)
+reused = tiempo() - start
+
+print clips, "clips of", clip_duration, "secs."
+print "new chain per track:  %.3f secs (%.2f ms/track)" % (per_track, 1000 * per_track / clips)
+print "reused chain:         %.3f secs (%.2f ms/track)" % (reused, 1000 * reused / clips)
+print "setup cost per track: %.2f ms" % (1000 * (per_track - reused) / clips)
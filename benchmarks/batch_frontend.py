@@ -0,0 +1,49 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Compares the vectorized hpcp front-end (batch_hpcp) with the per-frame
+essentia chain: mean chroma difference and running time per track.
+
+USAGE: batch_frontend.py [<route to audio>]
+Without arguments, synthetic clips are used.
+"""
+
+tolerance   = 0.05  # max absolute difference allowed between mean chromas.
+clips       = 20
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from time import time as tiempo
+from key_analyzer import KeyAnalyzer
+from synthetic import synthetic_clip
+
+essentia_chain = KeyAnalyzer(hop_size=4096, front_end='essentia')
+numpy_chain = KeyAnalyzer(hop_size=4096, front_end='numpy')
+
+if len(sys.argv) > 1:
+    audio_folder = sys.argv[1]
+    tracks = [essentia_chain.load(audio_folder + '/' + item)
+              for item in sorted(os.listdir(audio_folder)) if not item.startswith('.')]
+else:
+    tracks = [synthetic_clip(48 + (i % 12), 30) for i in range(clips)]
+
+times = [0, 0]
+differences = []
+for audio in tracks:
+    start = tiempo()
+    essentia_chroma = np.mean(essentia_chain.hpcp_frames(audio), axis=0)
+    times[0] += tiempo() - start
+    start = tiempo()
+    numpy_chroma = np.mean(numpy_chain.hpcp_frames(audio), axis=0)
+    times[1] += tiempo() - start
+    differences.append(np.max(np.abs(essentia_chroma - numpy_chroma)))
+
+print len(tracks), "tracks."
+print "per-frame essentia chain: %.3f secs" % times[0]
+print "vectorized numpy chain:   %.3f secs (x%.1f)" % (times[1], times[0] / times[1])
+print "max difference in mean chroma: %.4f (mean %.4f)" % (np.max(differences), np.mean(differences))
+if np.max(differences) > tolerance:
+    print "WARNING: difference above tolerance of", tolerance
@@ -0,0 +1,61 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Accuracy versus throughput of the frame selection strategies: for every
+strategy and budget (fraction of frames analysed), the weighted MIREX score
+and the tracks analysed per second on a corpus with the ground truth in the
+file names ('title' mode of key_detector).
+
+USAGE: frame_budget.py <route to audio>
+"""
+
+budgets      = [0.05, 0.1, 0.15, 0.25, 0.5, 1.0]
+strategies   = ['strided', 'random', 'energy', 'onset']
+window_size  = 4096
+front_end    = 'numpy'
+profile_type = 'edmm'
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from time import time as tiempo
+from key_analyzer import KeyAnalyzer
+from key_tools import key_to_list, mirex_score, shift_vector
+import frame_selection
+
+if len(sys.argv) < 2:
+    print "USAGE: frame_budget.py <route to audio>"
+    sys.exit()
+audio_folder = sys.argv[1]
+tracks = sorted(item for item in os.listdir(audio_folder) if ' = ' in item and ' < ' in item)
+analyzer = KeyAnalyzer(window_size=window_size, front_end=front_end, profile_type=profile_type)
+
+print len(tracks), "tracks.\n"
+print "%-8s %7s %10s %10s" % ('strategy', 'budget', 'weighted', 'tracks/sec')
+for strategy in strategies:
+    for budget in budgets:
+        scores = []
+        start_time = tiempo()
+        for item in tracks:
+            filename = audio_folder + '/' + item
+            reader = frame_selection.open_reader(filename, analyzer.sample_rate, analyzer.load)
+            positions = frame_selection.select_frames(reader, strategy, 0, reader.duration,
+                                                      window_size, budget=budget,
+                                                      seed=frame_selection.seed_for(item))
+            frames = frame_selection.read_frames(reader, positions, window_size)
+            reader.close()
+            chroma = np.asarray(analyzer.frames_hpcp(frames)).reshape(-1, analyzer.hpcp_size)
+            chroma = chroma[np.sum(chroma, axis=1) > 0]
+            if len(chroma) == 0:  # e.g. silence, or no onset found: scored as an error.
+                scores.append(0)
+                continue
+            chroma = shift_vector(np.mean(chroma, axis=0), analyzer.hpcp_size)
+            key, scale, strength, relative = analyzer.key(chroma)
+            ground_truth = key_to_list(item[item.find(' = ') + 3:item.rfind(' < ')])
+            scores.append(mirex_score(ground_truth, key_to_list(key + ' ' + scale)))
+        elapsed = tiempo() - start_time
+        print "%-8s %6.0f%% %10.3f %10.1f" % (strategy, budget * 100,
+                                              np.mean(scores) if scores else 0,
+                                              len(tracks) / elapsed)
@@ -0,0 +1,43 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Throughput of batch key estimation, in vectors per second: one Key call
+per vector versus a single KeyBatch call, and key_tools.estimate_keys().
+"""
+
+vectors      = 20000  # about 10 minutes of frames at a hop of 1024 samples.
+hpcp_size    = 36
+profile_type = 'edmm'
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import essentia.standard as estd
+from time import time as tiempo
+from key_tools import key_profile, profile_matrix, estimate_keys
+
+chroma = np.random.rand(vectors, hpcp_size).astype(np.float32)
+settings = dict(pcpSize=hpcp_size, profileType=profile_type,
+                usePolyphony=False, useThreeChords=False)
+
+key = estd.Key(**settings)
+start = tiempo()
+per_vector = [key(vector) for vector in chroma]
+elapsed = tiempo() - start
+print "Key, one call per vector:  %10.0f vectors/sec" % (vectors / elapsed)
+
+if hasattr(estd, 'KeyBatch'):
+    key_batch = estd.KeyBatch(**settings)
+    start = tiempo()
+    batch = key_batch(chroma)
+    elapsed = tiempo() - start
+    print "KeyBatch, single call:     %10.0f vectors/sec" % (vectors / elapsed)
+    assert list(batch[0]) == [estimation[0] for estimation in per_vector]
+
+start = tiempo()
+matrix = profile_matrix(*key_profile(profile_type, hpcp_size))
+tonic, mode, strength, relative_strength = estimate_keys(chroma, matrix)
+elapsed = tiempo() - start
+print "key_tools.estimate_keys:   %10.0f vectors/sec" % (vectors / elapsed)
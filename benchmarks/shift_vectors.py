@@ -0,0 +1,47 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Tuning correction of the frames of a 10-minute track: shift_vector() called
+per frame (as key_detector did with shift_scope = 'frame') versus a single
+key_tools.shift_vectors() call, with whole-bin and sub-bin (centroid) shifts.
+"""
+
+track_duration = 600  # seconds
+hop_size       = 1024
+hpcp_size      = 36
+repetitions    = 5
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from time import time as tiempo
+from key_analyzer import KeyAnalyzer
+from key_tools import shift_vector, shift_vectors
+from synthetic import synthetic_clip
+
+analyzer = KeyAnalyzer(hop_size=hop_size, hpcp_size=hpcp_size)
+frames = np.asarray(analyzer.hpcp_frames(synthetic_clip(57, track_duration)), dtype=float)
+frames = frames[np.sum(frames, axis=1) > 0]
+print len(frames), "frames of", hpcp_size, "bins."
+
+start = tiempo()
+for repetition in range(repetitions):
+    per_frame = np.array([shift_vector(vector, hpcp_size) for vector in frames])
+elapsed = (tiempo() - start) / repetitions
+print "shift_vector, per frame:     %8.2f ms" % (1000 * elapsed)
+
+start = tiempo()
+for repetition in range(repetitions):
+    batch = shift_vectors(frames, hpcp_size)
+batch_elapsed = (tiempo() - start) / repetitions
+print "shift_vectors, peak:         %8.2f ms (x%.0f), max difference %g" % (
+    1000 * batch_elapsed, elapsed / batch_elapsed, np.max(np.abs(batch - per_frame)))
+
+for scope in ('frame', 'global'):
+    start = tiempo()
+    for repetition in range(repetitions):
+        shift_vectors(frames, hpcp_size, 'centroid', scope)
+    batch_elapsed = (tiempo() - start) / repetitions
+    print "shift_vectors, centroid/%-6s %7.2f ms (x%.0f)" % (scope + ':', 1000 * batch_elapsed, elapsed / batch_elapsed)
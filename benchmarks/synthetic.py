@@ -0,0 +1,21 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Synthetic audio used by the benchmarks, so that they can run without a corpus.
+"""
+
+import numpy as np
+
+sample_rate = 44100
+
+
+def synthetic_clip(tonic, seconds=5, minor=False):
+    """a triad on the given midi note, with a few harmonics."""
+    t = np.arange(seconds * sample_rate) / float(sample_rate)
+    audio = np.zeros(len(t))
+    for note in (tonic, tonic + (3 if minor else 4), tonic + 7):
+        f0 = 440 * 2 ** ((note - 69) / 12.)
+        for h in range(1, 5):
+            audio += np.sin(2 * np.pi * f0 * h * t) / h
+    return (audio / np.max(np.abs(audio))).astype(np.float32)
@@ -0,0 +1,103 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Persistent on-disk cache of per-frame hpcp matrices.
+
+Entries are compressed .npz files named after a hash of the audio file
+(size and modification time, or its full content) and of the front-end
+settings used to compute them, so that sweeps over parameters of the key
+stage only (profile type, polyphony, thresholds...) do not need to decode
+and analyse the audio again. The cache is bounded in size: when it grows
+beyond max_size, the least recently used entries are deleted.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class ChromaCache(object):
+    """size-bounded LRU cache of per-frame hpcp matrices stored in folder."""
+
+    def __init__(self, folder, max_size=2048, hash_content=False):
+        """max_size is given in megabytes. If hash_content is True, audio files
+        are identified by a hash of their bytes instead of size and mtime."""
+        self.folder = os.path.expanduser(folder)
+        self.max_size = max_size * 1024 * 1024
+        self.hash_content = hash_content
+        if not os.path.isdir(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:  # created meanwhile by another worker.
+                pass
+        self.size = sum(size for path, size, mtime in self._entries())
+
+    def _entries(self):
+        entries = []
+        for item in os.listdir(self.folder):
+            if item.endswith('.npz'):
+                path = os.path.join(self.folder, item)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # removed by another process.
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.npz')
+
+    def file_id(self, filename):
+        """identifies an audio file by its content or by its size and mtime."""
+        if self.hash_content:
+            sha = hashlib.sha1()
+            with open(filename, 'rb') as audio_file:
+                for block in iter(lambda: audio_file.read(1 << 20), b''):
+                    sha.update(block)
+            return sha.hexdigest()
+        stat = os.stat(filename)
+        return '%s:%d:%d' % (os.path.abspath(filename), stat.st_size, int(stat.st_mtime))
+
+    def key(self, filename, settings):
+        """returns the cache key of an audio file analysed with the given
+        front-end settings (a dictionary)."""
+        sha = hashlib.sha1(self.file_id(filename).encode('utf-8'))
+        sha.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return sha.hexdigest()
+
+    def get(self, key):
+        """returns the hpcp matrix stored under key, or None if missing."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                frames = np.load(cache_file)['hpcp']
+            os.utime(path, None)  # mark as recently used.
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        return frames
+
+    def put(self, key, frames):
+        """stores an hpcp matrix under key, evicting old entries if needed."""
+        path = self._path(key)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as cache_file:
+            np.savez_compressed(cache_file, hpcp=np.asarray(frames, dtype=np.float32))
+        os.rename(temp_path, path)  # atomic, so other processes never read half a file.
+        self.size += os.path.getsize(path)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """deletes the least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(entry[1] for entry in entries)
+        for path, size, mtime in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
@@ -0,0 +1,205 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""Memory-mapped store of the per-frame chroma of a whole corpus.
+
+The hpcp frames of all the tracks are kept in a single float32 file,
+one after the other (total frames x hpcp_size), with an index of the first
+frame of every track and a table with the file name and ground truth of
+each track:
+
+chroma.f32     raw float32 frames, in C order.
+index.npz      offsets (tracks + 1), hpcp_size, filename, ground_truth.
+
+The frames are opened with numpy.memmap, so nothing is parsed when a store
+is read, only the pages used are loaded, and processes reading the same
+store share them through the page cache.
+
+A store is built from the audio with the settings of key_detector.py, in
+a pool of worker processes that reuse its chroma cache (--cache):
+
+USAGE: corpus_chroma.py build <route to audio> <store> [<route to ground-truth>] [-w N] [--cache]
+       corpus_chroma.py import <csv file> <store>
+       corpus_chroma.py evaluate <store> [-p PROFILE_TYPE]
+
+'import' converts the csv written by key_detector in 'title' mode
+(results_to_csv = True) into a store with the mean chroma of every track
+as its only frame.
+"""
+
+import os, sys, argparse
+import numpy as np
+from key_tools import *
+
+
+class ChromaStoreWriter(object):
+    """appends the frames of one track at a time to a store in folder."""
+
+    def __init__(self, folder, hpcp_size):
+        self.folder = folder
+        self.hpcp_size = hpcp_size
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.frames_file = open(os.path.join(folder, 'chroma.f32.tmp'), 'wb')
+        self.offsets = [0]
+        self.filenames = []
+        self.ground_truths = []
+
+    def append(self, filename, ground_truth, frames):
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1, self.hpcp_size)
+        frames.tofile(self.frames_file)
+        self.offsets.append(self.offsets[-1] + len(frames))
+        self.filenames.append(filename)
+        self.ground_truths.append(ground_truth)
+
+    def close(self):
+        """writes the index. The store is only visible once complete."""
+        self.frames_file.close()
+        with open(os.path.join(self.folder, 'index.npz.tmp'), 'wb') as index_file:
+            np.savez(index_file, offsets=np.array(self.offsets, dtype=np.int64),
+                     hpcp_size=self.hpcp_size, filename=np.array(self.filenames),
+                     ground_truth=np.array(self.ground_truths))
+        os.rename(os.path.join(self.folder, 'chroma.f32.tmp'), os.path.join(self.folder, 'chroma.f32'))
+        os.rename(os.path.join(self.folder, 'index.npz.tmp'), os.path.join(self.folder, 'index.npz'))
+
+
+class ChromaStore(object):
+    """read-only view of a store, with the frames mapped in memory."""
+
+    def __init__(self, folder):
+        with np.load(os.path.join(folder, 'index.npz')) as index:
+            self.offsets = index['offsets']
+            self.hpcp_size = int(index['hpcp_size'])
+            self.filenames = index['filename']
+            self.ground_truths = index['ground_truth']
+        if self.offsets[-1] > 0:
+            self.chroma = np.memmap(os.path.join(folder, 'chroma.f32'), dtype=np.float32, mode='r',
+                                    shape=(int(self.offsets[-1]), self.hpcp_size))
+        else:
+            self.chroma = np.zeros((0, self.hpcp_size), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def frames(self, track):
+        """returns the (frames x hpcp_size) chroma of a track, without copying it."""
+        return self.chroma[self.offsets[track]:self.offsets[track+1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def means(self):
+        """returns the (tracks x hpcp_size) mean chroma of every track, skipping
+        silent frames. Tracks without frames get zeros."""
+        sums = np.zeros((len(self), self.hpcp_size))
+        counts = np.zeros(len(self))
+        block = 1 << 16  # frames read at a time, to bound memory.
+        tracks = np.repeat(np.arange(len(self)), self.lengths())
+        for start in range(0, len(tracks), block):
+            frames = np.asarray(self.chroma[start:start+block], dtype=float)
+            voiced = np.sum(frames, axis=1) > 0
+            owners = tracks[start:start+block][voiced]
+            np.add.at(sums, owners, frames[voiced])
+            counts += np.bincount(owners, minlength=len(self))
+        return sums / np.maximum(counts, 1)[:, np.newaxis]
+
+    def key_indexes(self):
+        """returns the ground truth of every track as key indexes (-1 if unknown)."""
+        indexes = np.empty(len(self), dtype=int)
+        for i, key in enumerate(self.ground_truths):
+            try:
+                indexes[i] = key_index(*key_to_list(str(key).replace('\t', ' ').strip()))
+            except (KeyError, IndexError):
+                indexes[i] = -1
+        return indexes
+
+
+def ground_truth(item, groundtruth_folder):
+    """returns the annotated key of a track as text ('' if unknown)."""
+    if groundtruth_folder is None:
+        if ' = ' not in item or ' < ' not in item:
+            return ''
+        return item[item.find(' = ')+3:item.rfind(' < ')]
+    annotation = os.path.join(groundtruth_folder, item[:item.rfind('.')] + '.txt')
+    if not os.path.isfile(annotation):
+        return ''
+    with open(annotation) as annotation_file:
+        return annotation_file.readline().replace('\t', ' ').strip()
+
+
+def track_frames(item):
+    import key_detector as kd
+    return item, np.asarray(kd.track_frames(item), dtype=np.float32)
+
+
+def build(args):
+    import key_detector as kd
+    kd.audio_folder = args.audio_folder
+    kd.chroma_cache = args.cache
+    items = sorted(item for item in os.listdir(args.audio_folder) if not item.startswith('.'))
+    writer = ChromaStoreWriter(args.store, kd.hpcp_size)
+    if args.workers == 1:
+        kd.init_worker()
+        analysis = (track_frames(item) for item in items)
+    else:
+        from multiprocessing import Pool, cpu_count
+        pool = Pool(args.workers or cpu_count(), kd.init_worker)
+        analysis = pool.imap(track_frames, items, chunksize=4)
+    for item, frames in analysis:
+        writer.append(item, ground_truth(item, args.groundtruth_folder), frames)
+    if args.workers != 1:
+        pool.close()
+        pool.join()
+    writer.close()
+    print len(items), "tracks,", writer.offsets[-1], "frames written to", args.store
+
+
+def import_csv(args):
+    from profile_cv import read_csv
+    names, keys, chroma = read_csv(args.csv_file)
+    writer = ChromaStoreWriter(args.store, chroma.shape[1] if len(chroma) else 12)
+    for name, key, vector in zip(names, keys, chroma):
+        writer.append(name, key, vector)
+    writer.close()
+    print len(names), "tracks written to", args.store
+
+
+def evaluate(args):
+    store = ChromaStore(args.store)
+    chroma = store.means()
+    ground_truths = store.key_indexes()
+    selected = (np.sum(chroma, axis=1) > 0) & (ground_truths >= 0)
+    chroma, ground_truths = chroma[selected], ground_truths[selected]
+    print np.sum(selected), "of", len(store), "tracks with frames and ground truth."
+    if args.shift:
+        chroma = shift_vectors(chroma, store.hpcp_size)
+    major, minor = key_profile(args.profile_type, store.hpcp_size)
+    tonic, mode, strength, relative = estimate_keys(chroma, profile_matrix(major, minor))
+    mirex_evaluation(mirex_scores(ground_truths, key_index(tonic, mode)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped store of the per-frame chroma of a corpus.")
+    commands = parser.add_subparsers()
+    build_parser = commands.add_parser('build')
+    build_parser.add_argument('audio_folder')
+    build_parser.add_argument('store')
+    build_parser.add_argument('groundtruth_folder', nargs='?')
+    build_parser.add_argument('-w', '--workers', type=int, default=0)
+    build_parser.add_argument('--cache', action='store_true')
+    build_parser.set_defaults(command=build)
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('csv_file')
+    import_parser.add_argument('store')
+    import_parser.set_defaults(command=import_csv)
+    evaluate_parser = commands.add_parser('evaluate')
+    evaluate_parser.add_argument('store')
+    evaluate_parser.add_argument('-p', '--profile_type', default='edmm')
+    evaluate_parser.add_argument('--no-shift', dest='shift', action='store_false')
+    evaluate_parser.set_defaults(command=evaluate)
+    args = parser.parse_args()
+    args.command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Indexed manifest of an audio corpus with the annotations in the file names.
+
+The file names of the corpus follow the 'title' convention of key_detector:
+
+FORMAT:  'Artist Name - Title of the Song = Key annotation < genre > DATASET.wav'
+
+A CorpusManifest parses every name once and stores it in a json file,
+together with the size, modification time, duration, sample rate and
+content hash of the file. refresh() only looks again at the files that
+were added or modified since the manifest was written, and select()
+answers queries by collection, genre, modality and key from inverted
+indexes, without scanning the file names.
+
+USAGE: corpus_manifest.py <route to audio> [<manifest file>]
+"""
+
+import os
+import sys
+import json
+import wave
+import hashlib
+
+VERSION = 1
+
+
+def parse_title(item):
+    """returns the fields of a file name in the 'title' convention, or None
+    if the name does not follow it."""
+    if ' = ' not in item or ' < ' not in item or ' > ' not in item:
+        return None
+    description = item[:item.find(' = ')]
+    key = item[item.find(' = ')+3:item.rfind(' < ')].strip()
+    if ' - ' in description:
+        artist, title = description.split(' - ', 1)
+    else:
+        artist, title = '', description
+    return {'artist': artist,
+            'title': title,
+            'key': key,
+            'modality': key.split(' ')[-1] if ' ' in key else '',
+            'genre': item[item.rfind(' < ')+3:item.rfind(' > ')],
+            'collection': item[item.rfind(' > ')+3:item.rfind('.')]}
+
+
+def audio_properties(path):
+    """returns (duration in secs, sample rate) of an audio file, reading only
+    its header if it is a wav file, or (None, None) if they are unknown."""
+    if path.lower().endswith('.wav'):
+        try:
+            audio_file = wave.open(path, 'rb')
+        except (wave.Error, EOFError, IOError):
+            return None, None
+        try:
+            return audio_file.getnframes() / float(audio_file.getframerate()), audio_file.getframerate()
+        finally:
+            audio_file.close()
+    try:
+        import essentia.standard as estd
+        metadata = estd.MetadataReader(filename=path, failOnError=True)()
+        return float(metadata[-4]), int(metadata[-2])  # duration, bitrate, sample rate, channels.
+    except Exception:
+        return None, None
+
+
+def content_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as audio_file:
+        for block in iter(lambda: audio_file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def default_path(folder, cache_folder='~/.edmkey_cache'):
+    """the manifest of a folder is kept in cache_folder by default, so
+    that nothing is written to the corpus itself."""
+    name = hashlib.sha1(os.path.abspath(folder).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(cache_folder), 'manifest_' + name + '.json')
+
+
+class CorpusManifest(object):
+    """persistent index of the files in an audio folder."""
+
+    fields = ('collection', 'genre', 'modality', 'key')
+
+    def __init__(self, folder, path=None, hash_content=True):
+        self.folder = folder
+        self.path = path or default_path(folder)
+        self.hash_content = hash_content
+        self.files = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == VERSION:
+                self.files = manifest['files']
+        self.build_indexes()
+
+    def build_indexes(self):
+        self.indexes = dict((field, {}) for field in self.fields)
+        for item, entry in self.files.items():
+            if entry.get('title') is None:
+                continue
+            for field in self.fields:
+                self.indexes[field].setdefault(entry[field], set()).add(item)
+
+    def refresh(self):
+        """updates the entries of the files added, modified or removed since
+        the manifest was written, and saves it if anything changed. Returns
+        the number of (added or modified, removed) files."""
+        present = set()
+        changed = 0
+        for item in os.listdir(self.folder):
+            if item.startswith('.'):
+                continue
+            path = os.path.join(self.folder, item)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            present.add(item)
+            entry = self.files.get(item)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == int(stat.st_mtime):
+                continue
+            entry = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+            entry['duration'], entry['sample_rate'] = audio_properties(path)
+            entry['hash'] = content_hash(path) if self.hash_content else None
+            entry.update(parse_title(item) or {'title': None})
+            self.files[item] = entry
+            changed += 1
+        removed = [item for item in self.files if item not in present]
+        for item in removed:
+            del self.files[item]
+        if changed or removed:
+            self.build_indexes()
+            self.save()
+        return changed, len(removed)
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temp_path, 'w') as manifest_file:
+            json.dump({'version': VERSION, 'folder': os.path.abspath(self.folder),
+                       'files': self.files}, manifest_file)
+        os.rename(temp_path, self.path)
+
+    def select(self, collection=None, genre=None, modality=None, key=None):
+        """returns the sorted names of the files matching all the given
+        criteria. Every criterion is a list of accepted values (None
+        accepts any value)."""
+        selected = None
+        for field, values in zip(self.fields, (collection, genre, modality, key)):
+            if values is None:
+                continue
+            matching = set()
+            for value in values:
+                matching |= self.indexes[field].get(value, set())
+            selected = matching if selected is None else selected & matching
+        if selected is None:
+            selected = [item for item, entry in self.files.items() if entry.get('title') is not None]
+        return sorted(selected)
+
+    def entry(self, item):
+        """returns the manifest entry of a file."""
+        return self.files[item]
+
+
+if __name__ == "__main__":
+    try:
+        audio_folder = sys.argv[1]
+    except IndexError:
+        print "USAGE: corpus_manifest.py <route to audio> [<manifest file>]"
+        sys.exit()
+    manifest = CorpusManifest(audio_folder, sys.argv[2] if len(sys.argv) > 2 else None)
+    changed, removed = manifest.refresh()
+    print len(manifest.files), "files in", manifest.path
+    print changed, "added or modified,", removed, "removed."
+    for field in CorpusManifest.fields[:3]:
+        print field + ':', ', '.join('%s (%d)' % (value, len(items)) for value, items
+                                     in sorted(manifest.indexes[field].items()))
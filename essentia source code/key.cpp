@@ -19,6 +19,10 @@
 
 #include "key.h"
 #include "essentiamath.h"
+#include <cstdlib>
+#include <fstream>
+#include <map>
+#include <sstream>
 
 using namespace std;
 
@@ -39,93 +43,245 @@ const char* Key::description = DOC("Using pitch profile classes, this algorithm
 "  pp. 65-100, 1999.");
 
 
+namespace {
+
+typedef map<string, pair<vector<Real>, vector<Real> > > ProfileRegistry;
+typedef map<string, Key::Profiles> ProfileCache;
+
+// pcp sizes for which the built-in profiles are interpolated in advance
+const int commonPcpSizes[] = { 12, 24, 36, 120 };
+
+// reads extra profiles from a text file, one per line: a name followed by
+// 12 values for the major profile and 12 for the minor one (starting on the
+// tonic). Lines starting with '#' are ignored.
+void loadProfiles(const string& filename, ProfileRegistry& registry) {
+  ifstream file(filename.c_str());
+  if (!file.is_open()) {
+    throw EssentiaException("Key: could not open the profiles file ", filename);
+  }
+  string line;
+  while (getline(file, line)) {
+    if (line.empty() || line[0] == '#') continue;
+    istringstream fields(line);
+    string profileName;
+    fields >> profileName;
+    if (profileName.empty()) continue;
+    vector<Real> values;
+    Real value;
+    while (fields >> value) values.push_back(value);
+    if (values.size() != 24) {
+      throw EssentiaException("Key: profile ", profileName, " should have 24 values (12 major, 12 minor) in ", filename);
+    }
+    registry[profileName] = make_pair(vector<Real>(values.begin(), values.begin() + 12),
+                                      vector<Real>(values.begin() + 12, values.end()));
+  }
+}
+
+// the profiles known by name: the built-in ones, plus those in the file
+// given by the ESSENTIA_KEY_PROFILES environment variable, if any
+ProfileRegistry& profileRegistry() {
+  static ProfileRegistry registry;
+  if (registry.empty()) {
+    const char* profileNames[] = { "diatonic", "krumhansl", "temperley", "weichai",
+                                   "tonictriad", "temperley2005", "thpcp", "shaath",
+                                   "gomez", "noland", "faraldo", "pentatonic",
+                                   "edmm", "edma" };
+
+    const Real profileTypes[][12] = {
+      // Diatonic
+      { 1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1 },
+      { 1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 0, 1 },
+
+      // Krumhansl
+      { 6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88 },
+      { 6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17 },
+
+      // A revised version of the key profiles, by David Temperley, see [2]
+      { 5.0, 2.0, 3.5, 2.0, 4.5, 4.0, 2.0, 4.5, 2.0, 3.5, 1.5, 4.0 },
+      { 5.0, 2.0, 3.5, 4.5, 2.0, 4.0, 2.0, 4.5, 3.5, 2.0, 1.5, 4.0 },
+
+      // Wei Chai MIT PhD thesis
+      { 81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218, 39853, 1579, 28908 },
+      { 39853, 1579, 28908, 81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218 },
+
+      // Tonic triad.
+      { 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0 },
+      { 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0 },
+
+      // Temperley MIREX 2005
+      { 0.748, 0.060, 0.488, 0.082, 0.67, 0.46, 0.096, 0.715, 0.104, 0.366, 0.057, 0.4 },
+      { 0.712, 0.084, 0.474, 0.618, 0.049, 0.46, 0.105, 0.747, 0.404, 0.067, 0.133, 0.33 },
+
+      // Statistics THPCP over all the evaluation set
+      { 0.95162, 0.20742, 0.71758, 0.22007, 0.71341, 0.48841, 0.31431, 1.00000, 0.20957, 0.53657, 0.22585, 0.55363 },
+      { 0.94409, 0.21742, 0.64525, 0.63229, 0.27897, 0.57709, 0.26428, 1.0000, 0.26428, 0.30633, 0.45924, 0.35929 },
+
+      // Shaath
+      { 6.6, 2.0, 3.5, 2.3, 4.6, 4.0, 2.5, 5.2, 2.4, 3.7, 2.3, 3.4 },
+      { 6.5, 2.7, 3.5, 5.4, 2.6, 3.5, 2.5, 5.2, 4.0, 2.7, 4.3, 3.2 },
+
+      // Gómez (as specified by Shaath)
+      { 0.82, 0.00, 0.55, 0.00, 0.53, 0.30, 0.08, 1.00, 0.00, 0.38, 0.00, 0.47 },
+      { 0.81, 0.00, 0.53, 0.54, 0.00, 0.27, 0.07, 1.00, 0.27, 0.07, 0.10, 0.36 },
+
+      // Noland
+      { 0.0629, 0.0146, 0.061, 0.0121, 0.0623, 0.0414, 0.0248, 0.0631, 0.015, 0.0521, 0.0142, 0.0478 },
+      { 0.0682, 0.0138, 0.0543, 0.0519, 0.0234, 0.0544, 0.0176, 0.067, 0.0349, 0.0297, 0.0401, 0.027 },
+
+      // Faraldo
+      { 7.0, 2.0, 3.8, 2.3, 4.7, 4.1, 2.5, 5.2, 2.0, 3.7, 3.0, 3.4 },
+      { 7.0, 3.0, 3.8, 4.5, 2.6, 3.5, 2.5, 5.2, 4.0, 2.5, 4.5, 3.0 },
+
+      // Pentatonic
+      { 1.0, 0.1, 0.25, 0.1, 0.5, 0.7, 0.1, 0.8, 0.1, 0.25, 0.1, 0.5 },
+      { 1.0, 0.2, 0.25, 0.5, 0.1, 0.7, 0.1, 0.8, 0.3, 0.2, 0.6, 0.2  },
+
+      // edmm
+      { 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083 },
+      { 0.17235348, 0.04, 0.0761009,  0.12, 0.05621498, 0.08527853, 0.0497915,  0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106 },
+
+      // edma
+      { 0.16519551, 0.04749026, 0.08293076, 0.06687112, 0.09994645, 0.09274123, 0.05294487, 0.13159476, 0.05218986, 0.07443653, 0.06940723, 0.0642515  },
+      { 0.17235348, 0.05336489, 0.0761009,  0.10043649, 0.05621498, 0.08527853, 0.0497915,  0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106 }
+    };
+
+    const int profileCount = sizeof(profileNames) / sizeof(profileNames[0]);
+    for (int i=0; i<profileCount; i++) {
+      registry[profileNames[i]] = make_pair(arrayToVector<Real>(profileTypes[2*i]),
+                                            arrayToVector<Real>(profileTypes[2*i+1]));
+    }
+
+    const char* profilesFile = getenv("ESSENTIA_KEY_PROFILES");
+    if (profilesFile) {
+      loadProfiles(profilesFile, registry);
+    }
+  }
+  return registry;
+}
+
+// interpolates the 12-bin profiles to pcpsize values and precomputes their
+// means, standard deviations and all their normalised rotations
+Key::Profiles interpolateProfiles(const vector<Real>& M, const vector<Real>& m, int pcpsize) {
+  Key::Profiles profiles;
+  int n = pcpsize/12;
+
+  profiles.doM.resize(pcpsize);
+  profiles.dom.resize(pcpsize);
+
+  for (int i=0; i<12; i++) {
+
+    profiles.doM[i*n] = M[i];
+    profiles.dom[i*n] = m[i];
+
+    // Two interpolated values
+    Real incr_M, incr_m;
+    if (i == 11) {
+      incr_M = (M[11] - M[0]) / n;
+      incr_m = (m[11] - m[0]) / n;
+    }
+    else {
+      incr_M = (M[i] - M[i+1]) / n;
+      incr_m = (m[i] - m[i+1]) / n;
+    }
+
+    for (int j=1; j<=(n-1); j++) {
+      profiles.doM[i*n+j] = M[i] - j * incr_M;
+      profiles.dom[i*n+j] = m[i] - j * incr_m;
+    }
+  }
+
+  profiles.meanM = mean(profiles.doM);
+  profiles.meanm = mean(profiles.dom);
+  profiles.stdM = 0;
+  profiles.stdm = 0;
+
+  // Compute Standard Deviations
+  for (int i=0; i<pcpsize; i++) {
+    profiles.stdM += (profiles.doM[i] - profiles.meanM) * (profiles.doM[i] - profiles.meanM);
+    profiles.stdm += (profiles.dom[i] - profiles.meanm) * (profiles.dom[i] - profiles.meanm);
+  }
+  profiles.stdM = sqrt(profiles.stdM);
+  profiles.stdm = sqrt(profiles.stdm);
+
+  // Precompute the circulant matrices of the normalised profiles:
+  // row 'shift' holds the profile rotated by 'shift' bins, as the former
+  // correlation() did with a modulo per element on every call
+  profiles.shiftedM.resize(pcpsize*pcpsize);
+  profiles.shiftedm.resize(pcpsize*pcpsize);
+  for (int shift=0; shift<pcpsize; shift++) {
+    for (int i=0; i<pcpsize; i++) {
+      int index = (i - shift) % pcpsize;
+      if (index < 0) {
+        index += pcpsize;
+      }
+      profiles.shiftedM[shift*pcpsize + i] = (profiles.doM[index] - profiles.meanM) / profiles.stdM;
+      profiles.shiftedm[shift*pcpsize + i] = (profiles.dom[index] - profiles.meanm) / profiles.stdm;
+    }
+  }
+  return profiles;
+}
+
+string cacheKey(const string& profileKey, int pcpsize) {
+  ostringstream key;
+  key << profileKey << "@" << pcpsize;
+  return key.str();
+}
+
+// interpolated profiles by configuration and pcp size, shared by all the
+// instances of Key. The monophonic versions of the registered profiles are
+// computed in advance for the common pcp sizes; any other combination is
+// computed once, the first time it is needed
+ProfileCache& profileCache() {
+  static ProfileCache cache;
+  if (cache.empty()) {
+    ProfileRegistry& registry = profileRegistry();
+    for (ProfileRegistry::const_iterator it = registry.begin(); it != registry.end(); ++it) {
+      for (int i=0; i<(int)(sizeof(commonPcpSizes) / sizeof(commonPcpSizes[0])); i++) {
+        cache[cacheKey(it->first, commonPcpSizes[i])] = interpolateProfiles(it->second.first, it->second.second, commonPcpSizes[i]);
+      }
+    }
+  }
+  return cache;
+}
+
+} // anonymous namespace
+
+
 void Key::configure() {
   _slope = parameter("slope").toReal();
   _numHarmonics = parameter("numHarmonics").toInt();
   _profileType = parameter("profileType").toString();
+  _usePolyphony = parameter("usePolyphony").toBool();
+  _useThreeChords = parameter("useThreeChords").toBool();
 
   const char* keyNames[] = { "A", "Bb", "B", "C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab" };
   _keys = arrayToVector<string>(keyNames);
 
-  Real profileTypes[][12] = {
-    // Diatonic
-    { 1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1 },
-    { 1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 0, 1 },
-
-    // Krumhansl
-    { 6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88 },
-    { 6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17 },
-
-    // A revised version of the key profiles, by David Temperley, see [2]
-    { 5.0, 2.0, 3.5, 2.0, 4.5, 4.0, 2.0, 4.5, 2.0, 3.5, 1.5, 4.0 },
-    { 5.0, 2.0, 3.5, 4.5, 2.0, 4.0, 2.0, 4.5, 3.5, 2.0, 1.5, 4.0 },
-
-    // Wei Chai MIT PhD thesis
-    { 81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218, 39853, 1579, 28908 },
-    { 39853, 1579, 28908, 81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218 },
-
-    // Tonic triad.
-    { 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0 },
-    { 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0 },
-
-    // Temperley MIREX 2005
-    { 0.748, 0.060, 0.488, 0.082, 0.67, 0.46, 0.096, 0.715, 0.104, 0.366, 0.057, 0.4 },
-    { 0.712, 0.084, 0.474, 0.618, 0.049, 0.46, 0.105, 0.747, 0.404, 0.067, 0.133, 0.33 },
-
-    // Statistics THPCP over all the evaluation set
-    { 0.95162, 0.20742, 0.71758, 0.22007, 0.71341, 0.48841, 0.31431, 1.00000, 0.20957, 0.53657, 0.22585, 0.55363 },
-    { 0.94409, 0.21742, 0.64525, 0.63229, 0.27897, 0.57709, 0.26428, 1.0000, 0.26428, 0.30633, 0.45924, 0.35929 },
-
-    // Shaath
-    { 6.6, 2.0, 3.5, 2.3, 4.6, 4.0, 2.5, 5.2, 2.4, 3.7, 2.3, 3.4 },
-    { 6.5, 2.7, 3.5, 5.4, 2.6, 3.5, 2.5, 5.2, 4.0, 2.7, 4.3, 3.2 },
-
-    // Gómez (as specified by Shaath)
-    { 0.82, 0.00, 0.55, 0.00, 0.53, 0.30, 0.08, 1.00, 0.00, 0.38, 0.00, 0.47 },
-    { 0.81, 0.00, 0.53, 0.54, 0.00, 0.27, 0.07, 1.00, 0.27, 0.07, 0.10, 0.36 },
-
-    // Noland
-    { 0.0629, 0.0146, 0.061, 0.0121, 0.0623, 0.0414, 0.0248, 0.0631, 0.015, 0.0521, 0.0142, 0.0478 },
-    { 0.0682, 0.0138, 0.0543, 0.0519, 0.0234, 0.0544, 0.0176, 0.067, 0.0349, 0.0297, 0.0401, 0.027 },
-
-    // Faraldo
-    { 7.0, 2.0, 3.8, 2.3, 4.7, 4.1, 2.5, 5.2, 2.0, 3.7, 3.0, 3.4 },
-    { 7.0, 3.0, 3.8, 4.5, 2.6, 3.5, 2.5, 5.2, 4.0, 2.5, 4.5, 3.0 },
-
-    // Pentatonic
-    { 1.0, 0.1, 0.25, 0.1, 0.5, 0.7, 0.1, 0.8, 0.1, 0.25, 0.1, 0.5 },
-    { 1.0, 0.2, 0.25, 0.5, 0.1, 0.7, 0.1, 0.8, 0.3, 0.2, 0.6, 0.2  },
-
-    // edmm
-    { 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083 },
-    { 0.17235348, 0.04, 0.0761009,  0.12, 0.05621498, 0.08527853, 0.0497915,  0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106 },
-
-    // edma
-    { 0.16519551, 0.04749026, 0.08293076, 0.06687112, 0.09994645, 0.09274123, 0.05294487, 0.13159476, 0.05218986, 0.07443653, 0.06940723, 0.0642515  },
-    { 0.17235348, 0.05336489, 0.0761009,  0.10043649, 0.05621498, 0.08527853, 0.0497915,  0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106 }
-};
-
-
-#define SET_PROFILE(i) _M = arrayToVector<Real>(profileTypes[2*i]); _m = arrayToVector<Real>(profileTypes[2*i+1])
-
-  if      (_profileType == "diatonic")      { SET_PROFILE(0);  }
-  else if (_profileType == "krumhansl")     { SET_PROFILE(1);  }
-  else if (_profileType == "temperley")     { SET_PROFILE(2);  }
-  else if (_profileType == "weichai")       { SET_PROFILE(3);  }
-  else if (_profileType == "tonictriad")    { SET_PROFILE(4);  }
-  else if (_profileType == "temperley2005") { SET_PROFILE(5);  }
-  else if (_profileType == "thpcp")         { SET_PROFILE(6);  }
-  else if (_profileType == "shaath")        { SET_PROFILE(7);  }
-  else if (_profileType == "gomez")         { SET_PROFILE(8);  }
-  else if (_profileType == "noland")        { SET_PROFILE(9);  }
-  else if (_profileType == "faraldo")       { SET_PROFILE(10); }
-  else if (_profileType == "pentatonic")    { SET_PROFILE(11); }
-  else if (_profileType == "edmm")          { SET_PROFILE(12); }
-  else if (_profileType == "edma")          { SET_PROFILE(13); }
-  else {
+  if (profileRegistry().find(_profileType) == profileRegistry().end()) {
     throw EssentiaException("Key: Unsupported profile type: ", _profileType);
   }
 
+  // the interpolated profiles are cached by configuration, so that
+  // reconfiguring Key with known settings is just a lookup
+  ostringstream profileKey;
+  profileKey << _profileType;
+  if (_usePolyphony) {
+    profileKey << "/polyphony/" << _useThreeChords << "/" << _numHarmonics << "/" << _slope;
+  }
+  _profileKey = profileKey.str();
+  _profiles = 0;
+
+  resize(parameter("pcpSize").toInt());
+}
+
+
+// builds the 12 values of the major and minor profiles of the current
+// configuration, adding the polyphonic contributions if needed
+void Key::buildProfiles(vector<Real>& M, vector<Real>& m) const {
+  const ProfileRegistry::mapped_type& profile = profileRegistry().find(_profileType)->second;
+  M = profile.first;
+  m = profile.second;
+
   // Compute the other vectors getting into account chords:
   // the other?? they are initialised with zeroes!
   vector<Real> M_chords(12, (Real)0.0);
@@ -136,8 +292,8 @@ void Key::configure() {
     TIndex dominant = n+7;
     if ( dominant > 11)
       dominant -= 12;
-    M_chords[n]= _M[n] + (1.0/3.0)*_M[dominant];
-    m_chords[n]= _m[n] + (1.0/3.0)*_m[dominant];
+    M_chords[n]= M[n] + (1.0/3.0)*M[dominant];
+    m_chords[n]= m[n] + (1.0/3.0)*m[dominant];
   }
   */
 
@@ -155,7 +311,7 @@ void Key::configure() {
 
   Procedure:
     - First, profiles are initialized to 0
-    - We take _M[i], n[i] as Krumhansl profiles i=1,...12 related to each of the chords
+    - We take M[i], n[i] as Krumhansl profiles i=1,...12 related to each of the chords
       of the major/minor key.
     - For each chord, we add its contribution to the three notes (pitch classes) of the chord.
       We use the same weight for all the notes of the chord.
@@ -168,77 +324,75 @@ void Key::configure() {
   */
   /* MAJOR KEY */
   // Tonic (I)
-  // addMajorTriad(0, _M[0], M_chords);
-  addContributionHarmonics(0, _M[0], M_chords);
+  // addMajorTriad(0, M[0], M_chords);
+  addContributionHarmonics(0, M[0], M_chords);
 
-  if (!parameter("useThreeChords").toBool()) {
+  if (!_useThreeChords) {
     // II
-    // addMinorTriad(2, _M[2], M_chords);
-	addContributionHarmonics(2, _M[2], M_chords);
+    // addMinorTriad(2, M[2], M_chords);
+	addContributionHarmonics(2, M[2], M_chords);
     // III
-    // addMinorTriad(4, _M[4], M_chords);
-	addContributionHarmonics(4, _M[4], M_chords);
+    // addMinorTriad(4, M[4], M_chords);
+	addContributionHarmonics(4, M[4], M_chords);
   }
 
   // Subdominant (IV)
-  // addMajorTriad(5, _M[5], M_chords);
-  addContributionHarmonics(5, _M[5], M_chords);
+  // addMajorTriad(5, M[5], M_chords);
+  addContributionHarmonics(5, M[5], M_chords);
   // Dominant (V)
-  //addMajorTriad(7, _M[7], M_chords);
-  addContributionHarmonics(7, _M[7], M_chords);
+  //addMajorTriad(7, M[7], M_chords);
+  addContributionHarmonics(7, M[7], M_chords);
 
-  if (!parameter("useThreeChords").toBool()) {
+  if (!_useThreeChords) {
     // VI
-    // addMinorTriad(9, _M[9], M_chords);
-	addContributionHarmonics(9, _M[9], M_chords);
+    // addMinorTriad(9, M[9], M_chords);
+	addContributionHarmonics(9, M[9], M_chords);
     // VII
-    addContributionHarmonics(11, _M[11], M_chords);
-    // addContributionHarmonics(2 , _M[11], M_chords);
-    // addContributionHarmonics(5 , _M[11], M_chords);
+    addContributionHarmonics(11, M[11], M_chords);
+    // addContributionHarmonics(2 , M[11], M_chords);
+    // addContributionHarmonics(5 , M[11], M_chords);
   }
 
   /** MINOR KEY */
   // Tonic I
-  // addMinorTriad(0, _m[0], m_chords);
-  addContributionHarmonics(0, _m[0], m_chords);
+  // addMinorTriad(0, m[0], m_chords);
+  addContributionHarmonics(0, m[0], m_chords);
 
-  if (!parameter("useThreeChords").toBool()) {
+  if (!_useThreeChords) {
     // II
-    addContributionHarmonics(2, _m[2], m_chords);
- 	// addContributionHarmonics(5, _m[2], m_chords);
-    // addContributionHarmonics(8, _m[2], m_chords);
+    addContributionHarmonics(2, m[2], m_chords);
+ 	// addContributionHarmonics(5, m[2], m_chords);
+    // addContributionHarmonics(8, m[2], m_chords);
 
     // III
-	// addMajorTriad(3, _M[3], M_chords);
-    addContributionHarmonics(3, _m[3], m_chords);
-    // addContributionHarmonics(7, _m[3], m_chords);
-    // addContributionHarmonics(10,_m[3], m_chords); // change according to scale!
+	// addMajorTriad(3, M[3], M_chords);
+    addContributionHarmonics(3, m[3], m_chords);
+    // addContributionHarmonics(7, m[3], m_chords);
+    // addContributionHarmonics(10,m[3], m_chords); // change according to scale!
   }
 
   // Subdominant (IV)
-  // addMinorTriad(5, _m[5], m_chords);
-  addContributionHarmonics(5, _m[5], m_chords);
+  // addMinorTriad(5, m[5], m_chords);
+  addContributionHarmonics(5, m[5], m_chords);
 
   // Dominant (V) BEWARE OF THE SCALE!
-  // addMajorTriad(7, _m[7], m_chords);
-  addContributionHarmonics(7, _m[7], m_chords);
+  // addMajorTriad(7, m[7], m_chords);
+  addContributionHarmonics(7, m[7], m_chords);
 
-  if (!parameter("useThreeChords").toBool()) {
+  if (!_useThreeChords) {
     // VI
-    // addMajorTriad(8, _m[8], m_chords);
-	addContributionHarmonics(8, _m[8], m_chords);
+    // addMajorTriad(8, m[8], m_chords);
+	addContributionHarmonics(8, m[8], m_chords);
     // VII WHICH SCALE??
-    addContributionHarmonics(10, _m[10], m_chords);
-    // addContributionHarmonics(2, _m[8], m_chords);
-    // addContributionHarmonics(5, _m[8], m_chords);
+    addContributionHarmonics(10, m[10], m_chords);
+    // addContributionHarmonics(2, m[8], m_chords);
+    // addContributionHarmonics(5, m[8], m_chords);
   }
 
-  if (parameter("usePolyphony").toBool()) {
-    _M = M_chords;
-    _m = m_chords;
+  if (_usePolyphony) {
+    M = M_chords;
+    m = m_chords;
   }
-
-  resize(parameter("pcpSize").toInt());
 }
 
 
@@ -252,7 +406,7 @@ void Key::compute() {
   if (pcpsize < 12 || pcpsize % 12 != 0)
     throw EssentiaException("Key: input PCP size is not a positive multiple of 12");
 
-  if (pcpsize != (int)_profile_dom.size()) {
+  if (!_profiles || pcpsize != (int)_profiles->dom.size()) {
     resize(pcpsize);
   }
 
@@ -283,19 +437,24 @@ void Key::compute() {
   Real max2Min = -1;
   int keyIndexMin = -1;
 
+  // normalise the PCP once, so that the correlation with every shifted
+  // profile is just a dot product with a row of the precomputed matrices.
+  vector<Real> pcp_normalised(pcpsize);
+  for (int i=0; i<pcpsize; i++)
+    pcp_normalised[i] = (pcp[i] - mean_pcp) / std_pcp;
+
   // calculate the correlation between the profiles and the PCP...
   // we shift the profile around to find the best match
   for (int shift=0; shift<pcpsize; shift++) {
-    /*
-    // Penalization if the Tonic has not a minimum amplitude
-    // max_pcp needs to be calculated...
-    Real factor = pcp[i]/max_pcp;
-    if (factor < 0.6) {
-      corrMajor *= factor / 0.6;
-      corrMinor *= factor / 0.6;
+    const Real* rowMajor = &_profiles->shiftedM[shift*pcpsize];
+    const Real* rowMinor = &_profiles->shiftedm[shift*pcpsize];
+    Real corrMajor = 0;
+    Real corrMinor = 0;
+    for (int i=0; i<pcpsize; i++) {
+      corrMajor += pcp_normalised[i] * rowMajor[i];
+      corrMinor += pcp_normalised[i] * rowMinor[i];
     }
-    */
-    Real corrMajor = correlation(pcp, mean_pcp, std_pcp, _profile_doM, _mean_profile_M, _std_profile_M, shift);
+
     // Compute maximum value for major keys
     if (corrMajor > maxMaj) {
       max2Maj = maxMaj;
@@ -303,7 +462,6 @@ void Key::compute() {
       keyIndexMaj = shift;
     }
 
-    Real corrMinor = correlation(pcp, mean_pcp, std_pcp, _profile_dom, _mean_profile_m, _std_profile_m, shift);
     // Compute maximum value for minor keys
     if (corrMinor > maxMin) {
       max2Min = maxMin;
@@ -367,77 +525,21 @@ void Key::compute() {
 
 }
 
-// this function resizes and interpolates the profiles to fit the
-// pcp size...
+// this function looks up the profiles interpolated to fit the pcp size,
+// building them and adding them to the cache the first time
 void Key::resize(int pcpsize) {
-  ///////////////////////////////////////////////////////////////////
-  // Interpolate to get pcpsize values
-  int n = pcpsize/12;
-
-  _profile_doM.resize(pcpsize);
-  _profile_dom.resize(pcpsize);
-
-  for (int i=0; i<12; i++) {
-
-    _profile_doM[i*n] = _M[i];
-    _profile_dom[i*n] = _m[i];
-
-    // Two interpolated values
-    Real incr_M, incr_m;
-    if (i == 11) {
-      incr_M = (_M[11] - _M[0]) / n;
-      incr_m = (_m[11] - _m[0]) / n;
-    }
-    else {
-      incr_M = (_M[i] - _M[i+1]) / n;
-      incr_m = (_m[i] - _m[i+1]) / n;
-    }
-
-    for (int j=1; j<=(n-1); j++) {
-      _profile_doM[i*n+j] = _M[i] - j * incr_M;
-      _profile_dom[i*n+j] = _m[i] - j * incr_m;
-    }
+  ProfileCache& cache = profileCache();
+  string key = cacheKey(_profileKey, pcpsize);
+  ProfileCache::iterator it = cache.find(key);
+  if (it == cache.end()) {
+    vector<Real> M, m;
+    buildProfiles(M, m);
+    it = cache.insert(make_pair(key, interpolateProfiles(M, m, pcpsize))).first;
   }
-
-  _mean_profile_M = mean(_profile_doM);
-  _mean_profile_m = mean(_profile_dom);
-  _std_profile_M = 0;
-  _std_profile_m = 0;
-
-  // Compute Standard Deviations
-  for (int i=0; i<pcpsize; i++) {
-    _std_profile_M += (_profile_doM[i] - _mean_profile_M) * (_profile_doM[i] - _mean_profile_M);
-    _std_profile_m += (_profile_dom[i] - _mean_profile_m) * (_profile_dom[i] - _mean_profile_m);
-  }
-  _std_profile_M = sqrt(_std_profile_M);
-  _std_profile_m = sqrt(_std_profile_m);
+  _profiles = &it->second;
 }
 
 
-// correlation coefficient with 'shift'
-// on of the vectors is shifted in time, and then the correlation is calculated,
-// just like a cross-correlation
-Real Key::correlation(const vector<Real>& v1, const Real mean1, const Real std1, const vector<Real>& v2, const Real mean2, const Real std2, const int shift) const
-{
-  Real r = 0.0;
-  int size = (int)v1.size();
-
-  for (int i=0; i<size; i++)
-  {
-    int index = (i - shift) % size;
-
-    if (index < 0) {
-      index += size;
-    }
-
-    r += (v1[i] - mean1) * (v2[index] - mean2);
-  }
-
-  r /= std1*std2;
-
-  return r;
-}
-
 /**
   Each note contribute to the different harmonics:
   1.- first  harmonic  f   -> i
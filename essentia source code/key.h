@@ -37,7 +37,20 @@ class Key : public Algorithm {
 
  public:
 
-  Key() {
+  // major and minor profiles interpolated to a pcp size, with their means,
+  // standard deviations and all their normalised rotations (row major)
+  struct Profiles {
+    std::vector<Real> doM;
+    std::vector<Real> dom;
+    Real meanM;
+    Real meanm;
+    Real stdM;
+    Real stdm;
+    std::vector<Real> shiftedM;
+    std::vector<Real> shiftedm;
+  };
+
+  Key() : _profiles(0) {
     declareInput(_pcp, "pcp", "the input pitch class profile");
     declareOutput(_key, "key", "the estimated key, from A to G");
     declareOutput(_scale, "scale", "the scale of the key (major or minor)");
@@ -50,7 +63,7 @@ class Key : public Algorithm {
     declareParameter("useThreeChords", "consider only the 3 main triad chords of the key (T, D, SD) to build the polyphonic profiles", "{true,false}", true);
     declareParameter("numHarmonics", "number of harmonics that should contribute to the polyphonic profile (1 only considers the fundamental harmonic)", "[1,inf)", 4);
     declareParameter("slope", "value of the slope of the exponential harmonic contribution to the polyphonic profile", "[0,inf)", 0.6);
-    declareParameter("profileType", "the type of polyphic profile to use for correlation calculation", "{diatonic,krumhansl,temperley,weichai,tonictriad,temperley2005,thpcp,shaath,gomez,noland,faraldo,pentatonic,edmm,edma}", "temperley");
+    declareParameter("profileType", "the type of polyphic profile to use for correlation calculation: diatonic, krumhansl, temperley, weichai, tonictriad, temperley2005, thpcp, shaath, gomez, noland, faraldo, pentatonic, edmm, edma, or any profile in the file given by the ESSENTIA_KEY_PROFILES environment variable", "", "temperley");
     declareParameter("pcpSize", "number of array elements used to represent a semitone times 12 (this parameter is only a hint, during computation, the size of the input PCP is used instead)", "[12,inf)", 36);
   }
 
@@ -66,26 +79,23 @@ protected:
     MINOR = 1
   };
 
-  std::vector<Real> _m;
-  std::vector<Real> _M;
-  std::vector<Real> _profile_doM;
-  std::vector<Real> _profile_dom;
-
-  Real _mean_profile_M;
-  Real _mean_profile_m;
-  Real _std_profile_M;
-  Real _std_profile_m;
+  // the profiles currently in use, shared with other instances through a
+  // cache indexed by _profileKey and pcp size
+  const Profiles* _profiles;
+  std::string _profileKey;
 
   Real _slope;
   int _numHarmonics;
   std::string _profileType;
+  bool _usePolyphony;
+  bool _useThreeChords;
 
   std::vector<std::string> _keys;
 
-  Real correlation(const std::vector<Real>& v1, const Real mean1, const Real std1, const std::vector<Real>& v2, const Real mean2, const Real std2, const int shift) const;
   void addContributionHarmonics(const int pitchclass, const Real contribution, std::vector<Real>& M_chords) const;
   void addMajorTriad(const int root, const Real contribution, std::vector<Real>& M_chords) const;
   void addMinorTriad(int root, Real contribution, std::vector<Real>& M_chords) const;
+  void buildProfiles(std::vector<Real>& M, std::vector<Real>& m) const;
   void resize(int size);
 };
 
@@ -119,7 +129,7 @@ class Key : public AlgorithmComposite {
     declareParameter("useThreeChords", "consider only the 3 main triad chords of the key (T, D, SD) to build the polyphonic profiles", "{true,false}", true);
     declareParameter("numHarmonics", "number of harmonics that should contribute to the polyphonic profile (1 only considers the fundamental harmonic)", "[1,inf)", 4);
     declareParameter("slope", "value of the slope of the exponential harmonic contribution to the polyphonic profile", "[0,inf)", 0.6);
-    declareParameter("profileType", "the type of polyphic profile to use for correlation calculation", "{diatonic,krumhansl,temperley,weichai,tonictriad,temperley2005,thpcp,shaath,gomez,noland,faraldo,pentatonic,edmm,edma}", "temperley");
+    declareParameter("profileType", "the type of polyphic profile to use for correlation calculation: diatonic, krumhansl, temperley, weichai, tonictriad, temperley2005, thpcp, shaath, gomez, noland, faraldo, pentatonic, edmm, edma, or any profile in the file given by the ESSENTIA_KEY_PROFILES environment variable", "", "temperley");
     declareParameter("pcpSize", "number of array elements used to represent a semitone times 12 (this parameter is only a hint, during computation, the size of the input PCP is used instead)", "[12,inf)", 36);
   }
 
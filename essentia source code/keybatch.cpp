@@ -0,0 +1,79 @@
+/*
+ * Copyright (C) 2006-2013  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of Essentia
+ *
+ * Essentia is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ */
+
+#include "keybatch.h"
+#include "algorithmfactory.h"
+
+using namespace std;
+
+namespace essentia {
+namespace standard {
+
+const char* KeyBatch::name = "KeyBatch";
+const char* KeyBatch::description = DOC("This algorithm estimates the key of every row of a matrix of pitch class profiles (e.g. the HPCP of every frame of a track) with the Key algorithm, in a single call.\n"
+"\n"
+"The profiles of the Key algorithm are built once, in configure(), so that the cost per row is a single correlation against all the shifted profiles. Outputs are vectors with one element per input row.\n"
+"\n"
+"KeyBatch will throw the same exceptions as Key for any of the rows.");
+
+
+KeyBatch::~KeyBatch() {
+  delete _keyAlgo;
+}
+
+
+void KeyBatch::configure() {
+  if (!_keyAlgo) {
+    _keyAlgo = AlgorithmFactory::create("Key");
+  }
+  _keyAlgo->configure(INHERIT("usePolyphony"),
+                      INHERIT("useThreeChords"),
+                      INHERIT("numHarmonics"),
+                      INHERIT("slope"),
+                      INHERIT("profileType"),
+                      INHERIT("pcpSize"));
+}
+
+
+void KeyBatch::compute() {
+
+  const vector<vector<Real> >& pcp = _pcp.get();
+  vector<string>& key = _key.get();
+  vector<string>& scale = _scale.get();
+  vector<Real>& strength = _strength.get();
+  vector<Real>& firstToSecondRelativeStrength = _firstToSecondRelativeStrength.get();
+
+  int rows = (int)pcp.size();
+  key.resize(rows);
+  scale.resize(rows);
+  strength.resize(rows);
+  firstToSecondRelativeStrength.resize(rows);
+
+  for (int i=0; i<rows; i++) {
+    _keyAlgo->input("pcp").set(pcp[i]);
+    _keyAlgo->output("key").set(key[i]);
+    _keyAlgo->output("scale").set(scale[i]);
+    _keyAlgo->output("strength").set(strength[i]);
+    _keyAlgo->output("firstToSecondRelativeStrength").set(firstToSecondRelativeStrength[i]);
+    _keyAlgo->compute();
+  }
+}
+
+} // namespace standard
+} // namespace essentia
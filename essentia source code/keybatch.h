@@ -0,0 +1,72 @@
+/*
+ * Copyright (C) 2006-2013  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of Essentia
+ *
+ * Essentia is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ */
+
+#ifndef ESSENTIA_KEYBATCH_H
+#define ESSENTIA_KEYBATCH_H
+
+#include "algorithm.h"
+
+namespace essentia {
+namespace standard {
+
+class KeyBatch : public Algorithm {
+
+ private:
+  Input<std::vector<std::vector<Real> > > _pcp;
+
+  Output<std::vector<std::string> > _key;
+  Output<std::vector<std::string> > _scale;
+  Output<std::vector<Real> > _strength;
+  Output<std::vector<Real> > _firstToSecondRelativeStrength;
+
+  Algorithm* _keyAlgo;
+
+ public:
+
+  KeyBatch() : _keyAlgo(0) {
+    declareInput(_pcp, "pcp", "the input pitch class profiles, one per row");
+    declareOutput(_key, "key", "the estimated key of each row, from A to G");
+    declareOutput(_scale, "scale", "the scale of the key of each row (major or minor)");
+    declareOutput(_strength, "strength", "the strength of the estimated key of each row");
+    declareOutput(_firstToSecondRelativeStrength, "firstToSecondRelativeStrength", "the relative strength difference between the best estimate and second best estimate of the key of each row");
+  }
+
+  ~KeyBatch();
+
+  void declareParameters() {
+    declareParameter("usePolyphony", "enables the use of polyphonic profiles to define key profiles (this includes the contributions from triads as well as pitch harmonics)", "{true,false}", true);
+    declareParameter("useThreeChords", "consider only the 3 main triad chords of the key (T, D, SD) to build the polyphonic profiles", "{true,false}", true);
+    declareParameter("numHarmonics", "number of harmonics that should contribute to the polyphonic profile (1 only considers the fundamental harmonic)", "[1,inf)", 4);
+    declareParameter("slope", "value of the slope of the exponential harmonic contribution to the polyphonic profile", "[0,inf)", 0.6);
+    declareParameter("profileType", "the type of polyphic profile to use for correlation calculation: diatonic, krumhansl, temperley, weichai, tonictriad, temperley2005, thpcp, shaath, gomez, noland, faraldo, pentatonic, edmm, edma, or any profile in the file given by the ESSENTIA_KEY_PROFILES environment variable", "", "temperley");
+    declareParameter("pcpSize", "number of array elements used to represent a semitone times 12 (this parameter is only a hint, during computation, the size of the input PCP is used instead)", "[12,inf)", 36);
+  }
+
+  void compute();
+  void configure();
+
+  static const char* name;
+  static const char* description;
+
+};
+
+} // namespace standard
+} // namespace essentia
+
+#endif // ESSENTIA_KEYBATCH_H
@@ -5,82 +5,180 @@
 This script evaluates the key estimation task according to the mirex standard.
 Ángel Faraldo, March 2015.
 
+Ground-truth annotations and estimations are matched by file name (without
+extension), not by their order in the folders: files without a counterpart
+are reported and left out of the evaluation. Estimations can also be given
+as a single csv file with 'filename,key' rows or as the results store
+written by key_detector (results_format = 'store'), which are much faster
+to read than a folder with a file per track.
 """
 verbose = True
 confusion_matrix = True
 results_to_file = True
+report_unmatched = 10  # number of missing / extra files listed (all are counted).
+read_threads = 16  # files are read by a pool of threads.
 
 import sys
+import os
+from key_tools import *
+from results_store import is_store, ResultsReader
 
-# Command line interface
-# ======================
 try:
-    ground_truth_route = sys.argv[1]
-    estimations_route = sys.argv[2]
-except:
-    print "\nUSAGE:", sys.argv[0], "<folder with ground-truth annotations> <folder with key estimations>"
-    sys.exit()
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def index_folder(folder, extension='.txt'):
+    """returns a dictionary {name without extension: path} of the annotation
+    files in a folder, in a single pass over the directory. Hidden files and
+    the files written by the evaluation itself (starting with '_') are
+    skipped."""
+    if scandir is not None:
+        names = [entry.name for entry in scandir(folder) if entry.is_file()]
+    else:
+        names = os.listdir(folder)
+    index = {}
+    for name in names:
+        if name.startswith(('.', '_')) or not name.endswith(extension):
+            continue
+        index[name[:name.rfind('.')]] = os.path.join(folder, name)
+    return index
 
-import os
-from key_tools import *
 
+def read_first_line(path):
+    with open(path, 'r') as annotation:
+        return annotation.readline()
 
-# retrieve folder data
-# ====================
-ground_truth_list = os.listdir(ground_truth_route)
-if '.DS_Store' in ground_truth_list:
-    ground_truth_list.remove('.DS_Store')
-estimations_list = os.listdir(estimations_route)
-if '.DS_Store' in estimations_list:
-    estimations_list.remove('.DS_Store')
-
-# run the evaluation algorithm
-# ============================
-print "\n...EVALUATING..."
-if verbose:
-    print "\nresults for individual songs:"
-    print "-----------------------------"
-
-if confusion_matrix:
-    matrix = 24 * 24 * [0]
-
-list_of_results = []
-
-for i in range(len(ground_truth_list)):
-    ground_truth_file = open(ground_truth_route + '/' + ground_truth_list[i], 'r')
-    ground_truth = key_to_list(ground_truth_file.readline())
-    gt_filename = ground_truth_list[i][:ground_truth_list[i].rfind('.')]
-    estimation_file = open(estimations_route + '/' + estimations_list[i], 'r')
-    estimation = key_to_list(estimation_file.readline())
-    es_filename = estimations_list[i][:estimations_list[i].rfind('.')]
-    if es_filename == gt_filename:
-        score = mirex_score(ground_truth, estimation)
+
+def read_keys(index):
+    """reads the first line of every file in an index, with a pool of
+    threads. Returns a dictionary {name: key as text}."""
+    names = list(index)
+    if read_threads > 1 and len(names) > read_threads:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(read_threads)
+        lines = pool.map(read_first_line, [index[name] for name in names], chunksize=256)
+        pool.close()
+        pool.join()
     else:
-        print "ground-truth and estimation do not match. SKIPPING"
-    if verbose: print "%03d" % (i + 1,), '- est:', estimation, '\tgt:', ground_truth, '\tScore:', score
-    list_of_results.append(score)
+        lines = [read_first_line(index[name]) for name in names]
+    return dict(zip(names, lines))
+
+
+def read_keys_csv(filename):
+    """reads estimations from a csv file with 'filename,key' rows. Returns
+    a dictionary {name without extension: key as text}."""
+    import csv
+    keys = {}
+    with open(filename, 'r') as csv_file:
+        for row in csv.reader(csv_file):
+            if len(row) < 2:
+                continue
+            name = os.path.basename(row[0])
+            if '.' in name:
+                name = name[:name.rfind('.')]
+            keys[name] = row[1]
+    return keys
+
+
+def match(ground_truth, estimations):
+    """joins two dictionaries by name. Returns the sorted list of names in
+    both, and those only in ground_truth (missing) or only in estimations
+    (extra)."""
+    matched = sorted(name for name in ground_truth if name in estimations)
+    missing = sorted(name for name in ground_truth if name not in estimations)
+    extra = sorted(name for name in estimations if name not in ground_truth)
+    return matched, missing, extra
+
+
+def key_indexes(keys, names):
+    """converts the keys (as text) of the given names into key indexes.
+    Unreadable keys get -1 and are scored as errors."""
+    indexes = np.empty(len(names), dtype=int)
+    for i, name in enumerate(names):
+        try:
+            indexes[i] = key_index(*key_to_list(keys[name].replace('\t', ' ').strip()))
+        except (KeyError, IndexError):
+            indexes[i] = -1
+    return indexes
+
+
+def report(title, names):
+    if names:
+        print "\n%d %s:" % (len(names), title)
+        for name in names[:report_unmatched]:
+            print "   ", name
+        if len(names) > report_unmatched:
+            print "    ..."
+
+
+if __name__ == "__main__":
+    # Command line interface
+    # ======================
+    try:
+        ground_truth_route = sys.argv[1]
+        estimations_route = sys.argv[2]
+    except:
+        print "\nUSAGE:", sys.argv[0], "<folder with ground-truth annotations> <folder with key estimations | results store | csv file>"
+        sys.exit()
+
+    # retrieve folder data
+    # ====================
+    ground_truth_keys = read_keys(index_folder(ground_truth_route))
+    if is_store(estimations_route):
+        results_route = estimations_route
+        estimated_keys = ResultsReader(estimations_route).keys()
+    elif os.path.isdir(estimations_route) and is_store(os.path.join(estimations_route, '_results')):
+        results_route = estimations_route
+        estimated_keys = ResultsReader(os.path.join(estimations_route, '_results')).keys()
+    elif os.path.isdir(estimations_route):
+        results_route = estimations_route
+        estimated_keys = read_keys(index_folder(estimations_route))
+    else:
+        results_route = os.path.dirname(os.path.abspath(estimations_route))
+        estimated_keys = read_keys_csv(estimations_route)
+    matched, missing, extra = match(ground_truth_keys, estimated_keys)
+
+    # run the evaluation algorithm
+    # ============================
+    print "\n...EVALUATING..."
+    print len(matched), "estimations matched with their ground truth."
+    report("ground-truth files without estimation (not evaluated)", missing)
+    report("estimations without ground truth (not evaluated)", extra)
+    if not matched:
+        sys.exit()
+
+    ground_truth_indexes = key_indexes(ground_truth_keys, matched)
+    estimation_indexes = key_indexes(estimated_keys, matched)
+    categories = mirex_categories(ground_truth_indexes, estimation_indexes)
+    scores = mirex_values[categories]
+
+    if verbose:
+        print "\nresults for individual songs:"
+        print "-----------------------------"
+        for i, name in enumerate(matched):
+            print "%03d" % (i + 1,), '- est:', estimated_keys[name].strip(), '\tgt:', ground_truth_keys[name].strip(), '\tScore:', scores[i], '\t', name
+
+    evaluation_results = mirex_evaluation(scores)
+
     if confusion_matrix:
-        xpos = (ground_truth[0] + (ground_truth[0] * 24)) + (-1 * (ground_truth[1] - 1) * 24 * 12)
-        ypos = ((estimation[0] - ground_truth[0]) + (-1 * (estimation[1] - 1) * 12))
-        matrix[(xpos + ypos)] = + matrix[(xpos + ypos)] + 1
-    ground_truth_file.close()
-    estimation_file.close()
-
-evaluation_results = mirex_evaluation(list_of_results)
-
-if confusion_matrix:
-    matrix = np.matrix(matrix)
-    matrix = matrix.reshape(24, 24)
-    print matrix
-    if results_to_file:
-        np.savetxt(estimations_route + '/_confusion_matrix.csv', matrix, fmt='%i', delimiter=',',
-                   header='C,C#,D,Eb,E,F,F#,G,G#,A,Bb,B,Cm,C#m,Dm,Ebm,Em,Fm,F#m,Gm,G#m,Am,Bbm,Bm')
+        matrix = np.matrix(key_confusion_matrix(ground_truth_indexes, estimation_indexes))
+        print matrix
+        if results_to_file:
+            np.savetxt(results_route + '/_confusion_matrix.csv', matrix, fmt='%i', delimiter=',',
+                       header='C,C#,D,Eb,E,F,F#,G,G#,A,Bb,B,Cm,C#m,Dm,Ebm,Em,Fm,F#m,Gm,G#m,Am,Bbm,Bm')
 
-results_for_file = "\nEVALUATION RESULTS\n==================\nCorrect: " + str(
-    evaluation_results[0]) + "\nFifth: " + str(evaluation_results[1]) + "\nRelative: " + str(
-    evaluation_results[2]) + "\nParallel: " + str(evaluation_results[3]) + "\nError: " + str(
-    evaluation_results[4]) + "\nWeighted: " + str(evaluation_results[5])
+    results_for_file = "\nEVALUATION RESULTS\n==================\nCorrect: " + str(
+        evaluation_results[0]) + "\nFifth: " + str(evaluation_results[1]) + "\nRelative: " + str(
+        evaluation_results[2]) + "\nParallel: " + str(evaluation_results[3]) + "\nError: " + str(
+        evaluation_results[4]) + "\nWeighted: " + str(evaluation_results[5]) + "\n\nMatched: " + str(
+        len(matched)) + "\nMissing estimations: " + str(len(missing)) + "\nExtra estimations: " + str(len(extra))
 
-writeResults = open(estimations_route + '/_EvaluationResults.txt', 'w')
-writeResults.write(results_for_file)
-writeResults.close()
+    if results_to_file:
+        writeResults = open(results_route + '/_EvaluationResults.txt', 'w')
+        writeResults.write(results_for_file)
+        writeResults.close()
@@ -8,8 +8,15 @@ analysis_mode = 'title' # {'txt', 'title'}
 if analysis_mode == 'title':
     collection     = ['KF100', 'KF1000', 'GSANG', 'ENDO100', 'DJTECHTOOLS60'] # ['KF100', 'KF1000', 'GSANG', 'ENDO100', 'DJTECHTOOLS60']
     genre          = ['edm'] # ['edm', 'non-edm']
-    modality       = ['major'] # ['major', 'minor']
+    modality       = ['major', 'minor'] # ['major', 'minor'] (both are needed to save the profiles)
     limit_analysis = 0 # Limit analysis to N random tracks. 0 = all samples matching above criteria.
+    corpus_manifest = False # select files from a manifest of the audio folder (see corpus_manifest.py).
+
+# OUTPUT
+# ======
+profiles_file        = 'extracted_profiles.txt' # read by Key through ESSENTIA_KEY_PROFILES (see key_tools.load_profiles).
+profile_name         = 'extracted' # profiles are saved as <name>_mean and <name>_median.
+plot_profiles        = False # save a plot of the profiles next to profiles_file.
 
 # ANALYSIS PARAMETERS
 # ===================
@@ -24,6 +31,12 @@ verbose              = True
 confusion_matrix     = True
 results_to_file      = True
 confidence_threshold = 1
+# performance
+num_workers          = 0 # number of worker processes (0 = one per cpu core, 1 = no pool).
+chroma_cache         = False # share the per-frame hpcp cache of key_detector.py.
+cache_folder         = '~/.edmkey_cache'
+cache_size           = 2048 # MB.
+histogram_bins       = 1000 # resolution of the streaming median.
 # global
 sample_rate          = 44100
 window_size          = 4096
@@ -81,20 +94,22 @@ else:
 # LOAD MODULES
 # ============
 import os
-import essentia as e
-import essentia.standard as estd
+from random import sample
 from key_tools import *
-import matplotlib.pyplot as plt
-""""
-# create directory to write the results with an unique time id:
-if results_to_file:
-    uniqueTime = str(int(tiempo()))
-    wd = os.getcwd()
-    temp_folder = wd + '/KeyDetection_'+uniqueTime
-    os.mkdir(temp_folder)
-"""
+import key_detector as kd
 # retrieve files and filenames according to the desired settings:
-if analysis_mode == 'title':
+if analysis_mode == 'title' and corpus_manifest:
+    from corpus_manifest import CorpusManifest
+    manifest = CorpusManifest(audio_folder)
+    manifest.refresh()
+    analysis_files = manifest.select(collection=collection, genre=genre, modality=modality)
+    song_instances = len(analysis_files)
+    print song_instances, 'songs matching the selected criteria:'
+    print collection, genre, modality
+    if 0 < limit_analysis < song_instances:
+        analysis_files = sample(analysis_files, limit_analysis)
+        print "taking", limit_analysis, "random samples...\n"
+elif analysis_mode == 'title':
     allfiles = os.listdir(audio_folder)
     if '.DS_Store' in allfiles: allfiles.remove('.DS_Store')
     for item in collection: collection[collection.index(item)] = ' > ' + item + '.'
@@ -125,90 +140,107 @@ else:
 
 # ANALYSIS
 # ========
-song_chromas = []
-for item in analysis_files:
-    loader = estd.MonoLoader(filename=audio_folder+'/'+item,
-    						 sampleRate=sample_rate)
-    cut    = estd.FrameCutter(frameSize=window_size,
-                              hopSize=hop_size)
-    window = estd.Windowing(size=window_size,
-                            type=window_type)
-    rfft   = estd.Spectrum(size=window_size)
-    sw     = estd.SpectralWhitening(maxFrequency=max_frequency,
-                                    sampleRate=sample_rate)
-    speaks = estd.SpectralPeaks(magnitudeThreshold=magnitude_threshold,
-                                maxFrequency=max_frequency,
-                                minFrequency=min_frequency,
-                                maxPeaks=max_peaks,
-                                sampleRate=sample_rate)
-    hpcp   = estd.HPCP(bandPreset=band_preset,
-                       harmonics=harmonics,
-                       maxFrequency=max_frequency,
-                       minFrequency=min_frequency,
-                       nonLinear=non_linear,
-                       normalized=normalize,
-                       referenceFrequency=reference_frequency,
-                       sampleRate=sample_rate,
-                       size=hpcp_size,
-                       splitFrequency=split_frequency,
-                       weightType=weight_type,
-                       windowSize=weight_window_size)
-    key = item[item.find(' = ')+3:item.rfind(' < ')]
-    key = key_to_list(key)
-    audio = loader()
-    duration = len(audio)
-    if first_n_secs > 0:
-        if duration > (first_n_secs * sample_rate):
-            audio = audio[:first_n_secs * sample_rate]
-            duration = len(audio)
-    if avoid_edges > 0:
-        initial_sample = (avoid_edges * duration) / 100
-        final_sample = duration - initial_sample
-        audio = audio[initial_sample:final_sample]
-        duration = len(audio)
-    number_of_frames = duration / hop_size
-    chroma = []
-    for bang in range(number_of_frames):
-        spek = rfft(window(cut(audio)))
-        p1, p2 = speaks(spek) # p1 are frequencies; p2 magnitudes
-        if spectral_whitening:
-            p2 = sw(spek, p1, p2)
-        chroma.append(hpcp(p1,p2))
-    chroma = np.mean(chroma, axis=0)
+# the per-frame hpcp is computed by key_detector with the settings above, so
+# that both scripts share the entries of the chroma cache.
+for name in ('sample_rate', 'window_size', 'jump_frames', 'hop_size', 'window_type',
+             'min_frequency', 'max_frequency', 'spectral_whitening', 'magnitude_threshold',
+             'max_peaks', 'band_preset', 'split_frequency', 'harmonics', 'non_linear',
+             'normalize', 'reference_frequency', 'hpcp_size', 'weight_type',
+             'weight_window_size', 'first_n_secs', 'avoid_edges', 'chroma_cache',
+             'cache_folder', 'cache_size'):
+    setattr(kd, name, globals()[name])
+kd.audio_folder = audio_folder
+kd.skip_first_minute = False
+kd.frame_selection = 'all'
+kd.streaming = False
+
+
+def annotated_key(item):
+    """returns the annotated key of a track as a list, or None."""
+    if analysis_mode == 'title':
+        return key_to_list(item[item.find(' = ')+3:item.rfind(' < ')])
+    filename_to_match = item[:item.rfind('.')] + '.txt'
+    if filename_to_match not in groundtruth_files:
+        return None
+    with open(groundtruth_folder + '/' + filename_to_match, 'r') as groundtruth_file:
+        return key_to_list(groundtruth_file.readline().replace('\t', ' '))
+
+
+def song_chroma(task):
+    """returns (mode, chroma starting on the tonic, duration in secs) of a
+    track, or None if it is silent."""
+    item, key = task
+    frames = np.asarray(kd.track_frames(item))
+    duration = len(frames) * hop_size / float(sample_rate)
+    frames = frames[np.sum(frames, axis=1) > 0]
+    if len(frames) == 0:
+        return None
+    chroma = np.mean(frames, axis=0)
+    if shift_spectrum:
+        chroma = shift_vector(chroma, hpcp_size)
     chroma = np.roll(chroma, tuning_resolution * ((key[0] - 9) % 12) * -1) # rotación
-    if weight_duration:
-	    chroma = chroma * duration # ponderar según duración de pista
-    song_chromas.append(chroma)
-
-
-
-hpcp_mean = np.median(song_chromas, axis=0) # mean or median??
-print "hpcp_mean:", hpcp_mean
-hpcp_std = np.std(song_chromas, axis=0)
-print "hpcp_std:", hpcp_std
-
-normfactor = np.sum(hpcp_mean)
-profile = np.divide(hpcp_mean, normfactor)
-print "potential profile", profile
-
-plt.plot(range(12),profile)
-plt.plot(range(12),hpcp_mean)
-plt.plot(range(12),hpcp_std)
-plt.ylim([0,0.5])
-plt.xlim([-0.5,12.5])
-plt.show()
-
-
-"""
-# reduce 36 to 12:
-simplified = []
-for i in range(len(m)):
-	n = i % 3
-	if n == 0:
-		simplified.append(m[i])
-
-plt.plot(range(12),simplified)
-plt.ylim([0,1])
-plt.xlim([-0.5,12.5])
-plt.show()
-"""
+    return key[1], chroma, duration
+
+
+tasks = []
+for item in analysis_files:
+    key = annotated_key(item)
+    if key is not None and key[0] < 12:  # tracks annotated 'none' have no tonic.
+        tasks.append((item, key))
+if num_workers == 1:
+    kd.init_worker()
+    analysis = (song_chroma(task) for task in tasks)
+else:
+    from multiprocessing import Pool, cpu_count
+    pool = Pool(num_workers or cpu_count(), kd.init_worker)
+    analysis = pool.imap_unordered(song_chroma, tasks, chunksize=4)
+# statistics are accumulated as tracks are analysed, separately for major
+# (mode 1) and minor (mode 0) keys.
+statistics = [ProfileStatistics(hpcp_size, histogram_bins) for mode in (0, 1)]
+tracks = [0, 0]
+for result in analysis:
+    if result is None:
+        continue
+    mode, chroma, duration = result
+    tracks[mode] += 1
+    statistics[mode].add(chroma, duration if weight_duration else 1.0) # ponderar según duración de pista
+if num_workers != 1:
+    pool.close()
+    pool.join()
+
+
+def twelve_bins(profile):
+    """keeps the bins on the tempered semitones, normalised to sum 1."""
+    profile = profile[::tuning_resolution]
+    return profile / max(np.sum(profile), 1e-12)
+
+
+print tracks[1], "major and", tracks[0], "minor tracks analysed."
+if 0 in tracks:
+    # an empty mode would be saved as a flat profile, whose correlation with
+    # any chroma is undefined (NaN) in Key.
+    print "ERROR! No", "minor" if tracks[0] == 0 else "major", "tracks were analysed: profiles not saved."
+    sys.exit(1)
+new_profiles = {}
+for statistic in ('mean', 'median'):
+    major, minor = [twelve_bins(getattr(statistics[mode], statistic)()) for mode in (1, 0)]
+    new_profiles[profile_name + '_' + statistic] = (major, minor)
+    print statistic, "major:", np.round(major, 4)
+    print statistic, "minor:", np.round(minor, 4)
+for mode, name in ((1, 'major'), (0, 'minor')):
+    print "std", name + ":", np.round(statistics[mode].std()[::tuning_resolution], 4)
+save_profiles(profiles_file, new_profiles)
+print "profiles saved to", profiles_file
+
+if plot_profiles:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    for mode, name in ((1, 'major'), (0, 'minor')):
+        plt.figure()
+        plt.plot(range(12), new_profiles[profile_name + '_median'][1 - mode], label='median')
+        plt.plot(range(12), new_profiles[profile_name + '_mean'][1 - mode], label='mean')
+        plt.plot(range(12), statistics[mode].std()[::tuning_resolution], label='std')
+        plt.xlim([-0.5, 11.5])
+        plt.legend()
+        plt.savefig(profiles_file[:profiles_file.rfind('.')] + '_' + name + '.png')
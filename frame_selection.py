@@ -0,0 +1,206 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Frame selection for key estimation.
+
+Instead of decoding a whole track and analysing every hop_size samples,
+a selection strategy chooses which frames to analyse, and only those are
+read from the file (seeking into it) and passed to the front-end:
+
+'strided'  every jump_frames-th frame, as a hop of window_size * jump_frames.
+'random'   frames separated by a random number of frames in random_frames.
+'energy'   the frames with the highest energy.
+'onset'    frames starting at the strongest energy onsets (or 'strided'
+           frames, if the energy never rises).
+
+Frames are counted on a grid of non-overlapping frames of window_size,
+the first one centred on the first sample, as essentia's FrameCutter does.
+A budget (fraction of the frames in the grid) sets how many frames are
+analysed; without one, 1 / jump_frames of the frames are.
+
+PCM wav files at the analysis sample rate are read directly; any other
+file is decoded with the given loader, and frames are sliced from it.
+"""
+
+import wave
+import zlib
+import numpy as np
+
+strategies = ('strided', 'random', 'energy', 'onset')
+
+ONSET_HOP = 512  # samples between the values of the onset energy envelope.
+
+
+class ArrayReader(object):
+    """random access to the samples of a decoded signal."""
+
+    def __init__(self, audio):
+        self.audio = np.asarray(audio, dtype=np.float32)
+        self.duration = len(self.audio)
+
+    def read(self, start, length):
+        """returns length samples from start, padded with zeros outside."""
+        samples = np.zeros(length, dtype=np.float32)
+        first = max(start, 0)
+        last = min(start + length, self.duration)
+        if last > first:
+            samples[first - start:last - start] = self.audio[first:last]
+        return samples
+
+    def close(self):
+        pass
+
+
+class WavReader(object):
+    """random access to the samples of a PCM wav file: every read seeks into
+    the file and decodes only the requested samples, mixed down to mono."""
+
+    def __init__(self, filename):
+        self.file = wave.open(filename, 'rb')
+        self.channels = self.file.getnchannels()
+        self.sample_width = self.file.getsampwidth()
+        self.sample_rate = self.file.getframerate()
+        self.duration = self.file.getnframes()
+
+    def read(self, start, length):
+        samples = np.zeros(length, dtype=np.float32)
+        first = max(start, 0)
+        last = min(start + length, self.duration)
+        if last > first:
+            self.file.setpos(first)
+            samples[first - start:last - start] = self.decode(self.file.readframes(last - first))
+        return samples
+
+    def decode(self, data):
+        width = self.sample_width
+        if width == 1:
+            values = np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128
+        elif width == 3:
+            raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            values = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) |
+                      (raw[:, 2].astype(np.int8).astype(np.int32) << 16)).astype(np.float32)
+        else:
+            values = np.frombuffer(data, dtype='<i%d' % width).astype(np.float32)
+        values /= 2 ** (8 * width - 1)
+        return values.reshape(-1, self.channels).mean(axis=1)
+
+    def close(self):
+        self.file.close()
+
+
+def open_reader(filename, sample_rate, loader):
+    """returns a WavReader when the file can be read directly at sample_rate,
+    or an ArrayReader over the signal decoded by loader(filename)."""
+    if filename.lower().endswith('.wav'):
+        try:
+            reader = WavReader(filename)
+        except (wave.Error, EOFError, IOError):
+            pass
+        else:
+            if reader.sample_rate == sample_rate and reader.sample_width in (1, 2, 3, 4):
+                return reader
+            reader.close()
+    return ArrayReader(loader(filename))
+
+
+def analysis_range(duration, sample_rate, skip_first_minute=False,
+                   first_n_secs=0, avoid_edges=0):
+    """returns the (start, end) samples to analyse, applying the trimming
+    options of key_detector in the same order."""
+    start, end = 0, duration
+    if skip_first_minute and duration > sample_rate * 60:
+        start += sample_rate * 60
+    if first_n_secs > 0 and end - start > first_n_secs * sample_rate:
+        end = start + int(first_n_secs * sample_rate)
+    if avoid_edges > 0:
+        edge = (avoid_edges * (end - start)) / 100
+        start, end = start + edge, end - edge
+    return start, end
+
+
+def frame_count(budget, jump_frames, candidates):
+    """number of frames to analyse out of the candidates in the grid."""
+    if budget > 0:
+        return max(1, min(candidates, int(round(budget * candidates))))
+    return (candidates + jump_frames - 1) / jump_frames
+
+
+def frame_energies(reader, start, window_size, candidates):
+    """energy of every frame in the grid, read one frame at a time."""
+    half = window_size / 2
+    return np.array([np.sum(reader.read(start + k * window_size - half, window_size) ** 2)
+                     for k in range(candidates)])
+
+
+def onset_positions(reader, start, end, window_size, count):
+    """returns the first samples of up to count frames starting at the
+    strongest increases of the energy envelope, at least window_size apart."""
+    envelope = []
+    block = ONSET_HOP * 256
+    for position in range(start, end, block):
+        samples = reader.read(position, min(block, end - position))
+        samples = samples[:len(samples) / ONSET_HOP * ONSET_HOP].reshape(-1, ONSET_HOP)
+        envelope.append(np.log10(np.sum(samples ** 2, axis=1) + 1e-10))
+    envelope = np.concatenate(envelope) if envelope else np.zeros(0)
+    novelty = np.maximum(np.diff(envelope), 0)
+    distance = window_size / ONSET_HOP
+    taken = np.zeros(len(novelty), dtype=bool)
+    onsets = []
+    for index in np.argsort(-novelty, kind='mergesort'):
+        if len(onsets) == count or novelty[index] <= 0:
+            break
+        if not taken[index]:
+            onsets.append(start + (index + 1) * ONSET_HOP)
+            taken[max(index - distance + 1, 0):index + distance] = True
+    return sorted(onsets)
+
+
+def select_frames(reader, strategy, start, end, window_size=4096, jump_frames=4,
+                  random_frames=(1, 5), budget=0, seed=0):
+    """returns the centre samples of the frames to analyse between start
+    and end, according to the selection strategy."""
+    candidates = (end - start) / window_size
+    if candidates <= 0:
+        return []
+    count = frame_count(budget, jump_frames, candidates)
+    if strategy == 'strided':
+        if budget > 0:
+            indexes = (np.arange(count) * (candidates / float(count))).astype(int)
+        else:  # the same frames as a hop of window_size * jump_frames.
+            indexes = np.arange((end - start) / (window_size * jump_frames)) * jump_frames
+    elif strategy == 'random':
+        generator = np.random.RandomState(seed)
+        if budget > 0:
+            indexes = np.sort(generator.choice(candidates, count, replace=False))
+        else:
+            gaps = generator.randint(random_frames[0], random_frames[1] + 1, candidates)
+            indexes = np.cumsum(gaps) - gaps[0]
+            indexes = indexes[indexes < candidates]
+    elif strategy == 'energy':
+        energies = frame_energies(reader, start, window_size, candidates)
+        indexes = np.sort(np.argsort(-energies, kind='mergesort')[:count])
+    elif strategy == 'onset':
+        onsets = onset_positions(reader, start, end, window_size, count)
+        if not onsets:  # a flat envelope has no onsets.
+            return select_frames(reader, 'strided', start, end, window_size,
+                                 jump_frames, random_frames, budget, seed)
+        return [onset + window_size / 2 for onset in onsets]
+    else:
+        raise ValueError("frame_selection must be one of: " + ', '.join(strategies))
+    return [start + index * window_size for index in indexes]
+
+
+def read_frames(reader, positions, window_size=4096):
+    """returns a (len(positions) x window_size) matrix with the frames
+    centred on the given samples."""
+    frames = np.zeros((len(positions), window_size), dtype=np.float32)
+    half = window_size / 2
+    for row, position in enumerate(positions):
+        frames[row] = reader.read(position - half, window_size)
+    return frames
+
+
+def seed_for(filename):
+    """a reproducible seed for the random strategy of each file."""
+    return zlib.crc32(filename) & 0xffffffff
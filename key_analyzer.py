@@ -0,0 +1,240 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Reusable analysis chain for key estimation.
+
+A KeyAnalyzer instantiates and configures the essentia algorithms once,
+so that the same chain can be applied to any number of tracks. Only the
+audio loader is reconfigured for every new file.
+
+With front_end='numpy' the hpcp of all frames is computed at once by the
+vectorized front-end in batch_hpcp, instead of frame by frame in essentia.
+stream_hpcp_frames() runs the same chain as an essentia.streaming network,
+so that the audio of long files is never loaded into memory at once (the
+hpcp of every frame still is, hpcp_size values per hop).
+frames_hpcp() analyses frames chosen by frame_selection instead.
+"""
+
+import numpy as np
+import essentia as e
+import essentia.standard as estd
+import essentia.streaming as estr
+import batch_hpcp
+
+
+def key_algorithm(hpcp_size=36, profile_type='edmm', use_three_chords=False,
+                  use_polyphony=False, num_harmonics=15, slope=0.2):
+    """instantiates an essentia Key algorithm with the given configuration."""
+    return estd.Key(numHarmonics=num_harmonics,
+                    pcpSize=hpcp_size,
+                    profileType=profile_type,
+                    slope=slope,
+                    usePolyphony=use_polyphony,
+                    useThreeChords=use_three_chords)
+
+
+class KeyAnalyzer(object):
+    """owns a configured essentia chain (FrameCutter, Windowing, Spectrum,
+    SpectralWhitening, SpectralPeaks, HPCP and Key) built once per process.
+    Call reset() between tracks."""
+
+    def __init__(self,
+                 sample_rate=44100,
+                 window_size=4096,
+                 hop_size=16384,
+                 window_type='hann',
+                 min_frequency=25,
+                 max_frequency=3500,
+                 spectral_whitening=True,
+                 magnitude_threshold=0.0001,
+                 max_peaks=60,
+                 band_preset=False,
+                 split_frequency=250,
+                 harmonics=4,
+                 non_linear=True,
+                 normalize=True,
+                 reference_frequency=440,
+                 hpcp_size=36,
+                 weight_type='squaredCosine',
+                 weight_window_size=1,
+                 profile_type='edmm',
+                 use_three_chords=False,
+                 use_polyphony=False,
+                 num_harmonics=15,
+                 slope=0.2,
+                 front_end='essentia'):
+        if front_end not in ('essentia', 'numpy'):
+            raise ValueError("front_end must be set to 'essentia' or 'numpy'")
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.spectral_whitening = spectral_whitening
+        self.hpcp_size = hpcp_size
+        self.front_end = front_end
+        self.front_end_settings = dict(sample_rate=sample_rate,
+                                       window_size=window_size,
+                                       hop_size=hop_size,
+                                       window_type=window_type,
+                                       min_frequency=min_frequency,
+                                       max_frequency=max_frequency,
+                                       spectral_whitening=spectral_whitening,
+                                       magnitude_threshold=magnitude_threshold,
+                                       max_peaks=max_peaks,
+                                       band_preset=band_preset,
+                                       split_frequency=split_frequency,
+                                       harmonics=harmonics,
+                                       non_linear=non_linear,
+                                       normalize=normalize,
+                                       reference_frequency=reference_frequency,
+                                       hpcp_size=hpcp_size,
+                                       weight_type=weight_type,
+                                       weight_window_size=weight_window_size)
+        self.loader = None
+        self.network = None
+        self.cut = estd.FrameCutter(frameSize=window_size,
+                                    hopSize=hop_size)
+        self.window = estd.Windowing(size=window_size,
+                                     type=window_type)
+        self.rfft = estd.Spectrum(size=window_size)
+        self.sw = estd.SpectralWhitening(maxFrequency=max_frequency,
+                                         sampleRate=sample_rate)
+        self.speaks = estd.SpectralPeaks(magnitudeThreshold=magnitude_threshold,
+                                         maxFrequency=max_frequency,
+                                         minFrequency=min_frequency,
+                                         maxPeaks=max_peaks,
+                                         sampleRate=sample_rate)
+        self.hpcp_settings = dict(bandPreset=band_preset,
+                                  harmonics=harmonics,
+                                  maxFrequency=max_frequency,
+                                  minFrequency=min_frequency,
+                                  nonLinear=non_linear,
+                                  normalized=normalize,
+                                  referenceFrequency=reference_frequency,
+                                  sampleRate=sample_rate,
+                                  size=hpcp_size,
+                                  splitFrequency=split_frequency,
+                                  weightType=weight_type,
+                                  windowSize=weight_window_size)
+        self.hpcp = estd.HPCP(**self.hpcp_settings)
+        self.key_algorithm = key_algorithm(hpcp_size=hpcp_size,
+                                           profile_type=profile_type,
+                                           use_three_chords=use_three_chords,
+                                           use_polyphony=use_polyphony,
+                                           num_harmonics=num_harmonics,
+                                           slope=slope)
+
+    def reset(self):
+        """clears the internal state left by the previous track (i.e. the
+        position of the frame cutter) without reconfiguring anything."""
+        for algorithm in (self.cut, self.window, self.rfft, self.sw,
+                          self.speaks, self.hpcp, self.key_algorithm):
+            algorithm.reset()
+        if self.loader is not None:
+            self.loader.reset()
+
+    def tune(self, reference_frequency):
+        """sets the reference frequency of the hpcp, e.g. to the tuning of the
+        next track (see tuning.py). Every parameter is given again, as
+        configure() resets those left out to their defaults."""
+        if reference_frequency == self.front_end_settings['reference_frequency']:
+            return
+        self.hpcp_settings['referenceFrequency'] = reference_frequency
+        self.hpcp.configure(**self.hpcp_settings)
+        if self.network is not None:
+            # the streaming network is kept; only its HPCP is reconfigured.
+            self.network[2].configure(**self.hpcp_settings)
+        self.front_end_settings['reference_frequency'] = reference_frequency
+
+    def load(self, filename):
+        """decodes an audio file into a mono signal, reconfiguring the loader
+        instead of creating a new one."""
+        if self.loader is None:
+            self.loader = estd.MonoLoader(filename=filename,
+                                          sampleRate=self.sample_rate)
+        else:
+            self.loader.configure(filename=filename,
+                                  sampleRate=self.sample_rate)
+        return self.loader()
+
+    def hpcp_frame(self, frame):
+        """returns the hpcp of a single audio frame of window_size samples."""
+        spek = self.rfft(self.window(frame))
+        p1, p2 = self.speaks(spek)  # p1 are frequencies; p2 magnitudes
+        if self.spectral_whitening:
+            p2 = self.sw(spek, p1, p2)
+        return self.hpcp(p1, p2)
+
+    def hpcp_frames(self, audio):
+        """returns the hpcp of every frame in the audio signal."""
+        if self.front_end == 'numpy':
+            return batch_hpcp.hpcp_frames(audio, **self.front_end_settings)
+        self.cut.reset()
+        number_of_frames = len(audio) / self.hop_size
+        return [self.hpcp_frame(self.cut(audio)) for bang in range(number_of_frames)]
+
+    def frames_hpcp(self, frames):
+        """returns the hpcp of every row of a matrix of audio frames of
+        window_size samples, such as those returned by frame_selection."""
+        if self.front_end == 'numpy':
+            return batch_hpcp.frames_hpcp(frames, **self.front_end_settings)
+        return [self.hpcp_frame(frame) for frame in frames]
+
+    def streaming_network(self, filename):
+        """builds the essentia.streaming network (MonoLoader -> FrameCutter ->
+        Windowing -> Spectrum -> SpectralPeaks -> SpectralWhitening -> HPCP),
+        whose hpcp frames are stored in a pool. Returns the loader, the pool
+        and the HPCP, which tune() reconfigures. Only hpcp_size values per
+        frame are kept; the audio is decoded and analysed chunk by chunk."""
+        settings = self.front_end_settings
+        loader = estr.MonoLoader(filename=filename, sampleRate=self.sample_rate)
+        cut = estr.FrameCutter(frameSize=self.window_size,
+                               hopSize=self.hop_size)
+        window = estr.Windowing(size=self.window_size,
+                                type=settings['window_type'])
+        rfft = estr.Spectrum(size=self.window_size)
+        speaks = estr.SpectralPeaks(magnitudeThreshold=settings['magnitude_threshold'],
+                                    maxFrequency=settings['max_frequency'],
+                                    minFrequency=settings['min_frequency'],
+                                    maxPeaks=settings['max_peaks'],
+                                    sampleRate=self.sample_rate)
+        hpcp = estr.HPCP(**self.hpcp_settings)
+        pool = e.Pool()
+        loader.audio >> cut.signal
+        cut.frame >> window.frame >> rfft.frame
+        rfft.spectrum >> speaks.spectrum
+        speaks.frequencies >> hpcp.frequencies
+        if self.spectral_whitening:
+            sw = estr.SpectralWhitening(maxFrequency=settings['max_frequency'],
+                                        sampleRate=self.sample_rate)
+            rfft.spectrum >> sw.spectrum
+            speaks.frequencies >> sw.frequencies
+            speaks.magnitudes >> sw.magnitudes
+            sw.magnitudes >> hpcp.magnitudes
+        else:
+            speaks.magnitudes >> hpcp.magnitudes
+        hpcp.hpcp >> (pool, 'tonal.hpcp')
+        return loader, pool, hpcp
+
+    def stream_hpcp_frames(self, filename):
+        """returns the hpcp of every frame of an audio file, computed by the
+        streaming network, which is built once and reused for every file.
+        The matrix grows with the duration of the file."""
+        if self.network is None:
+            self.network = self.streaming_network(filename)
+            loader, pool, hpcp = self.network
+        else:
+            loader, pool, hpcp = self.network
+            pool.clear()
+            loader.configure(filename=filename, sampleRate=self.sample_rate)
+            e.reset(loader)
+        e.run(loader)
+        if 'tonal.hpcp' not in pool.descriptorNames():
+            return np.zeros((0, self.hpcp_size), dtype=np.float32)
+        return pool['tonal.hpcp']
+
+    def key(self, chroma, algorithm=None):
+        """estimates the key of a chroma vector. Returns a tuple with
+        (key, scale, strength, first to second relative strength).
+        A different Key algorithm (see key_algorithm()) can be given."""
+        return (algorithm or self.key_algorithm)(list(chroma))
@@ -72,19 +72,44 @@ skip_first_minute    = False
 spectral_whitening   = True
 shift_spectrum       = True
 shift_scope          = 'average'  # ['average', 'frame']
+tuning_prepass       = False  # set the hpcp reference frequency to the tuning of every track (shift_spectrum can then be False). with streaming, only wav files at sample_rate are not decoded whole.
+tuning_frames        = 64  # frames whose spectral peaks are used by tuning_prepass.
+shift_method         = 'peak'  # {'peak', 'centroid'} whole-bin roll or sub-bin tuning (see key_tools.shift_vectors).
+front_end            = 'essentia'  # {'essentia', 'numpy'} numpy computes all frames at once.
+streaming            = False  # decode and analyse with essentia.streaming (the audio is never held in memory; the hpcp of every frame is).
+chroma_cache         = False  # reuse per-frame hpcp computed with the same front-end settings.
+cache_folder         = '~/.edmkey_cache'
+cache_size           = 2048  # MB. least recently used entries are deleted beyond this size.
+incremental          = False  # only analyse tracks new or modified since the last run with the same settings.
+state_database       = ''  # sqlite file of the incremental runs ('' = analysis_state.db in cache_folder).
+corpus_manifest      = False  # in 'title' mode, select files from a manifest of audio_folder kept in cache_folder.
 
 # print and verbose:
 verbose              = True
 confusion_matrix     = True
 results_to_file      = False
 results_to_csv       = False
+results_folder       = ''  # where results are written ('' = a new KeyDetection_<time> folder).
+results_format       = 'txt'  # {'txt', 'store'} 'store' appends all results to a columnar store (see results_store.py).
 confidence_threshold = 1
+# parallel processing:
+parallel             = False
+num_workers          = 0  # number of worker processes (0 = one per cpu core).
 # global:
 sample_rate          = 44100
 window_size          = 4096
 jump_frames          = 4  # 1 = analyse every frame; 2 = analyse every other frame; etc.
 random_frames        = [1, 5]  # range of random generator for analysing frames...
 hop_size             = window_size * jump_frames
+frame_selection      = 'all'  # {'all', 'strided', 'random', 'energy', 'onset'} only the selected frames are read and analysed.
+frame_budget         = 0  # fraction of frames analysed by frame_selection (0 = 1 / jump_frames).
+early_exit           = False  # stop reading a track once its key estimation is stable.
+check_every          = 8  # frames read between key estimations if early_exit.
+stable_checks        = 4  # consecutive estimations with the same key needed to stop.
+stable_tolerance     = 0.05  # max variation of their first to second relative strength.
+key_tracking         = False  # estimate keys over a sliding window; the global key is the longest one (not with early_exit).
+tracking_window      = 20  # secs of audio in the sliding window.
+tracking_hysteresis  = 3  # consecutive estimations of a new key needed to start a segment.
 window_type          = 'hann'
 min_frequency        = 25
 max_frequency        = 3500
@@ -107,6 +132,9 @@ use_three_chords     = False  # BEWARE: False executes the extra code including
 use_polyphony        = False
 num_harmonics        = 15   # when use_polyphony == True
 slope                = 0.2  # when use_polyphony == True
+# several key detector configurations can be evaluated in a single pass,
+# sharing the same chroma. Each dict overrides some of the settings above:
+key_configurations   = []  # e.g. [{'profile_type': 'edmm'}, {'profile_type': 'krumhansl', 'use_polyphony': True}]
 
 # ////////////////////////////////////////////////////////////////////////////
 
@@ -116,36 +144,427 @@ import sys, os, re
 import essentia as e
 import essentia.standard as estd
 from key_tools import *
+from key_analyzer import KeyAnalyzer, key_algorithm
+from chroma_cache import ChromaCache
+from frame_selection import ArrayReader, open_reader, analysis_range, select_frames, read_frames, seed_for
+from tuning import reader_tuning, tuned_reference
+from key_tracker import KeyTracker, global_key
+from results_store import ResultsWriter
+from analysis_state import AnalysisState
 from random import sample, randint
 from time import time as tiempo
-from time import clock as reloj
+
+
+def analyzer_settings():
+    """collects the global settings that configure the analysis chain."""
+    return dict(sample_rate=sample_rate,
+                window_size=window_size,
+                hop_size=hop_size,
+                window_type=window_type,
+                min_frequency=min_frequency,
+                max_frequency=max_frequency,
+                spectral_whitening=spectral_whitening,
+                magnitude_threshold=magnitude_threshold,
+                max_peaks=max_peaks,
+                band_preset=band_preset,
+                split_frequency=split_frequency,
+                harmonics=harmonics,
+                non_linear=non_linear,
+                normalize=normalize,
+                reference_frequency=reference_frequency,
+                hpcp_size=hpcp_size,
+                weight_type=weight_type,
+                weight_window_size=weight_window_size,
+                profile_type=profile_type,
+                use_three_chords=use_three_chords,
+                use_polyphony=use_polyphony,
+                num_harmonics=num_harmonics,
+                slope=slope,
+                front_end=front_end)
+
+
+def configurations():
+    """returns the list of key detector configurations to evaluate."""
+    default = dict(profile_type=profile_type,
+                   use_three_chords=use_three_chords,
+                   use_polyphony=use_polyphony,
+                   num_harmonics=num_harmonics,
+                   slope=slope)
+    if not key_configurations:
+        return [default]
+    # repeated configurations are evaluated once, as they would write their
+    # results to the same folder.
+    unique = []
+    for configuration in key_configurations:
+        configuration = dict(default, **configuration)
+        if configuration_name(configuration) not in [configuration_name(known) for known in unique]:
+            unique.append(configuration)
+    return unique
+
+
+def configuration_name(configuration):
+    """short name identifying a key detector configuration."""
+    return '%s_poly%d_3ch%d_h%d_s%s' % (configuration['profile_type'],
+                                        configuration['use_polyphony'],
+                                        configuration['use_three_chords'],
+                                        configuration['num_harmonics'],
+                                        configuration['slope'])
+
+
+def settings_hash(configuration):
+    """identifies the settings with which a key configuration is evaluated:
+    those of the chroma cache (front_end_settings()) plus every setting of
+    the key stage, early_exit and key_tracking used by analyse_track."""
+    import hashlib, json
+    settings = dict(front_end_settings(),
+                    shift_spectrum=shift_spectrum,
+                    shift_scope=shift_scope,
+                    shift_method=shift_method,
+                    early_exit=early_exit,
+                    check_every=check_every,
+                    stable_checks=stable_checks,
+                    stable_tolerance=stable_tolerance,
+                    key_tracking=key_tracking,
+                    tracking_window=tracking_window,
+                    tracking_hysteresis=tracking_hysteresis,
+                    **configuration)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
+
+
+def init_worker():
+    """builds the analysis chain once per process, so that it can be
+    reused for all the tracks analysed by that process."""
+    global analyzer, key_algorithms, cache
+    analyzer = KeyAnalyzer(**analyzer_settings())
+    key_algorithms = [key_algorithm(hpcp_size=hpcp_size, **configuration)
+                      for configuration in configurations()]
+    if chroma_cache:
+        cache = ChromaCache(cache_folder, cache_size)
+
+
+KEY_PARAMETERS = ('profile_type', 'use_three_chords', 'use_polyphony', 'num_harmonics', 'slope')
+
+
+def front_end_settings():
+    """settings that determine the per-frame hpcp of a track. They are taken
+    from the globals, not from the analyzer, which may be tuned to the last
+    track and does not exist in the main process of a parallel run."""
+    return dict(((name, value) for name, value in analyzer_settings().items()
+                 if name not in KEY_PARAMETERS),
+                jump_frames=jump_frames,
+                front_end=front_end,
+                streaming=streaming,
+                skip_first_minute=skip_first_minute,
+                first_n_secs=first_n_secs,
+                avoid_edges=avoid_edges,
+                frame_selection=frame_selection,
+                frame_budget=frame_budget,
+                random_frames=random_frames,
+                tuning_prepass=tuning_prepass,
+                tuning_frames=tuning_frames)
+
+
+def trim_frames(frames):
+    """applies skip_first_minute, first_n_secs and avoid_edges to a sequence
+    of frames, for the streaming mode, in which the audio is never stored."""
+    frames_per_sec = sample_rate / float(hop_size)
+    if skip_first_minute and len(frames) > frames_per_sec*60:
+        frames = frames[int(frames_per_sec*60):]
+    if first_n_secs > 0:
+        frames = frames[:int(first_n_secs * frames_per_sec)]
+    if avoid_edges > 0:
+        initial_frame = (avoid_edges * len(frames)) / 100
+        frames = frames[initial_frame:len(frames)-initial_frame]
+    return frames
+
+
+def tune_track(reader):
+    """sets the hpcp reference frequency of the analyzer to the tuning of a
+    track, estimated from tuning_frames of its frames. Returns the deviation
+    in cents."""
+    deviation = reader_tuning(reader, tuning_frames, window_size, sample_rate,
+                              skip_first_minute, first_n_secs, avoid_edges,
+                              window_type=window_type,
+                              min_frequency=min_frequency,
+                              max_frequency=max_frequency,
+                              max_peaks=max_peaks,
+                              magnitude_threshold=magnitude_threshold,
+                              reference_frequency=reference_frequency)
+    analyzer.tune(tuned_reference(deviation, reference_frequency))
+    return deviation
+
+
+def selected_frames(filename):
+    """returns the hpcp of the frames chosen by frame_selection and their
+    centre samples. Only those frames are read from the file (wav files are
+    not decoded entirely)."""
+    reader = open_reader(filename, sample_rate, analyzer.load)
+    try:
+        if tuning_prepass:
+            tune_track(reader)
+        start, end = analysis_range(reader.duration, sample_rate, skip_first_minute,
+                                    first_n_secs, avoid_edges)
+        positions = select_frames(reader, frame_selection, start, end, window_size,
+                                  jump_frames, random_frames, frame_budget,
+                                  seed_for(os.path.basename(filename)))
+        frames = read_frames(reader, positions, window_size)
+    finally:
+        reader.close()
+    return analyzer.frames_hpcp(frames), positions
+
+
+def track_frames(item, with_times=False):
+    """returns the per-frame hpcp of a file in audio_folder, reading it
+    from the chroma cache when it has already been computed. If with_times
+    is True, returns a tuple with the hpcp and the position of every frame
+    in the track, in secs."""
+    filename = audio_folder+'/'+item
+    if chroma_cache:
+        cache_key = cache.key(filename, front_end_settings())
+        times_key = cache.key(filename, dict(front_end_settings(), frame_times=True))
+        frames = cache.get(cache_key)
+        times = cache.get(times_key) if with_times else None
+        if frames is not None and (times is not None or not with_times):
+            return (frames, times) if with_times else frames
+    if streaming:
+        if tuning_prepass:
+            # only wav files at sample_rate are read frame by frame: any other
+            # file is decoded whole for the pre-pass, and then streamed again.
+            reader = open_reader(filename, sample_rate, analyzer.load)
+            tune_track(reader)
+            reader.close()
+        frames = analyzer.stream_hpcp_frames(filename)
+        # the frames kept are those of the hop grid from the start of the track.
+        times = trim_frames(np.arange(len(frames))) * hop_size / float(sample_rate)
+        frames = trim_frames(frames)
+    elif frame_selection != 'all':
+        analyzer.reset()
+        frames, positions = selected_frames(filename)
+        times = np.array(positions) / float(sample_rate)
+    else:
+        analyzer.reset()
+        audio = analyzer.load(filename)
+        if tuning_prepass:
+            tune_track(ArrayReader(audio))
+        duration = len(audio)
+        offset = 0  # first sample analysed.
+        if skip_first_minute and duration > (sample_rate*60):
+            audio = audio[sample_rate*60:]
+            offset = sample_rate*60
+            duration = len(audio)
+        if first_n_secs > 0:
+            if duration > (first_n_secs * sample_rate):
+                audio = audio[:first_n_secs * sample_rate]
+                duration = len(audio)
+        if avoid_edges > 0:
+            initial_sample = (avoid_edges * duration) / 100
+            final_sample = duration - initial_sample
+            audio = audio[initial_sample:final_sample]
+            offset += initial_sample
+            duration = len(audio)
+        frames = analyzer.hpcp_frames(audio)
+        times = (offset + np.arange(len(frames)) * hop_size) / float(sample_rate)
+    if chroma_cache:
+        cache.put(cache_key, frames)
+        cache.put(times_key, times)
+    return (frames, times) if with_times else frames
+
+
+def add_frame(chroma, vector, shift=True):
+    """adds an hpcp frame to a running chroma sum, shifting it to the
+    tempered scale if shift_scope is 'frame' (unless shift is False, for
+    frames already shifted). Returns the number of frames added (silent
+    frames are skipped)."""
+    if np.sum(vector) <= 0:
+        return 0
+    if shift_spectrum == False or shift_scope == 'average' or not shift:
+        chroma += vector
+    elif shift_spectrum and shift_scope == 'frame':
+        chroma += shift_vectors(vector, hpcp_size, shift_method)[0]
+    else:
+        print "shift_scope must be set to 'frame' or 'average'"
+        return 0
+    return 1
+
+
+def track_chroma(chroma, number_of_frames):
+    """returns the mean of a running chroma sum, shifted to the tempered
+    scale if shift_scope is 'average'."""
+    chroma = np.divide(chroma, number_of_frames)
+    if shift_spectrum and shift_scope == 'average':
+        chroma = shift_vectors(chroma, hpcp_size, shift_method)[0]
+    return chroma
+
+
+def early_exit_chroma(item):
+    """accumulates the chroma of a track from its beginning, check_every
+    frames at a time, and stops reading the file once the estimation of the
+    first key configuration has been stable for stable_checks consecutive
+    checks. Returns (chroma sum, frames added, frames read, frames available)."""
+    filename = audio_folder+'/'+item
+    analyzer.reset()
+    reader = open_reader(filename, sample_rate, analyzer.load)
+    chroma = np.zeros(hpcp_size)
+    number_of_frames = 0
+    frames_read = 0
+    history = []
+    try:
+        if tuning_prepass:
+            tune_track(reader)
+        start, end = analysis_range(reader.duration, sample_rate, skip_first_minute,
+                                    first_n_secs, avoid_edges)
+        strategy = 'strided' if frame_selection == 'all' else frame_selection
+        positions = select_frames(reader, strategy, start, end, window_size,
+                                  jump_frames, random_frames, frame_budget,
+                                  seed_for(item))
+        for block in range(0, len(positions), check_every):
+            frames = read_frames(reader, positions[block:block+check_every], window_size)
+            for vector in analyzer.frames_hpcp(frames):
+                number_of_frames += add_frame(chroma, vector)
+            frames_read += len(frames)
+            if number_of_frames == 0:
+                continue
+            estimation = analyzer.key(track_chroma(chroma, number_of_frames), key_algorithms[0])
+            history.append((estimation[0] + ' ' + estimation[1], estimation[3]))
+            recent = history[-stable_checks:]
+            if len(recent) == stable_checks and len(set(key for key, relative in recent)) == 1:
+                relative_strengths = [relative for key, relative in recent]
+                if max(relative_strengths) - min(relative_strengths) <= stable_tolerance:
+                    break
+    finally:
+        reader.close()
+    return chroma, number_of_frames, frames_read, len(positions)
+
+
+def key_trackers():
+    """returns a KeyTracker per key configuration."""
+    window_frames = int(round(tracking_window * sample_rate / float(hop_size)))
+    shift = None
+    if shift_spectrum and shift_scope == 'average':
+        shift = lambda chroma: shift_vectors(chroma, hpcp_size, shift_method)[0]
+    return [KeyTracker(lambda chroma, algorithm=algorithm: analyzer.key(chroma, algorithm),
+                       window_frames, hpcp_size, hop_size / float(sample_rate),
+                       tracking_hysteresis, shift=shift)
+            for algorithm in key_algorithms]
+
+
+def analyse_track(item):
+    """estimates the key of a single file in audio_folder and returns
+    a tuple with (filename, chroma, estimations, frames, segments), where
+    estimations is a list of (estimation, confidence) pairs, one per key
+    configuration, frames is a tuple with the frames read, the frames
+    available and the secs spent analysing the track, and segments a list of (start, end, key, confidence) tuples
+    per configuration if key_tracking is True.
+    With key_tracking, the estimation of every configuration is the key
+    lasting longest, and its confidence the fraction of time in that key.
+    Tracks without voiced frames are estimated as 'none', which is scored
+    as an error."""
+    start_time = tiempo()
+    trackers = []
+    if early_exit:
+        chroma, number_of_frames, frames_read, frames_available = early_exit_chroma(item)
+    else:
+        # the chroma is accumulated as a running sum of the hpcp frames of the
+        # track, which track_frames returns as a matrix.
+        chroma = np.zeros(hpcp_size)
+        number_of_frames = 0
+        frames_read = 0
+        if key_tracking:
+            trackers = key_trackers()
+            # segments are timed with the position of every frame, which
+            # frame_selection and the trimming options move.
+            frames, times = track_frames(item, with_times=True)
+        else:
+            frames = track_frames(item)
+            times = None
+        if shift_spectrum and shift_scope == 'frame' and len(frames) > 0:
+            # all the frames of the track are shifted in a single call.
+            frames = shift_vectors(frames, hpcp_size, shift_method)
+        for i, vector in enumerate(frames):
+            number_of_frames += add_frame(chroma, vector, shift=False)
+            frames_read += 1
+            for tracker in trackers:
+                tracker.add(vector, times[i])
+        frames_available = frames_read
+    if number_of_frames == 0:
+        if verbose:
+            print item, '|| no voiced frames, the key cannot be estimated.'
+        estimations = [('none', 0.0) for algorithm in key_algorithms]
+        segments = [[] for tracker in trackers]
+        return item, chroma, estimations, (frames_read, frames_available, tiempo() - start_time), segments
+    chroma = track_chroma(chroma, number_of_frames)
+    estimations = []
+    segments = []
+    for c, algorithm in enumerate(key_algorithms):
+        if trackers:
+            segments.append(trackers[c].finish())
+            key, duration = global_key(segments[c])
+            if key is not None:
+                estimations.append((key, duration))
+                continue
+        estimation = analyzer.key(chroma, algorithm)
+        estimations.append((estimation[0] + ' ' + estimation[1], estimation[2]))
+    return item, chroma, estimations, (frames_read, frames_available, tiempo() - start_time), segments
+
+
+def merged_analysis(items, stored, analysis):
+    """yields the analysis of every item in order, taking the stored ones
+    from the state database and the rest from analysis, which yields the
+    results of the items not stored, in the same order."""
+    for item in items:
+        if stored[item] is None:
+            yield next(analysis)
+        else:
+            yield (item,) + stored[item]
 
 
 def key_detector():
-    reloj()
+    """analyses and evaluates the files in audio_folder with the current
+    settings. Returns the mirex_evaluation() results of every key
+    configuration."""
+    start_time = tiempo()
+    if early_exit and key_tracking:
+        print "WARNING: key_tracking is ignored with early_exit, and no key segments are written."
+    if streaming and tuning_prepass:
+        print "WARNING: with tuning_prepass, files other than wav at", sample_rate, "Hz are decoded whole before being streamed."
     # create directory to write the results with an unique time id:
     if results_to_file or results_to_csv:
-        uniqueTime = str(int(tiempo()))
-        wd = os.getcwd()
-        temp_folder = wd + '/KeyDetection_'+uniqueTime
-        os.mkdir(temp_folder)
+        if results_folder:
+            temp_folder = os.path.abspath(os.path.expanduser(results_folder))
+            if not os.path.isdir(temp_folder):
+                os.makedirs(temp_folder)
+        else:
+            uniqueTime = str(int(tiempo()))
+            wd = os.getcwd()
+            temp_folder = wd + '/KeyDetection_'+uniqueTime
+            os.mkdir(temp_folder)
     if results_to_csv:
         import csv
         csvFile = open(temp_folder + '/Estimation_&_PCP.csv', 'w')
         lineWriter = csv.writer(csvFile, delimiter=',')
     # retrieve files and filenames according to the desired settings:
-    if analysis_mode == 'title':
+    if analysis_mode == 'title' and corpus_manifest:
+        from corpus_manifest import CorpusManifest, default_path
+        manifest = CorpusManifest(audio_folder, default_path(audio_folder, cache_folder))
+        changed, removed = manifest.refresh()
+        if changed or removed:
+            print "manifest updated:", changed, "files added or modified,", removed, "removed."
+        analysis_files = manifest.select(collection=collection, genre=genre, modality=modality)
+    elif analysis_mode == 'title':
         allfiles = os.listdir(audio_folder)
         if '.DS_Store' in allfiles: allfiles.remove('.DS_Store')
-        for item in collection: collection[collection.index(item)] = ' > ' + item + '.'
-        for item in genre: genre[genre.index(item)] = ' < ' + item + ' > '
-        for item in modality:modality[modality.index(item)] = ' ' + item + ' < '
+        # the settings are not modified, so that key_detector() can be run
+        # again with them (see key_sweep.py).
+        collection_tags = [' > ' + item + '.' for item in collection]
+        genre_tags = [' < ' + item + ' > ' for item in genre]
+        modality_tags = [' ' + item + ' < ' for item in modality]
         analysis_files = []
         for item in allfiles:
-            if any(e1 for e1 in collection if e1 in item):
-                if any(e2 for e2 in genre if e2 in item):
-                    if any(e3 for e3 in modality if e3 in item):
+            if any(e1 for e1 in collection_tags if e1 in item):
+                if any(e2 for e2 in genre_tags if e2 in item):
+                    if any(e3 for e3 in modality_tags if e3 in item):
                         analysis_files.append(item)
+    if analysis_mode == 'title':
         song_instances = len(analysis_files)
         print song_instances, 'songs matching the selected criteria:'
         print collection, genre, modality
@@ -167,156 +586,158 @@ def key_detector():
     if verbose:
         print "ANALYSING INDIVIDUAL SONGS..."
         print "============================="
-    if confusion_matrix:
-        matrix = 24 * 24 * [0]
-    mirex_scores = []
-    for item in analysis_files:
-        # INSTANTIATE ESSENTIA ALGORITHMS
-        # ===============================
-        loader = estd.MonoLoader(filename=audio_folder+'/'+item,
-        						 sampleRate=sample_rate)
-        cut    = estd.FrameCutter(frameSize=window_size,
-                                  hopSize=hop_size)
-        window = estd.Windowing(size=window_size,
-                                type=window_type)
-        rfft   = estd.Spectrum(size=window_size)
-        sw     = estd.SpectralWhitening(maxFrequency=max_frequency,
-                                        sampleRate=sample_rate)
-        speaks = estd.SpectralPeaks(magnitudeThreshold=magnitude_threshold,
-                                    maxFrequency=max_frequency,
-                                    minFrequency=min_frequency,
-                                    maxPeaks=max_peaks,
-                                    sampleRate=sample_rate)
-        hpcp   = estd.HPCP(bandPreset=band_preset,
-                           harmonics=harmonics,
-                           maxFrequency=max_frequency,
-                           minFrequency=min_frequency,
-                           nonLinear=non_linear,
-                           normalized=normalize,
-                           referenceFrequency=reference_frequency,
-                           sampleRate=sample_rate,
-                           size=hpcp_size,
-                           splitFrequency=split_frequency,
-                           weightType=weight_type,
-                           windowSize=weight_window_size)
-        key    = estd.Key(numHarmonics=num_harmonics,
-                          pcpSize=hpcp_size,
-                          profileType=profile_type,
-                          slope=slope,
-                          usePolyphony=use_polyphony,
-                          useThreeChords=use_three_chords)
-        # ACTUAL ANALYSIS
-        # ===============
-        audio = loader()
-        duration = len(audio)
-        if skip_first_minute and duration > (sample_rate*60):
-            audio = audio[sample_rate*60:]
-            duration = len(audio)
-        if first_n_secs > 0:
-            if duration > (first_n_secs * sample_rate):
-                audio = audio[:first_n_secs * sample_rate]
-                duration = len(audio)
-        if avoid_edges > 0:
-            initial_sample = (avoid_edges * duration) / 100
-            final_sample = duration - initial_sample
-            audio = audio[initial_sample:final_sample]
-            duration = len(audio)
-        number_of_frames = duration / hop_size
-        chroma = []
-        for bang in range(number_of_frames):
-            spek = rfft(window(cut(audio)))
-            p1, p2 = speaks(spek) # p1 are frequencies; p2 magnitudes
-            if spectral_whitening:
-                p2 = sw(spek, p1, p2)
-            vector = hpcp(p1,p2)
-            sum_vector = np.sum(vector)
-            if sum_vector > 0:
-                if shift_spectrum == False or shift_scope == 'average':
-                    chroma.append(vector)
-                elif shift_spectrum and shift_scope == 'frame':
-                    vector = shift_vector(vector, hpcp_size)
-                    chroma.append(vector)
-                else:
-                    print "shift_scope must be set to 'frame' or 'average'"
-        chroma = np.mean(chroma, axis=0)
-        if shift_spectrum and shift_scope == 'average':
-            chroma = shift_vector(chroma, hpcp_size)
-        estimation = key(chroma.tolist())
-        result = estimation[0] + ' ' + estimation[1]
-        confidence = estimation[2]
-        if results_to_csv:
-            chroma = list(chroma)
-        # MIREX EVALUATION:
-        # ================
+    key_settings = configurations()
+    names = [configuration_name(configuration) for configuration in key_settings]
+    if results_to_file:
+        if len(key_settings) == 1:
+            folders = [temp_folder]
+        else:
+            folders = [temp_folder + '/' + name for name in names]
+            for folder in folders:
+                if not os.path.isdir(folder):  # results_folder may be reused.
+                    os.mkdir(folder)
+        if results_format == 'store':
+            stores = [ResultsWriter(folder + '/_results') for folder in folders]
+    hashes = [settings_hash(configuration) for configuration in key_settings]
+    # in incremental mode, only the tracks without results for the current
+    # settings are analysed; the evaluation still covers all the tracks.
+    pending = analysis_files
+    if incremental:
+        state = AnalysisState(state_database or os.path.join(os.path.expanduser(cache_folder), 'analysis_state.db'))
+        tracks = dict((item, state.track_hash(audio_folder+'/'+item)) for item in analysis_files)
+        stored = dict((item, state.get(tracks[item], hashes)) for item in analysis_files)
+        pending = [item for item in analysis_files if stored[item] is None]
+        print len(analysis_files) - len(pending), "results reused,", len(pending), "new or modified tracks to analyse.\n"
+    # keys are stored as indexes of key_names, and scored all at once.
+    ground_truths = []
+    estimated_keys = [[] for configuration in key_settings]
+    collections = []
+    # tracks are analysed in a pool of worker processes, but their results
+    # are collected in input order, so that scores, confusion matrix and
+    # csv rows are identical to those of a sequential run.
+    if parallel:
+        from multiprocessing import Pool, cpu_count
+        pool = Pool(num_workers or cpu_count(), init_worker)
+        analysis = pool.imap(analyse_track, pending)
+    else:
+        init_worker()
+        analysis = (analyse_track(item) for item in pending)
+    if incremental:
+        analysis = merged_analysis(analysis_files, stored, analysis)
+    frames_read = frames_available = 0
+    for item, chroma, estimations, frames, segments in analysis:
+        if incremental and stored[item] is None:
+            state.put(tracks[item], hashes, chroma, estimations, frames, segments)
+        results = [result for result, confidence in estimations]
+        frames_read += frames[0]
+        frames_available += frames[1]
+        if verbose and early_exit:
+            print item, '|| frames read:', frames[0], 'of', frames[1]
+        # GROUND TRUTH:
+        # ============
         if analysis_mode == 'title':
             ground_truth = item[item.find(' = ')+3:item.rfind(' < ')]
-            if verbose and confidence < confidence_threshold:
-                print item[:item.rfind(' = ')]
-                print 'G:', ground_truth, '|| P:',
             if results_to_csv:
                 title = item[:item.rfind(' = ')]
-                lineWriter.writerow([title, ground_truth, chroma[0], chroma[1], chroma[2], chroma[3], chroma[4], chroma[5], chroma[6], chroma[7], chroma[8], chroma[9], chroma[10], chroma[11], chroma[12], chroma[13], chroma[14], chroma[15], chroma[16], chroma[17], chroma[18], chroma[19], chroma[20], chroma[21], chroma[22], chroma[23], chroma[24], chroma[25], chroma[26], chroma[27], chroma[28], chroma[29], chroma[30], chroma[31], chroma[32], chroma[33], chroma[34], chroma[35], result])
-            ground_truth = key_to_list(ground_truth)
-            estimation = key_to_list(result)
-            score = mirex_score(ground_truth, estimation)
-            mirex_scores.append(score)
+                lineWriter.writerow([title, ground_truth] + list(chroma) + results)
         else:
             filename_to_match = item[:item.rfind('.')] + '.txt'
             print filename_to_match
             if filename_to_match in groundtruth_files:
                 groundtruth_file = open(groundtruth_folder+'/'+filename_to_match, 'r')
                 ground_truth = groundtruth_file.readline()
+                groundtruth_file.close()
                 if "\t" in ground_truth:
                     ground_truth = re.sub("\t", " ", ground_truth)
                 if results_to_csv:
-                    lineWriter.writerow([filename_to_match, chroma[0], chroma[1], chroma[2], chroma[3], chroma[4], chroma[5], chroma[6], chroma[7], chroma[8], chroma[9], chroma[10], chroma[11], chroma[12], chroma[13], chroma[14], chroma[15], chroma[16], chroma[17], chroma[18], chroma[19], chroma[20], chroma[21], chroma[22], chroma[23], chroma[24], chroma[25], chroma[26], chroma[27], chroma[28], chroma[29], chroma[30], chroma[31], chroma[32], chroma[33], chroma[34], chroma[35], result])
-                ground_truth = key_to_list(ground_truth)
-                estimation = key_to_list(result)
-                score = mirex_score(ground_truth, estimation)
-                mirex_scores.append(score)
+                    lineWriter.writerow([filename_to_match] + list(chroma) + results)
             else:
                 print "FILE NOT FOUND... Skipping it from evaluation.\n"
                 continue
+        ground_truth_name = ground_truth.strip()
+        ground_truth = key_index(*key_to_list(ground_truth))
+        ground_truths.append(ground_truth)
+        if analysis_mode == 'title':
+            collections.append(item[item.rfind(' > ')+3:item.rfind('.')])
+        for c in range(len(key_settings)):
+            result, confidence = estimations[c]
+            # MIREX EVALUATION:
+            # ================
+            estimation = key_index(*key_to_list(result))
+            estimated_keys[c].append(estimation)
+            score = mirex_values[mirex_categories(ground_truth, estimation)]
+            if verbose and confidence < confidence_threshold:
+                if analysis_mode == 'title':
+                    print item[:item.rfind(' = ')]
+                if len(key_settings) > 1:
+                    print names[c]
+                print 'G:', ground_truth_name, '|| P:', result, '(%.2f)' % confidence, '|| SCORE:', score, '\n'
+            # WRITE RESULTS TO FILE:
+            # =====================
+            if results_to_file and results_format == 'store':
+                stores[c].append(item, ground_truth_name, result, chroma, confidence, frames[2], hashes[c])
+            elif results_to_file:
+                with open(folders[c] + '/' + item[:-3]+'txt', 'w') as textfile:
+                    textfile.write(result)
+            # key segments are written with both results formats.
+            if results_to_file and segments:
+                with open(folders[c] + '/' + item[:-4]+'.segments.csv', 'w') as segments_file:
+                    for start, end, key, strength in segments[c]:
+                        segments_file.write('%.3f,%.3f,%s,%.4f\n' % (start, end, key, strength))
+    if parallel:
+        pool.close()
+        pool.join()
+    if results_to_csv:
+        csvFile.close()
+    if incremental:
+        state.close()
+    if results_to_file and results_format == 'store':
+        for store in stores:
+            store.close()
+    print len(ground_truths), "files analysed in", tiempo() - start_time, "secs.\n"
+    if early_exit and frames_available > 0:
+        print frames_read, "of", frames_available, "frames read (%.1f%%).\n" % (100.0 * frames_read / frames_available)
+    summary = []
+    for c in range(len(key_settings)):
+        if len(key_settings) > 1:
+            print "\n" + names[c]
+            print "=" * len(names[c])
+        categories = mirex_categories(ground_truths, estimated_keys[c])
         # CONFUSION MATRIX:
         # ================
         if confusion_matrix:
-            xpos = (ground_truth[0] + (ground_truth[0] * 24)) + (-1*(ground_truth[1]-1) * 24 * 12)
-            ypos = ((estimation[0] - ground_truth[0]) + (-1 * (estimation[1]-1) * 12))
-            matrix[(xpos+ypos)] =+ matrix[(xpos+ypos)] + 1
-        if verbose and confidence < confidence_threshold:
-            print result, '(%.2f)' % confidence, '|| SCORE:', score, '\n'
-        # WRITE RESULTS TO FILE:
-        # =====================
-        if results_to_file:
-            with open(temp_folder + '/' + item[:-3]+'txt', 'w') as textfile:
-                textfile.write(result)
-                textfile.close()
-    if results_to_csv:
-        csvFile.close()
-    print len(mirex_scores), "files analysed in", reloj(), "secs.\n"
-    if confusion_matrix:
-        matrix = np.matrix(matrix)
-        matrix = matrix.reshape(24,24)
-        print matrix
+            matrix = np.matrix(key_confusion_matrix(ground_truths, estimated_keys[c]))
+            print matrix
+            if results_to_file:
+                np.savetxt(folders[c] + '/_confusion_matrix.csv', matrix, fmt='%i', delimiter=',', header='C,C#,D,Eb,E,F,F#,G,G#,A,Bb,B,Cm,C#m,Dm,Ebm,Em,Fm,F#m,Gm,G#m,Am,Bbm,Bm')
+        # MIREX RESULTS
+        # =============
+        evaluation_results = mirex_evaluation(mirex_values[categories])
+        summary.append(evaluation_results)
+        if len(categories) > 1:
+            print "95%% confidence interval of weighted score: %.3f - %.3f" % bootstrap_interval(categories)
+        if len(set(collections)) > 1:
+            for collection_name, results in sorted(mirex_breakdown(categories, collections).items()):
+                print "%-15s weighted %.3f, correct %.3f" % (collection_name, results[5], results[0])
+        # WRITE INFO TO FILE
+        # ==================
         if results_to_file:
-            np.savetxt(temp_folder + '/_confusion_matrix.csv', matrix, fmt='%i', delimiter=',', header='C,C#,D,Eb,E,F,F#,G,G#,A,Bb,B,Cm,C#m,Dm,Ebm,Em,Fm,F#m,Gm,G#m,Am,Bbm,Bm')
-    # MIREX RESULTS
-    # =============
-    evaluation_results = mirex_evaluation(mirex_scores)
-    # WRITE INFO TO FILE
-    # ==================
-    if results_to_file:
-        settings = "SETTINGS\n========\nAvoid edges ('%' of duration disregarded at both ends (0 = complete)) = "+str(avoid_edges)+"\nfirst N secs = "+str(first_n_secs)+"\nshift spectrum to fit tempered scale = "+str(shift_spectrum)+"\nspectral whitening = "+str(spectral_whitening)+"\nsample rate = "+str(sample_rate)+"\nwindow size = "+str(window_size)+"\nhop size = "+str(hop_size)+"\nmagnitude threshold = "+str(magnitude_threshold)+"\nminimum frequency = "+str(min_frequency)+"\nmaximum frequency = "+str(max_frequency)+"\nmaximum peaks = "+str(max_peaks)+"\nband preset = "+str(band_preset)+"\nsplit frequency = "+str(split_frequency)+"\nharmonics = "+str(harmonics)+"\nnon linear = "+str(non_linear)+"\nnormalize = "+str(normalize)+"\nreference frequency = "+str(reference_frequency)+"\nhpcp size = "+str(hpcp_size)+"\nweigth type = "+weight_type+"\nweight window size in semitones = "+str(weight_window_size)+"\nharmonics key = "+str(num_harmonics)+"\nslope = "+str(slope)+"\nprofile = "+profile_type+"\npolyphony = "+str(use_polyphony)+"\nuse three chords = "+str(use_three_chords)
-        results_for_file = "\n\nEVALUATION RESULTS\n==================\nCorrect: "+str(evaluation_results[0])+"\nFifth:  "+str(evaluation_results[1])+"\nRelative: "+str(evaluation_results[2])+"\nParallel: "+str(evaluation_results[3])+"\nError: "+str(evaluation_results[4])+"\nWeighted: "+str(evaluation_results[5])
-        write_to_file = open(temp_folder + '/_SUMMARY.txt', 'w')
-        write_to_file.write(settings)
-        write_to_file.write(results_for_file)
-        if analysis_mode == 'title':
-            corpus = "\n\nANALYSIS CORPUS\n===============\n" + str(collection) + '\n' + str(genre) + '\n' + str(modality) + '\n\n' + str(len(mirex_scores)) + " files analysed.\n"
-            write_to_file.write(corpus)
-        write_to_file.close()
+            write_summary(folders[c], key_settings[c], evaluation_results, len(categories))
+    return summary
 
 
+def write_summary(folder, configuration, evaluation_results, files_analysed):
+    """writes the settings and evaluation results of a run to _SUMMARY.txt"""
+    settings = "SETTINGS\n========\nAvoid edges ('%' of duration disregarded at both ends (0 = complete)) = "+str(avoid_edges)+"\nfirst N secs = "+str(first_n_secs)+"\nshift spectrum to fit tempered scale = "+str(shift_spectrum)+"\nspectral whitening = "+str(spectral_whitening)+"\nsample rate = "+str(sample_rate)+"\nwindow size = "+str(window_size)+"\nhop size = "+str(hop_size)+"\nframe selection = "+frame_selection+" (budget "+str(frame_budget)+")"+"\nmagnitude threshold = "+str(magnitude_threshold)+"\nminimum frequency = "+str(min_frequency)+"\nmaximum frequency = "+str(max_frequency)+"\nmaximum peaks = "+str(max_peaks)+"\nband preset = "+str(band_preset)+"\nsplit frequency = "+str(split_frequency)+"\nharmonics = "+str(harmonics)+"\nnon linear = "+str(non_linear)+"\nnormalize = "+str(normalize)+"\nreference frequency = "+str(reference_frequency)+"\nhpcp size = "+str(hpcp_size)+"\nweigth type = "+weight_type+"\nweight window size in semitones = "+str(weight_window_size)+"\nharmonics key = "+str(configuration['num_harmonics'])+"\nslope = "+str(configuration['slope'])+"\nprofile = "+configuration['profile_type']+"\npolyphony = "+str(configuration['use_polyphony'])+"\nuse three chords = "+str(configuration['use_three_chords'])
+    results_for_file = "\n\nEVALUATION RESULTS\n==================\nCorrect: "+str(evaluation_results[0])+"\nFifth:  "+str(evaluation_results[1])+"\nRelative: "+str(evaluation_results[2])+"\nParallel: "+str(evaluation_results[3])+"\nError: "+str(evaluation_results[4])+"\nWeighted: "+str(evaluation_results[5])
+    write_to_file = open(folder + '/_SUMMARY.txt', 'w')
+    write_to_file.write(settings)
+    write_to_file.write(results_for_file)
+    if analysis_mode == 'title':
+        corpus = "\n\nANALYSIS CORPUS\n===============\n" + str(collection) + '\n' + str(genre) + '\n' + str(modality) + '\n\n' + str(files_analysed) + " files analysed.\n"
+        write_to_file.write(corpus)
+    write_to_file.close()
+
 if __name__ == "__main__":
     if analysis_mode == 'txt':
         try:
@@ -0,0 +1,147 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""Runs key_detector over grids of settings, without editing its source.
+
+Settings are read from a JSON or YAML file and from the command line. Any
+global setting of key_detector.py can be given; a grid assigns a list of
+values to some of them, and every combination is a job:
+
+{"settings": {"analysis_mode": "title", "collection": ["KF1000"]},
+ "grid":     {"window_size": [4096, 8192],
+              "profile_type": ["edmm", "krumhansl"],
+              "use_polyphony": [false, true]}}
+
+Grid points that differ only in key detector parameters (profile_type,
+use_three_chords, use_polyphony, num_harmonics, slope) are evaluated in the
+same run of key_detector, as its key_configurations, so the chroma of every
+track is computed once for all of them. Tracks are analysed in a pool of
+worker processes, and the results of every job are written to a folder of
+their own, with a subfolder per key configuration.
+
+USAGE: key_sweep.py <route to audio> [<route to ground-truth>] [options]
+  -c, --config FILE      JSON or YAML file with settings and grid.
+  -s, --set NAME=VALUE   sets a setting (VALUE is parsed as JSON).
+  -g, --grid NAME=LIST   sweeps a setting over a JSON list of values.
+  -w, --workers N        number of worker processes (0 = one per cpu core).
+  -o, --output FOLDER    where results are written.
+"""
+
+import os, sys, json, copy, argparse, itertools
+from time import time as tiempo
+import key_detector as kd
+from key_detector import KEY_PARAMETERS
+
+
+def parse_value(text):
+    """parses a command-line value as JSON, or takes it as a string."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def load_config(filename):
+    """reads a JSON or YAML config file with 'settings' and 'grid' sections."""
+    with open(filename) as config_file:
+        if filename.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                print "PyYAML is needed to read", filename
+                sys.exit()
+            config = yaml.safe_load(config_file)
+        else:
+            config = json.load(config_file)
+    return config.get('settings', {}), config.get('grid', {})
+
+
+def expand_grid(grid):
+    """returns a list with one dictionary of settings per combination of the
+    values in a grid (a dictionary of lists)."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def jobs(settings, grid):
+    """groups the grid points into jobs: a list of (settings, key
+    configurations) tuples, in which all the key configurations of a job
+    share the same front-end settings."""
+    front_end_grid = dict((name, values) for name, values in grid.items() if name not in KEY_PARAMETERS)
+    key_grid = dict((name, values) for name, values in grid.items() if name in KEY_PARAMETERS)
+    key_configurations = expand_grid(key_grid) if key_grid else settings.get('key_configurations', [])
+    return [(dict(settings, **point), key_configurations) for point in expand_grid(front_end_grid)]
+
+
+def configure(settings, key_configurations, folder):
+    """sets the globals of key_detector for a job."""
+    for name, value in settings.items():
+        if not hasattr(kd, name):
+            raise ValueError("Unknown setting: " + name)
+        setattr(kd, name, copy.deepcopy(value))
+    if 'hop_size' not in settings:
+        kd.hop_size = kd.window_size * kd.jump_frames
+    kd.key_configurations = key_configurations
+    kd.results_to_file = True
+    kd.results_folder = folder
+
+
+def write_results(filename, rows):
+    import csv
+    with open(filename, 'w') as results_file:
+        writer = csv.writer(results_file, delimiter=',')
+        writer.writerow(['job', 'configuration', 'settings', 'correct', 'fifth', 'relative', 'parallel', 'error', 'weighted'])
+        for row in rows:
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs key_detector over grids of settings.")
+    parser.add_argument('audio_folder')
+    parser.add_argument('groundtruth_folder', nargs='?')
+    parser.add_argument('-c', '--config')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE')
+    parser.add_argument('-g', '--grid', action='append', default=[], metavar='NAME=LIST')
+    parser.add_argument('-w', '--workers', type=int, default=0)
+    parser.add_argument('-o', '--output', default='KeySweep_' + str(int(tiempo())))
+    args = parser.parse_args()
+
+    settings, grid = load_config(args.config) if args.config else ({}, {})
+    for option in args.set:
+        name, value = option.split('=', 1)
+        settings[name] = parse_value(value)
+    for option in args.grid:
+        name, values = option.split('=', 1)
+        values = parse_value(values)
+        grid[name] = values if isinstance(values, list) else [values]
+    settings.setdefault('parallel', True)
+    settings.setdefault('num_workers', args.workers)
+    if args.groundtruth_folder:
+        settings.setdefault('analysis_mode', 'txt')
+    kd.audio_folder = args.audio_folder
+    kd.groundtruth_folder = args.groundtruth_folder
+
+    output = os.path.abspath(args.output)
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    rows = []
+    job_list = jobs(settings, grid)
+    print len(job_list), "jobs,", len(expand_grid(grid)), "configurations.\n"
+    for number, (job_settings, key_configurations) in enumerate(job_list):
+        name = 'job_%03d' % number
+        folder = os.path.join(output, name)
+        configure(job_settings, key_configurations, folder)
+        with open(os.path.join(output, name + '.json'), 'w') as settings_file:
+            json.dump({'settings': job_settings, 'key_configurations': key_configurations},
+                      settings_file, indent=2, sort_keys=True)
+        print "\n" + name, json.dumps(dict((key, job_settings[key]) for key in grid if key in job_settings))
+        print "=" * len(name)
+        results = kd.key_detector()
+        for configuration, evaluation in zip(kd.configurations(), results):
+            rows.append([name, kd.configuration_name(configuration),
+                         json.dumps(job_settings, sort_keys=True)] + list(evaluation))
+        write_results(os.path.join(output, 'sweep_results.csv'), rows)
+
+
+if __name__ == "__main__":
+    main()
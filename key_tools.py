@@ -7,6 +7,7 @@ Function definitions for key analysis and symbolic manipulation."
 Ángel Faraldo, March 2015.
 """
 
+import os
 import numpy as np
 
 # Dictionaries
@@ -38,6 +39,49 @@ mode2num = {'minor':      0,
             'mix':        1,
             'lyd':        1}
 
+# mirex scores, in the order of the categories returned by mirex_evaluation():
+# correct, fifth, relative, parallel and other errors.
+mirex_values = np.array([1, 0.5, 0.3, 0.2, 0])
+
+# key profiles as in Key::configure() (essentia source code/key.cpp),
+# 12 values for major and minor, starting on the tonic.
+profiles = {
+    'diatonic':      ([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1],
+                      [1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 0, 1]),
+    'krumhansl':     ([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+                      [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]),
+    'temperley':     ([5.0, 2.0, 3.5, 2.0, 4.5, 4.0, 2.0, 4.5, 2.0, 3.5, 1.5, 4.0],
+                      [5.0, 2.0, 3.5, 4.5, 2.0, 4.0, 2.0, 4.5, 3.5, 2.0, 1.5, 4.0]),
+    'weichai':       ([81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218, 39853, 1579, 28908],
+                      [39853, 1579, 28908, 81302, 320, 65719, 1916, 77469, 40928, 2223, 83997, 1218]),
+    'tonictriad':    ([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
+                      [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0]),
+    'temperley2005': ([0.748, 0.060, 0.488, 0.082, 0.67, 0.46, 0.096, 0.715, 0.104, 0.366, 0.057, 0.4],
+                      [0.712, 0.084, 0.474, 0.618, 0.049, 0.46, 0.105, 0.747, 0.404, 0.067, 0.133, 0.33]),
+    'thpcp':         ([0.95162, 0.20742, 0.71758, 0.22007, 0.71341, 0.48841, 0.31431, 1.00000, 0.20957, 0.53657, 0.22585, 0.55363],
+                      [0.94409, 0.21742, 0.64525, 0.63229, 0.27897, 0.57709, 0.26428, 1.0000, 0.26428, 0.30633, 0.45924, 0.35929]),
+    'shaath':        ([6.6, 2.0, 3.5, 2.3, 4.6, 4.0, 2.5, 5.2, 2.4, 3.7, 2.3, 3.4],
+                      [6.5, 2.7, 3.5, 5.4, 2.6, 3.5, 2.5, 5.2, 4.0, 2.7, 4.3, 3.2]),
+    'gomez':         ([0.82, 0.00, 0.55, 0.00, 0.53, 0.30, 0.08, 1.00, 0.00, 0.38, 0.00, 0.47],
+                      [0.81, 0.00, 0.53, 0.54, 0.00, 0.27, 0.07, 1.00, 0.27, 0.07, 0.10, 0.36]),
+    'noland':        ([0.0629, 0.0146, 0.061, 0.0121, 0.0623, 0.0414, 0.0248, 0.0631, 0.015, 0.0521, 0.0142, 0.0478],
+                      [0.0682, 0.0138, 0.0543, 0.0519, 0.0234, 0.0544, 0.0176, 0.067, 0.0349, 0.0297, 0.0401, 0.027]),
+    'faraldo':       ([7.0, 2.0, 3.8, 2.3, 4.7, 4.1, 2.5, 5.2, 2.0, 3.7, 3.0, 3.4],
+                      [7.0, 3.0, 3.8, 4.5, 2.6, 3.5, 2.5, 5.2, 4.0, 2.5, 4.5, 3.0]),
+    'pentatonic':    ([1.0, 0.1, 0.25, 0.1, 0.5, 0.7, 0.1, 0.8, 0.1, 0.25, 0.1, 0.5],
+                      [1.0, 0.2, 0.25, 0.5, 0.1, 0.7, 0.1, 0.8, 0.3, 0.2, 0.6, 0.2]),
+    'edmm':          ([0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083, 0.083],
+                      [0.17235348, 0.04, 0.0761009, 0.12, 0.05621498, 0.08527853, 0.0497915, 0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106]),
+    'edma':          ([0.16519551, 0.04749026, 0.08293076, 0.06687112, 0.09994645, 0.09274123, 0.05294487, 0.13159476, 0.05218986, 0.07443653, 0.06940723, 0.0642515],
+                      [0.17235348, 0.05336489, 0.0761009, 0.10043649, 0.05621498, 0.08527853, 0.0497915, 0.13451001, 0.07458916, 0.05003023, 0.09187879, 0.05545106])}
+
+# key names in the order of the 24 columns returned by key_scores(),
+# which is also the order of the rows and columns of the confusion matrix.
+key_names = ['C major', 'C# major', 'D major', 'Eb major', 'E major', 'F major',
+             'F# major', 'G major', 'G# major', 'A major', 'Bb major', 'B major',
+             'C minor', 'C# minor', 'D minor', 'Eb minor', 'E minor', 'F minor',
+             'F# minor', 'G minor', 'G# minor', 'A minor', 'Bb minor', 'B minor']
+
 
 # Functions
 # =========
@@ -93,25 +137,15 @@ def mirex_evaluation(list_with_weighted_results):
     Parallel Mode = 0.2
     Other Errors = 0.0
     and returs a list with the results for each of these categories plus a weighted score"""
-    results = [0, 0, 0, 0, 0]
-    l = float(len(list_with_weighted_results))
-    for item in list_with_weighted_results:
-        if item == 1:
-            results[0] += 1.0
-        elif item == 0.5:
-            results[1] += 1.0
-        elif item == 0.3:
-            results[2] += 1.0
-        elif item == 0.2:
-            results[3] += 1.0
-        elif item == 0:
-            results[4] += 1.0
+    scores = np.asarray(list_with_weighted_results, dtype=float)
+    results = [np.count_nonzero(scores == value) for value in mirex_values]
+    l = float(len(scores))
     correct = results[0] / l
     fifth = results[1] / l
     relative = results[2] / l
     parallel = results[3] / l
     error = results[4] / l
-    weighted = np.mean(list_with_weighted_results)
+    weighted = np.mean(scores)
     print "\nCorrect ", correct
     print "Fifth     ", fifth
     print "Relative  ", relative
@@ -121,6 +155,152 @@ def mirex_evaluation(list_with_weighted_results):
     return [correct, fifth, relative, parallel, error, weighted]
 
 
+def key_index(tonic, mode):
+    """converts (arrays of) tonics and modes, as returned by key_to_list(),
+    into indexes of key_names (C major = 0, ..., B minor = 23). Unknown
+    keys ('none') get -1."""
+    tonic = np.asarray(tonic)
+    mode = np.asarray(mode)
+    return np.where(tonic < 12, tonic + 12 * (1 - mode), -1)
+
+
+def _category_table():
+    table = np.zeros((24, 24), dtype=int)
+    for ground_truth in range(24):
+        for estimation in range(24):
+            score = mirex_score([ground_truth % 12, 1 - ground_truth / 12],
+                                [estimation % 12, 1 - estimation / 12])
+            table[ground_truth, estimation] = list(mirex_values).index(score)
+    return table
+
+# category (index in mirex_values) of every pair of ground truth and
+# estimated key indexes, and the corresponding scores.
+category_table = _category_table()
+score_table = mirex_values[category_table]
+
+
+def mirex_categories(ground_truth, estimation):
+    """returns the category (index in mirex_values) of every pair of ground
+    truth and estimated key indexes (see key_index()). Pairs with an unknown
+    key are counted as errors."""
+    ground_truth = np.asarray(ground_truth)
+    estimation = np.asarray(estimation)
+    return np.where((ground_truth >= 0) & (estimation >= 0),
+                    category_table[ground_truth, estimation], 4)
+
+
+def mirex_scores(ground_truth, estimation):
+    """vectorized mirex_score() over arrays of key indexes."""
+    return mirex_values[mirex_categories(ground_truth, estimation)]
+
+
+def key_confusion_matrix(ground_truth, estimation):
+    """returns the 24 x 24 confusion matrix (rows are ground truth, columns
+    estimations, both in the order of key_names) of arrays of key indexes.
+    Pairs with an unknown key are left out."""
+    ground_truth = np.asarray(ground_truth)
+    estimation = np.asarray(estimation)
+    known = (ground_truth >= 0) & (estimation >= 0)
+    return np.bincount(24 * ground_truth[known] + estimation[known],
+                       minlength=24 * 24).reshape(24, 24)
+
+
+def mirex_breakdown(categories, groups):
+    """returns a dictionary with the results of mirex_evaluation() (without
+    printing them) for every group, e.g. collection or genre, given the
+    category and the group of every estimation."""
+    names, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    counts = np.bincount(inverse * 5 + np.asarray(categories),
+                         minlength=len(names) * 5).reshape(-1, 5).astype(float)
+    fractions = counts / np.sum(counts, axis=1)[:, np.newaxis]
+    weighted = np.dot(fractions, mirex_values)
+    return dict((name, list(fractions[i]) + [weighted[i]]) for i, name in enumerate(names))
+
+
+def bootstrap_interval(categories, confidence=0.95, iterations=10000, seed=0):
+    """returns the bootstrap confidence interval of the weighted score.
+    As the scores only take five values, resampling the estimations is
+    equivalent to drawing the counts of every category from a multinomial,
+    which does not depend on the number of estimations."""
+    counts = np.bincount(np.asarray(categories), minlength=5)
+    total = np.sum(counts)
+    draws = np.random.RandomState(seed).multinomial(total, counts / float(total), size=iterations)
+    weighted = np.dot(draws, mirex_values) / float(total)
+    tail = 50 * (1 - confidence)
+    return np.percentile(weighted, tail), np.percentile(weighted, 100 - tail)
+
+
+def load_profiles(filename):
+    """adds the profiles in a text file to the profiles dictionary. The file
+    has one profile per line: a name followed by 12 major and 12 minor values
+    (starting on the tonic); lines starting with '#' are ignored. This is the
+    format read by Key from the file in ESSENTIA_KEY_PROFILES."""
+    with open(filename) as profiles_file:
+        for line in profiles_file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            values = [float(value) for value in fields[1:]]
+            if len(values) != 24:
+                raise ValueError("Profile %s should have 24 values in %s" % (fields[0], filename))
+            profiles[fields[0]] = (values[:12], values[12:])
+
+
+def save_profiles(filename, new_profiles):
+    """writes a dictionary of (major, minor) profiles in the format read by
+    load_profiles() and by Key through ESSENTIA_KEY_PROFILES."""
+    with open(filename, 'w') as profiles_file:
+        for name in sorted(new_profiles):
+            major, minor = new_profiles[name]
+            values = list(major) + list(minor)
+            profiles_file.write(name + ' ' + ' '.join(repr(float(value)) for value in values) + '\n')
+
+
+class ProfileStatistics(object):
+    """weighted mean, standard deviation and median of chroma vectors with
+    values in [0, 1], accumulated one vector at a time. The median is taken
+    from a histogram with the given number of bins per chroma bin, so memory
+    does not grow with the number of vectors."""
+
+    def __init__(self, size, bins=1000):
+        self.bins = bins
+        self.weight = 0.0
+        self.sum = np.zeros(size)
+        self.squares = np.zeros(size)
+        self.histogram = np.zeros((size, bins))
+
+    def add(self, chroma, weight=1.0):
+        chroma = np.clip(np.asarray(chroma, dtype=float), 0, 1)
+        self.weight += weight
+        self.sum += weight * chroma
+        self.squares += weight * chroma * chroma
+        cells = np.minimum((chroma * self.bins).astype(int), self.bins - 1)
+        self.histogram[np.arange(len(chroma)), cells] += weight
+
+    def merge(self, other):
+        self.weight += other.weight
+        self.sum += other.sum
+        self.squares += other.squares
+        self.histogram += other.histogram
+
+    def mean(self):
+        return self.sum / max(self.weight, 1e-12)
+
+    def std(self):
+        return np.sqrt(np.maximum(self.squares / max(self.weight, 1e-12) - self.mean() ** 2, 0))
+
+    def median(self):
+        cumulative = np.cumsum(self.histogram, axis=1)
+        half = self.weight / 2.0
+        cells = np.array([np.searchsorted(row, half) for row in cumulative])
+        cells = np.minimum(cells, self.bins - 1)
+        rows = np.arange(len(cells))
+        before = np.where(cells > 0, cumulative[rows, np.maximum(cells - 1, 0)], 0)
+        inside = self.histogram[rows, cells]
+        fraction = np.where(inside > 0, (half - before) / np.where(inside > 0, inside, 1), 0.5)
+        return (cells + fraction) / self.bins
+
+
 def shift_vector(hpcp, hpcp_size=12):
     """shifts the spectrum to the nearest tempered bin"""
     tuning_resolution = hpcp_size / 12
@@ -136,3 +316,190 @@ def shift_vector(hpcp, hpcp_size=12):
         shift_distance = max_val_index
     hpcp = np.roll(hpcp, shift_distance)
     return hpcp
+
+
+def tuning_offsets(chroma, hpcp_size=12):
+    """estimates the tuning of every row of a (N x hpcp_size) chroma batch
+    as the circular centroid of the bins within each semitone. Returns the
+    offsets of the tempered scale from the first bin of every semitone, in
+    bins, between -hpcp_size/24 and hpcp_size/24."""
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=float))
+    tuning_resolution = hpcp_size / 12
+    angles = 2 * np.pi * (np.arange(hpcp_size) % tuning_resolution) / tuning_resolution
+    centroids = np.dot(chroma, np.exp(1j * angles))
+    return np.angle(centroids) * tuning_resolution / (2 * np.pi)
+
+
+def shift_vectors(chroma, hpcp_size=12, method='peak', scope='frame'):
+    """shifts every row of a (N x hpcp_size) chroma batch to the tempered
+    scale, in a single call, and normalises it to a maximum of 1. With
+    method 'peak', rows are rolled by whole bins as shift_vector() does;
+    with method 'centroid', they are re-interpolated by the fractional
+    offset given by tuning_offsets(). If scope is 'global', all the rows
+    are shifted by the tuning of the whole batch. Silent rows stay silent."""
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=float))
+    tuning_resolution = hpcp_size / 12
+    peaks = np.max(chroma, axis=1)
+    voiced = peaks > 0
+    chroma = chroma / np.where(voiced, peaks, 1)[:, np.newaxis]
+    if method == 'peak':
+        if scope == 'global':
+            offsets = np.argmax(np.sum(chroma, axis=0)) % tuning_resolution
+            offsets = np.repeat(offsets, len(chroma))
+        else:
+            offsets = np.argmax(chroma, axis=1) % tuning_resolution
+        shifts = np.where(offsets > tuning_resolution / 2, tuning_resolution - offsets, offsets)
+    elif method == 'centroid':
+        if scope == 'global':
+            shifts = -np.repeat(tuning_offsets(np.sum(chroma, axis=0), hpcp_size), len(chroma))
+        else:
+            shifts = -tuning_offsets(chroma, hpcp_size)
+    else:
+        raise ValueError("Unknown shift method: " + method)
+    # out[i] = in[i - shift], interpolating linearly between bins.
+    whole = np.floor(shifts).astype(int)
+    fraction = (shifts - whole)[:, np.newaxis]
+    index = (np.arange(hpcp_size)[np.newaxis, :] - whole[:, np.newaxis]) % hpcp_size
+    rows = np.arange(len(chroma))[:, np.newaxis]
+    shifted = (1 - fraction) * chroma[rows, index] + fraction * chroma[rows, (index - 1) % hpcp_size]
+    if method == 'centroid':
+        peaks = np.max(shifted, axis=1)
+        shifted = shifted / np.where(peaks > 0, peaks, 1)[:, np.newaxis]
+    return np.where(voiced[:, np.newaxis], shifted, 0)
+
+
+def add_contribution_harmonics(pitch_class, contribution, chords, num_harmonics=15, slope=0.2):
+    """adds the contribution of a note and its harmonics to a 12-bin profile,
+    as Key::addContributionHarmonics() does."""
+    weight = contribution
+    for harmonic in range(1, num_harmonics + 1):
+        index = pitch_class + 12 * np.log2(harmonic)
+        before = np.floor(index)
+        after = np.ceil(index)
+        ibefore = int(before % 12)
+        iafter = int(after % 12)
+        if ibefore < iafter:
+            chords[ibefore] += np.cos(0.5 * np.pi * (index - before)) ** 2 * weight
+            chords[iafter] += np.cos(0.5 * np.pi * (after - index)) ** 2 * weight
+        else:
+            chords[ibefore] += weight
+        weight *= slope
+
+
+def key_profile(profile_type='edmm', hpcp_size=36, use_three_chords=False,
+                use_polyphony=False, num_harmonics=15, slope=0.2):
+    """returns the major and minor profiles of a profile type interpolated to
+    hpcp_size bins, exactly as the Key algorithm builds them."""
+    major, minor = [np.array(profile, dtype=float) for profile in profiles[profile_type]]
+    if use_polyphony:
+        degrees_major = [0, 5, 7] if use_three_chords else [0, 2, 4, 5, 7, 9, 11]
+        degrees_minor = [0, 5, 7] if use_three_chords else [0, 2, 3, 5, 7, 8, 10]
+        major_chords = np.zeros(12)
+        minor_chords = np.zeros(12)
+        for degree in degrees_major:
+            add_contribution_harmonics(degree, major[degree], major_chords, num_harmonics, slope)
+        for degree in degrees_minor:
+            add_contribution_harmonics(degree, minor[degree], minor_chords, num_harmonics, slope)
+        major, minor = major_chords, minor_chords
+    return [interpolate_profile(profile, hpcp_size) for profile in (major, minor)]
+
+
+def interpolate_profile(profile, hpcp_size=36):
+    """interpolates a 12-bin profile to hpcp_size bins, as Key does."""
+    profile = np.asarray(profile, dtype=float)
+    n = hpcp_size / 12
+    increments = (profile - np.roll(profile, -1)) / n
+    steps = np.arange(n)
+    return (profile[:, np.newaxis] - steps * increments[:, np.newaxis]).ravel()
+
+
+def train_profiles(chroma, tonics, modes, statistic='mean'):
+    """learns 12-bin major and minor profiles (starting on the tonic and
+    adding up to 1) from a (N x hpcp_size) batch of track chroma, with
+    tonics c=0,...,b=11 and modes maj = 1, min = 0. Chroma bins are counted
+    from A, as the HPCP computes them. statistic is 'mean' or 'median'.
+    The profile of a mode without tracks is None."""
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=float))
+    size = chroma.shape[1]
+    tuning_resolution = size / 12
+    # rotate every chroma so that its tonic is in the first bin.
+    shifts = tuning_resolution * ((np.asarray(tonics) - 9) % 12)
+    index = (np.arange(size)[np.newaxis, :] + shifts[:, np.newaxis]) % size
+    rotated = chroma[np.arange(len(chroma))[:, np.newaxis], index]
+    trained = []
+    for mode in (1, 0):
+        selected = rotated[np.asarray(modes) == mode]
+        if len(selected) == 0:
+            trained.append(None)
+            continue
+        profile = np.median(selected, axis=0) if statistic == 'median' else np.mean(selected, axis=0)
+        profile = profile[::tuning_resolution]
+        trained.append(profile / max(np.sum(profile), 1e-12))
+    return trained
+
+
+def profile_matrix(major, minor):
+    """returns a (2 * size x size) matrix with all the rotations of the
+    normalised major profile followed by those of the minor profile, so
+    that the correlations with every key are a single matrix product."""
+    rotations = []
+    for profile in (major, minor):
+        profile = np.asarray(profile, dtype=float)
+        profile = profile - np.mean(profile)
+        profile = profile / np.sqrt(np.sum(profile * profile))
+        size = len(profile)
+        index = (np.arange(size)[np.newaxis, :] - np.arange(size)[:, np.newaxis]) % size
+        rotations.append(profile[index])
+    return np.vstack(rotations)
+
+
+def key_correlations(chroma, matrix):
+    """correlates a (N x size) chroma batch (or a single vector) with all the
+    rotations in a profile_matrix(). Returns a (N x 2 x size) array, in which
+    [:, 0, shift] are major and [:, 1, shift] minor correlations, shifts being
+    counted in hpcp bins from A, as in the Key algorithm."""
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=float))
+    chroma = chroma - np.mean(chroma, axis=1)[:, np.newaxis]
+    norm = np.sqrt(np.sum(chroma * chroma, axis=1))[:, np.newaxis]
+    chroma = chroma / np.where(norm > 0, norm, 1)
+    size = chroma.shape[1]
+    return np.dot(chroma, matrix.T).reshape(-1, 2, size)
+
+
+def key_scores(chroma, matrix):
+    """returns a (N x 24) array with the best correlation of each chroma with
+    every key, in the order of key_names (C major ... B minor)."""
+    correlations = key_correlations(chroma, matrix)
+    size = correlations.shape[2]
+    # group the shifts of each semitone (rounded down, as Key does), and
+    # move from A-based to C-based pitch classes.
+    per_semitone = correlations.reshape(-1, 2, 12, size / 12).max(axis=3)
+    per_semitone = np.roll(per_semitone, -3, axis=2)
+    return per_semitone.reshape(-1, 24)
+
+
+def estimate_keys(chroma, matrix):
+    """estimates the key of every row of a (N x size) chroma batch, following
+    the Key algorithm (including its running second maximum). Returns four
+    arrays: tonic (c=0,...,b=11), mode (maj = 1, min = 0), strength and first
+    to second relative strength."""
+    correlations = key_correlations(chroma, matrix)
+    rows = np.arange(len(correlations))
+    size = correlations.shape[2]
+    best = np.argmax(correlations, axis=2)  # first maximum, as Key scans shifts.
+    maxima = correlations.max(axis=2)
+    # Key keeps as second maximum the running maximum before the best shift.
+    running = np.maximum.accumulate(correlations, axis=2)
+    previous = running[rows[:, np.newaxis], [[0, 1]], np.maximum(best - 1, 0)]
+    previous = np.where(best > 0, previous, -1)
+    minor = (maxima[:, 0] < maxima[:, 1]).astype(int)
+    shift = best[rows, minor]
+    strength = maxima[rows, minor]
+    second = previous[rows, minor]
+    tonic = (shift * 12 / size + 9) % 12  # shifts are counted from A.
+    return tonic, 1 - minor, strength, (strength - second) / strength
+
+
+# profiles loaded by Key from ESSENTIA_KEY_PROFILES are also known here.
+if os.environ.get('ESSENTIA_KEY_PROFILES'):
+    load_profiles(os.environ['ESSENTIA_KEY_PROFILES'])
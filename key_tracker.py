@@ -0,0 +1,115 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Time-resolved key estimation.
+
+A KeyTracker estimates the key of a sliding window of hpcp frames as they
+arrive. The window sum is updated in O(hpcp_size) per frame (the new frame
+is added and the expired one subtracted), and consecutive estimations are
+grouped into segments (start, end, key, confidence). A new segment only
+starts when a different key has been estimated `hysteresis` times in a
+row, so that short fluctuations do not split the track. Segments are timed
+with the position of every frame in the track, when it is given to add().
+
+global_key() collapses the segments into a single key by duration, as
+obsolete/multipleKeys2single.py did with the timed keys in a file.
+"""
+
+import numpy as np
+
+
+class KeyTracker(object):
+    """sliding-window key tracker. key is a function returning (key, scale,
+    strength, relative strength) for a chroma vector, such as
+    KeyAnalyzer.key; shift, if given, is applied to every window mean."""
+
+    def __init__(self, key, window_frames, hpcp_size=36, hop_seconds=1.0,
+                 hysteresis=3, step=1, shift=None):
+        self.key = key
+        self.window_frames = max(int(window_frames), 1)
+        self.hop_seconds = hop_seconds
+        self.hysteresis = max(int(hysteresis), 1)
+        self.step = max(int(step), 1)
+        self.shift = shift
+        self.window = np.zeros((self.window_frames, hpcp_size))
+        self.sum = np.zeros(hpcp_size)
+        self.frames = 0
+        self.first_time = 0.0  # secs of the first frame,
+        self.step_time = 0.0   # of the first frame of the current step
+        self.last_time = 0.0   # and of the last frame.
+        self.segments = []
+        self.current = None    # [start secs, key, sum of strengths, estimations]
+        self.candidate = None  # [start secs, key, sum of strengths, estimations]
+
+    def add(self, vector, time=None):
+        """adds the next hpcp frame, re-estimating the key every step frames.
+        time is the position of the frame in secs; by default, frames are
+        taken to be hop_seconds apart from the start of the track."""
+        if time is None:
+            time = self.frames * self.hop_seconds
+        if self.frames == 0:
+            self.first_time = time
+        if self.frames % self.step == 0:
+            self.step_time = time
+        self.last_time = time
+        index = self.frames % self.window_frames
+        self.sum -= self.window[index]
+        self.window[index] = vector
+        self.sum += self.window[index]
+        self.frames += 1
+        if self.frames % self.step == 0:
+            self.estimate()
+
+    def estimate(self):
+        """estimates the key of the current window and updates the segments."""
+        if np.max(self.sum) <= 0:  # only silence in the window.
+            return
+        chroma = self.sum / min(self.frames, self.window_frames)
+        if self.shift is not None:
+            chroma = self.shift(chroma)
+        estimation = self.key(chroma)
+        key = estimation[0] + ' ' + estimation[1]
+        strength = estimation[2]
+        if self.current is None:
+            self.current = [self.first_time, key, strength, 1]
+        elif key == self.current[1]:
+            self.current[2] += strength
+            self.current[3] += 1
+            self.candidate = None
+        else:
+            if self.candidate is not None and key == self.candidate[1]:
+                self.candidate[2] += strength
+                self.candidate[3] += 1
+            else:
+                self.candidate = [self.step_time, key, strength, 1]
+            if self.candidate[3] >= self.hysteresis:
+                self.close(self.candidate[0])
+                self.current = self.candidate
+                self.candidate = None
+
+    def close(self, end_time):
+        start_time, key, strengths, estimations = self.current
+        self.segments.append((start_time, end_time, key, strengths / estimations))
+
+    def finish(self):
+        """closes the last segment and returns the list of segments as
+        (start, end, key, confidence) tuples, with times in seconds."""
+        if self.current is not None:
+            self.close(self.last_time + self.hop_seconds)
+            self.current = None
+            self.candidate = None
+        return self.segments
+
+
+def global_key(segments):
+    """returns the key lasting longest in a list of segments, and the
+    fraction of the tracked duration in that key."""
+    durations = {}
+    for start, end, key, confidence in segments:
+        durations[key] = durations.get(key, 0) + end - start
+    if not durations:
+        return None, 0
+    key = max(sorted(durations), key=lambda name: durations[name])
+    total = sum(durations.values())
+    return key, durations[key] / total if total > 0 else 0
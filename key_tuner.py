@@ -0,0 +1,231 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""Searches the analysis settings that maximise the MIREX weighted score.
+
+Random configurations are drawn from the search space below and evaluated
+by successive halving: all of them are first scored on a small subset of
+the tracks, the best 1/eta are kept and scored on eta times more tracks,
+and so on until the survivors are scored on the whole corpus. Subsets are
+nested, so every track analysed in a round is reused in the next ones.
+
+The mean chroma of a track only depends on the front-end settings, so it
+is computed once and shared by all the configurations that differ only in
+profile_type. It is computed by key_detector itself (track_frames,
+add_frame and track_chroma) with its globals set to every configuration,
+so settings not in the search space (trimming, frame selection, tuning
+pre-pass, shift_scope, shift_method...) are taken from key_detector.py.
+With --cache the per-frame hpcp is kept in key_detector's chroma cache,
+under the same keys, for later runs of either program.
+
+USAGE: key_tuner.py <route to audio> [<route to ground-truth>] [options]
+  -n, --candidates N   number of random configurations (default 64).
+  -e, --eta N          fraction of configurations kept every round is 1/N.
+  -w, --workers N      number of worker processes (0 = one per cpu core).
+  --cache              share the per-frame hpcp cache of key_detector (cache_folder).
+  --seed N             seed of the random search.
+"""
+
+search_space = {'window_size':        [2048, 4096, 8192],
+                'min_frequency':      [25, 50, 80],
+                'max_frequency':      [1000, 1700, 2500, 3500, 5000],
+                'max_peaks':          [20, 40, 60, 100],
+                'harmonics':          [0, 2, 4, 8],
+                'hpcp_size':          [12, 24, 36, 48],
+                'weight_window_size': [0.5, 1, 1.5],
+                'spectral_whitening': [True, False],
+                'profile_type':       ['edmm', 'edma', 'krumhansl', 'temperley',
+                                       'temperley2005', 'shaath', 'noland', 'faraldo']}
+
+import os, sys, json, random, argparse
+import numpy as np
+from time import time as tiempo
+import key_detector as kd
+from key_detector import KEY_PARAMETERS
+from key_analyzer import KeyAnalyzer, key_algorithm
+from key_tools import key_to_list, mirex_score, shift_vectors
+
+
+def front_end_of(configuration):
+    """the key_detector globals that determine the chroma of a track, with
+    the values of a configuration."""
+    settings = kd.front_end_settings()
+    settings.update(shift_spectrum=kd.shift_spectrum,
+                    shift_scope=kd.shift_scope,
+                    shift_method=kd.shift_method)
+    settings.update((name, value) for name, value in configuration.items()
+                    if name not in KEY_PARAMETERS)
+    settings['hop_size'] = settings['window_size'] * settings['jump_frames']
+    return settings
+
+
+def init_worker(audio_folder, use_cache):
+    global analyzers
+    analyzers = {}
+    kd.audio_folder = audio_folder
+    kd.chroma_cache = use_cache
+    if use_cache:
+        kd.cache = kd.ChromaCache(kd.cache_folder, kd.cache_size)
+
+
+def mean_chroma(task):
+    """returns the mean chroma of a track as key_detector computes it with
+    the front-end settings given as json. The analysis chain of every
+    front-end is built once per worker process."""
+    settings_json, item = task
+    for name, value in json.loads(settings_json).items():
+        setattr(kd, name, value)
+    if settings_json not in analyzers:
+        analyzers[settings_json] = KeyAnalyzer(**kd.analyzer_settings())
+    kd.analyzer = analyzers[settings_json]
+    frames = kd.track_frames(item)
+    if kd.shift_spectrum and kd.shift_scope == 'frame' and len(frames) > 0:
+        frames = shift_vectors(frames, kd.hpcp_size, kd.shift_method)
+    chroma = np.zeros(kd.hpcp_size)
+    number_of_frames = 0
+    for vector in frames:
+        number_of_frames += kd.add_frame(chroma, vector, shift=False)
+    if number_of_frames == 0:
+        return settings_json, item, None
+    return settings_json, item, kd.track_chroma(chroma, number_of_frames)
+
+
+def ground_truth(item, groundtruth_folder):
+    """returns the annotated key of a track as a list, or None."""
+    if groundtruth_folder is None:
+        if ' = ' not in item or ' < ' not in item:
+            return None
+        return key_to_list(item[item.find(' = ')+3:item.rfind(' < ')])
+    annotation = os.path.join(groundtruth_folder, item[:item.rfind('.')] + '.txt')
+    if not os.path.isfile(annotation):
+        return None
+    with open(annotation) as annotation_file:
+        return key_to_list(annotation_file.readline().replace('\t', ' '))
+
+
+class Tuner(object):
+    """evaluates configurations on growing subsets of the corpus, keeping
+    the mean chroma of every track and front-end already analysed."""
+
+    def __init__(self, audio_folder, tracks, truths, pool=None):
+        self.audio_folder = audio_folder
+        self.tracks = tracks
+        self.truths = truths
+        self.pool = pool
+        self.chromas = {}     # (front-end json, item) -> chroma
+        self.algorithms = {}  # (hpcp_size, profile_type) -> Key
+
+    def analyse(self, configurations, number_of_tracks):
+        """computes the chroma that is still missing for the configurations."""
+        tasks = []
+        pending = set()
+        for configuration in configurations:
+            settings_json = json.dumps(front_end_of(configuration), sort_keys=True)
+            for item in self.tracks[:number_of_tracks]:
+                task = (settings_json, item)
+                if task not in self.chromas and task not in pending:
+                    tasks.append(task)
+                    pending.add(task)
+        results = self.pool.imap(mean_chroma, tasks) if self.pool else (mean_chroma(task) for task in tasks)
+        for settings_json, filename, chroma in results:
+            self.chromas[(settings_json, filename)] = chroma
+
+    def score(self, configuration, number_of_tracks):
+        """returns the MIREX weighted score on the first tracks."""
+        settings = front_end_of(configuration)
+        settings_json = json.dumps(settings, sort_keys=True)
+        algorithm_key = (settings['hpcp_size'], configuration['profile_type'])
+        if algorithm_key not in self.algorithms:
+            self.algorithms[algorithm_key] = key_algorithm(hpcp_size=settings['hpcp_size'],
+                                                           profile_type=configuration['profile_type'],
+                                                           use_three_chords=kd.use_three_chords,
+                                                           use_polyphony=kd.use_polyphony,
+                                                           num_harmonics=kd.num_harmonics,
+                                                           slope=kd.slope)
+        algorithm = self.algorithms[algorithm_key]
+        scores = []
+        for item, truth in zip(self.tracks[:number_of_tracks], self.truths):
+            chroma = self.chromas[(settings_json, item)]
+            if chroma is None:
+                scores.append(0)
+                continue
+            estimation = algorithm(list(chroma))
+            scores.append(mirex_score(truth, key_to_list(estimation[0] + ' ' + estimation[1])))
+        return np.mean(scores)
+
+    def successive_halving(self, configurations, eta=2):
+        """returns the surviving configurations with their final scores,
+        printing the scores of every round."""
+        rounds = 0
+        while len(configurations) / eta ** (rounds + 1) > 1:
+            rounds += 1
+        number_of_tracks = max(len(self.tracks) / eta ** rounds, 1)
+        for round_number in range(rounds + 1):
+            if round_number == rounds:
+                number_of_tracks = len(self.tracks)
+            start_time = tiempo()
+            self.analyse(configurations, number_of_tracks)
+            scored = sorted(((self.score(configuration, number_of_tracks), configuration)
+                             for configuration in configurations),
+                            key=lambda pair: -pair[0])
+            print "round %d: %d configurations on %d tracks (%.1f secs), best %.3f" % (
+                round_number, len(configurations), number_of_tracks, tiempo() - start_time, scored[0][0])
+            if round_number == rounds:
+                return scored
+            configurations = [configuration for score, configuration in
+                              scored[:max(len(configurations) / eta, 1)]]
+            number_of_tracks = min(number_of_tracks * eta, len(self.tracks))
+
+
+def random_configurations(number, generator):
+    """draws distinct configurations from the search space."""
+    names = sorted(search_space)
+    configurations = []
+    for attempt in range(number * 20):
+        configuration = dict((name, generator.choice(search_space[name])) for name in names)
+        if configuration not in configurations:
+            configurations.append(configuration)
+        if len(configurations) == number:
+            break
+    return configurations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches the analysis settings that maximise the MIREX weighted score.")
+    parser.add_argument('audio_folder')
+    parser.add_argument('groundtruth_folder', nargs='?')
+    parser.add_argument('-n', '--candidates', type=int, default=64)
+    parser.add_argument('-e', '--eta', type=int, default=2)
+    parser.add_argument('-w', '--workers', type=int, default=0)
+    parser.add_argument('--cache', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    tracks, truths = [], []
+    for item in sorted(os.listdir(args.audio_folder)):
+        truth = ground_truth(item, args.groundtruth_folder)
+        if truth is not None:
+            tracks.append(item)
+            truths.append(truth)
+    order = range(len(tracks))
+    generator.shuffle(order)  # subsets are random, but nested.
+    tracks = [tracks[i] for i in order]
+    truths = [truths[i] for i in order]
+    print len(tracks), "annotated tracks."
+
+    from multiprocessing import Pool, cpu_count
+    pool = Pool(args.workers or cpu_count(), init_worker, (args.audio_folder, args.cache))
+    init_worker(args.audio_folder, args.cache)
+    tuner = Tuner(args.audio_folder, tracks, truths, pool)
+    scored = tuner.successive_halving(random_configurations(args.candidates, generator), max(args.eta, 2))
+    pool.close()
+    pool.join()
+    print "\nBEST CONFIGURATIONS"
+    print "==================="
+    for score, configuration in scored[:5]:
+        print "%.3f" % score, json.dumps(configuration, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""Trains key profiles and evaluates them by k-fold cross-validation.
+
+The mean chroma of every track is read from the results store written by
+key_detector (results_format = 'store') or from its csv file in 'title'
+mode (results_to_csv = True), so no audio is analysed. For every fold,
+major and minor profiles are learnt from the other k-1 folds (as
+extract_profiles.py does) and the keys of the held-out tracks are
+estimated with the numpy key finder of key_tools, which follows the Key
+algorithm. Built-in profiles can be scored on the same folds for
+comparison.
+
+The profiles learnt from all the tracks can be written to a file that
+Key loads from ESSENTIA_KEY_PROFILES, so they can be used by
+key_detector.py without recompiling essentia.
+
+USAGE: profile_cv.py <results store | key_detector results folder | csv file> [options]
+  -k, --folds N          number of folds (default 5).
+  --statistic NAME       'mean' or 'median' of the training chroma.
+  -b, --baseline NAME    also evaluates a built-in profile (can be repeated).
+  -o, --output FILE      writes the profiles learnt from all the tracks.
+  --name NAME            name of the profiles written (default 'trained').
+  --seed N               seed of the assignment of tracks to folds.
+"""
+
+import os, sys, csv, argparse
+import numpy as np
+from key_tools import *
+from results_store import is_store, ResultsReader
+
+
+def read_store(folder):
+    """returns the file names, ground-truth keys and chroma of a results
+    store. Later records of a file replace earlier ones."""
+    records = ResultsReader(folder).read(('filename', 'ground_truth', 'chroma'))
+    latest = {}
+    for i, filename in enumerate(records['filename']):
+        latest[str(filename)] = i
+    rows = [latest[filename] for filename in sorted(latest)]
+    return (sorted(latest), [str(key) for key in records['ground_truth'][rows]],
+            records['chroma'][rows])
+
+
+def read_csv(filename):
+    """reads the 'title' mode csv of key_detector: title, ground truth,
+    chroma and the estimations of every key configuration."""
+    names, keys, chroma = [], [], []
+    with open(filename, 'r') as csv_file:
+        for row in csv.reader(csv_file):
+            values = []
+            for field in row[2:]:
+                try:
+                    values.append(float(field))
+                except ValueError:
+                    break
+            if not values:
+                continue
+            names.append(row[0])
+            keys.append(row[1])
+            chroma.append(values)
+    return names, keys, np.array(chroma)
+
+
+def load(route):
+    if is_store(route):
+        return read_store(route)
+    if os.path.isdir(route) and is_store(os.path.join(route, '_results')):
+        return read_store(os.path.join(route, '_results'))
+    return read_csv(route)
+
+
+def folds_of(number_of_tracks, k, seed=0):
+    """assigns every track to one of k folds of (almost) equal size."""
+    order = np.random.RandomState(seed).permutation(number_of_tracks)
+    folds = np.empty(number_of_tracks, dtype=int)
+    for fold, tracks in enumerate(np.array_split(order, k)):
+        folds[tracks] = fold
+    return folds
+
+
+def estimated_indexes(chroma, major, minor):
+    """estimates the keys of a chroma batch with 12-bin profiles, which are
+    interpolated to the size of the chroma as Key does."""
+    size = chroma.shape[1]
+    matrix = profile_matrix(interpolate_profile(major, size), interpolate_profile(minor, size))
+    tonic, mode, strength, relative = estimate_keys(chroma, matrix)
+    return key_index(tonic, mode)
+
+
+def cross_validate(chroma, tonics, modes, folds, statistic='mean'):
+    """returns the estimated key index of every track, with the profiles
+    learnt from the folds it does not belong to. Folds whose training tracks
+    lack a mode are not evaluated, and their estimations are -1."""
+    estimations = np.empty(len(chroma), dtype=int)
+    for fold in np.unique(folds):
+        training = folds != fold
+        major, minor = train_profiles(chroma[training], tonics[training], modes[training], statistic)
+        if major is None or minor is None:
+            print "WARNING: no %s tracks to train fold %d, which is not evaluated." % (
+                "major" if major is None else "minor", fold + 1)
+            estimations[~training] = -1
+            continue
+        estimations[~training] = estimated_indexes(chroma[~training], major, minor)
+    return estimations
+
+
+def report(title, ground_truths, estimations, folds):
+    categories = mirex_categories(ground_truths, estimations)
+    results = mirex_breakdown(categories, folds)
+    weighted = [results[fold][5] for fold in sorted(results)]
+    print "\n" + title
+    print "=" * len(title)
+    print "fold   correct  fifth  relative  parallel  error  weighted"
+    for fold in sorted(results):
+        print "%-5d  %.3f    %.3f  %.3f     %.3f     %.3f  %.3f" % ((fold + 1,) + tuple(results[fold]))
+    print "mean weighted %.3f (std %.3f across folds)" % (np.mean(weighted), np.std(weighted))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains key profiles and evaluates them by k-fold cross-validation.")
+    parser.add_argument('route')
+    parser.add_argument('-k', '--folds', type=int, default=5)
+    parser.add_argument('--statistic', choices=('mean', 'median'), default='mean')
+    parser.add_argument('-b', '--baseline', action='append', default=[])
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--name', default='trained')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    names, keys, chroma = load(args.route)
+    keys = [key_to_list(key.replace('\t', ' ').strip()) for key in keys]
+    tonics = np.array([key[0] for key in keys])
+    modes = np.array([key[1] for key in keys])
+    known = tonics < 12
+    chroma = np.asarray(chroma, dtype=float)[known]
+    tonics, modes = tonics[known], modes[known]
+    if len(chroma) < args.folds:
+        print "Not enough annotated tracks for", args.folds, "folds."
+        sys.exit()
+    if np.all(modes == 1) or np.all(modes == 0):
+        print "No", "minor" if np.all(modes == 1) else "major", "tracks: profiles cannot be trained."
+        sys.exit()
+    ground_truths = key_index(tonics, modes)
+    folds = folds_of(len(chroma), args.folds, args.seed)
+    print len(chroma), "tracks (%d major, %d minor), %d bins, %d folds." % (
+        np.sum(modes == 1), np.sum(modes == 0), chroma.shape[1], args.folds)
+
+    estimations = cross_validate(chroma, tonics, modes, folds, args.statistic)
+    evaluated = estimations >= 0
+    if not np.any(evaluated):
+        print "No fold could be evaluated."
+        sys.exit()
+    # baselines are scored on the same tracks as the trained profiles.
+    ground_truths, folds = ground_truths[evaluated], folds[evaluated]
+    report("trained (%s)" % args.statistic, ground_truths, estimations[evaluated], folds)
+    for profile_type in args.baseline:
+        major, minor = profiles[profile_type]
+        report(profile_type, ground_truths, estimated_indexes(chroma[evaluated], major, minor), folds)
+
+    if args.output:
+        major, minor = train_profiles(chroma, tonics, modes, args.statistic)
+        save_profiles(args.output, {args.name: (major, minor)})
+        print "\nprofiles learnt from all the tracks saved to", args.output
+        print "use them with ESSENTIA_KEY_PROFILES=%s and profile_type = '%s'" % (args.output, args.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Real-time key estimation from a live audio stream.
+
+A RealtimeKeyAnalyzer accepts blocks of mono PCM audio of any size, as
+they arrive from a sound card callback, a socket or a pipe, cuts them into
+frames with the front-end settings of key_detector.py and publishes a key
+estimate of the last window_seconds of audio every publish_every hops.
+Audio and hpcp frames are kept in preallocated ring buffers, so the work
+per block is bounded by the number of hops it contains.
+
+In the steady state no numpy arrays are allocated: the mean chroma is
+shifted to the tempered scale in place, and estimates are published in a
+list that is updated in place. What still allocates are the essentia
+algorithms, which copy their inputs and return new vectors and strings
+(the spectrum, the spectral peaks, the hpcp of every frame and the
+results of Key), and the small Python objects created by slicing.
+
+USAGE: realtime_key.py <audio file | -> [block size]
+With '-', raw 16-bit mono PCM at the sample rate of key_detector is read
+from the standard input; otherwise the file is fed block by block, as a
+stand-in for a live input.
+"""
+
+import sys
+import numpy as np
+from time import time as tiempo
+from key_analyzer import KeyAnalyzer
+
+
+class RealtimeKeyAnalyzer(object):
+    """push-based key analyser. callback, if given, receives every published
+    estimate as a list [time in secs, key, strength, relative strength],
+    which is updated in place by the next publication."""
+
+    def __init__(self, settings, hop_size=None, window_seconds=20,
+                 publish_every=4, shift_spectrum=True, callback=None):
+        self.analyzer = KeyAnalyzer(**settings)
+        self.window_size = self.analyzer.window_size
+        self.hop_size = hop_size or self.analyzer.hop_size
+        self.sample_rate = self.analyzer.sample_rate
+        self.hpcp_size = self.analyzer.hpcp_size
+        self.publish_every = max(int(publish_every), 1)
+        self.shift_spectrum = shift_spectrum
+        self.callback = callback
+        window_frames = max(int(round(window_seconds * self.sample_rate / float(self.hop_size))), 1)
+        self.audio = np.zeros(self.window_size, dtype=np.float32)  # ring buffer
+        self.frame = np.zeros(self.window_size, dtype=np.float32)
+        self.chroma_frames = np.zeros((window_frames, self.hpcp_size))  # ring buffer
+        self.chroma_sum = np.zeros(self.hpcp_size)
+        self.mean = np.zeros(self.hpcp_size)
+        self.chroma = np.zeros(self.hpcp_size, dtype=np.float32)
+        self.names = {}  # {key: {scale: 'key scale'}}
+        self.reset()
+
+    def reset(self):
+        """forgets all the audio received so far."""
+        self.audio[:] = 0
+        self.chroma_frames[:] = 0
+        self.chroma_sum[:] = 0
+        self.write_position = 0
+        self.samples = 0
+        self.frames = 0
+        # as essentia's FrameCutter, the first frame is centred on sample 0.
+        self.next_frame = self.window_size / 2
+        self.estimate = None
+        self.published = [0.0, '', 0.0, 0.0]
+
+    def push(self, block):
+        """adds a block of samples (floats in [-1, 1] or 16-bit integers).
+        Returns the latest estimate, which may have been published while
+        processing this block."""
+        block = np.asarray(block)
+        scale = 1.0 / 32768 if block.dtype == np.int16 else 1.0
+        position = 0
+        while position < len(block):
+            count = min(len(block) - position,
+                        self.next_frame - self.samples,
+                        self.window_size - self.write_position)
+            self.audio[self.write_position:self.write_position + count] = block[position:position + count]
+            if scale != 1.0:
+                self.audio[self.write_position:self.write_position + count] *= scale
+            self.write_position = (self.write_position + count) % self.window_size
+            self.samples += count
+            position += count
+            if self.samples == self.next_frame:
+                self.process_frame()
+                self.next_frame += self.hop_size
+        return self.estimate
+
+    def process_frame(self):
+        # unroll the ring buffer: the oldest sample is at write_position.
+        tail = self.window_size - self.write_position
+        self.frame[:tail] = self.audio[self.write_position:]
+        self.frame[tail:] = self.audio[:self.write_position]
+        vector = self.analyzer.hpcp_frame(self.frame)
+        index = self.frames % len(self.chroma_frames)
+        self.chroma_sum -= self.chroma_frames[index]
+        self.chroma_frames[index] = vector
+        self.chroma_sum += self.chroma_frames[index]
+        self.frames += 1
+        if self.frames % self.publish_every == 0:
+            self.publish()
+
+    def shift(self):
+        """writes the mean chroma into self.chroma, normalised and shifted to
+        the tempered scale as key_tools.shift_vector() does, without
+        allocating arrays."""
+        peak = np.argmax(self.mean)
+        self.mean /= self.mean[peak]
+        tuning_resolution = self.hpcp_size / 12
+        offset = peak % tuning_resolution
+        distance = tuning_resolution - offset if offset > tuning_resolution / 2 else offset
+        if distance == 0:
+            self.chroma[:] = self.mean
+        else:  # np.roll(mean, distance)
+            self.chroma[distance:] = self.mean[:-distance]
+            self.chroma[:distance] = self.mean[-distance:]
+
+    def key_name(self, key, scale):
+        try:
+            return self.names[key][scale]
+        except KeyError:
+            name = self.names.setdefault(key, {})[scale] = key + ' ' + scale
+            return name
+
+    def publish(self):
+        if np.max(self.chroma_sum) <= 0:  # only silence so far.
+            return
+        np.divide(self.chroma_sum, min(self.frames, len(self.chroma_frames)), out=self.mean)
+        if self.shift_spectrum:
+            self.shift()
+        else:
+            self.chroma[:] = self.mean
+        key, scale, strength, relative = self.analyzer.key_algorithm(self.chroma)
+        self.published[0] = float(self.samples) / self.sample_rate
+        self.published[1] = self.key_name(key, scale)
+        self.published[2] = strength
+        self.published[3] = relative
+        self.estimate = self.published
+        if self.callback is not None:
+            self.callback(self.estimate)
+
+
+def file_blocks(filename, block_size, sample_rate):
+    """yields the samples of an audio file in blocks of block_size, as a
+    stand-in for a live input."""
+    import essentia.standard as estd
+    from frame_selection import open_reader
+    loader = lambda name: estd.MonoLoader(filename=name, sampleRate=sample_rate)()
+    reader = open_reader(filename, sample_rate, loader)
+    try:
+        for start in range(0, reader.duration, block_size):
+            yield reader.read(start, min(block_size, reader.duration - start))
+    finally:
+        reader.close()
+
+
+def stdin_blocks(block_size):
+    """yields blocks of raw 16-bit mono PCM read from the standard input."""
+    while True:
+        data = sys.stdin.read(block_size * 2)
+        if len(data) < 2:
+            break
+        yield np.frombuffer(data[:len(data) / 2 * 2], dtype=np.int16)
+
+
+if __name__ == "__main__":
+    import key_detector as kd
+    try:
+        source = sys.argv[1]
+    except IndexError:
+        print "USAGE: realtime_key.py <audio file | -> [block size]"
+        sys.exit()
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+
+    def show(estimate):
+        print "%8.2f secs: %-10s (%.2f)" % tuple(estimate[:3])
+
+    realtime = RealtimeKeyAnalyzer(kd.analyzer_settings(),
+                                   window_seconds=kd.tracking_window,
+                                   shift_spectrum=kd.shift_spectrum,
+                                   callback=show)
+    if source == '-':
+        blocks = stdin_blocks(block_size)
+    else:
+        blocks = file_blocks(source, block_size, kd.sample_rate)
+    latency = 0
+    for block in blocks:
+        start = tiempo()
+        realtime.push(block)
+        latency = max(latency, tiempo() - start)
+    print "max processing time per block of %d samples: %.2f ms" % (block_size, latency * 1000)
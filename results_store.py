@@ -0,0 +1,108 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Columnar store for per-track key estimation results.
+
+Instead of a small text file per track, records are buffered and written
+in batches, as numbered chunks (chunk_00000.npz, chunk_00001.npz...) in a
+folder. Every chunk holds one array per column:
+
+filename, ground_truth, key     strings
+chroma                          (records x hpcp_size) float32
+confidence, seconds             float32 (seconds of analysis per track)
+settings                        hash of the settings used (see key_detector)
+
+Chunks are only added, never rewritten, so a store can be read while it
+is being written and a run can be resumed. A ResultsReader concatenates
+the columns of all the chunks.
+"""
+
+import os
+import glob
+import numpy as np
+
+columns = ('filename', 'ground_truth', 'key', 'chroma', 'confidence', 'seconds', 'settings')
+
+
+def is_store(folder):
+    """tells whether a folder contains a results store."""
+    return os.path.isdir(folder) and bool(glob.glob(os.path.join(folder, 'chunk_*.npz')))
+
+
+class ResultsWriter(object):
+    """appends records to the store in folder, batch_size at a time."""
+
+    def __init__(self, folder, batch_size=1024):
+        self.folder = folder
+        self.batch_size = batch_size
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.chunks = len(glob.glob(os.path.join(folder, 'chunk_*.npz')))
+        self.records = dict((column, []) for column in columns)
+
+    def append(self, filename, ground_truth, key, chroma, confidence, seconds, settings):
+        """adds the record of a track, writing a chunk when the batch is full."""
+        self.records['filename'].append(filename)
+        self.records['ground_truth'].append(ground_truth)
+        self.records['key'].append(key)
+        self.records['chroma'].append(np.asarray(chroma, dtype=np.float32))
+        self.records['confidence'].append(confidence)
+        self.records['seconds'].append(seconds)
+        self.records['settings'].append(settings)
+        if len(self.records['filename']) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes the buffered records as a new chunk."""
+        if not self.records['filename']:
+            return
+        arrays = dict((column, np.array(values)) for column, values in self.records.items())
+        arrays['chroma'] = np.vstack(self.records['chroma'])
+        arrays['confidence'] = arrays['confidence'].astype(np.float32)
+        arrays['seconds'] = arrays['seconds'].astype(np.float32)
+        path = os.path.join(self.folder, 'chunk_%05d.npz' % self.chunks)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as chunk_file:
+            np.savez(chunk_file, **arrays)
+        os.rename(temp_path, path)  # readers never see half a chunk.
+        self.chunks += 1
+        self.records = dict((column, []) for column in columns)
+
+    def close(self):
+        self.flush()
+
+
+class ResultsReader(object):
+    """reads the records of the store in folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def chunks(self):
+        """yields a dictionary of column arrays per chunk, in order."""
+        for path in sorted(glob.glob(os.path.join(self.folder, 'chunk_*.npz'))):
+            with np.load(path) as chunk:
+                yield dict((column, chunk[column]) for column in chunk.files)
+
+    def read(self, selected=columns):
+        """returns a dictionary with the selected columns of all the records."""
+        parts = dict((column, []) for column in selected)
+        for chunk in self.chunks():
+            for column in selected:
+                parts[column].append(chunk[column])
+        return dict((column, np.concatenate(arrays) if arrays else np.array([]))
+                    for column, arrays in parts.items())
+
+    def keys(self):
+        """returns a dictionary {file name without extension: estimated key},
+        as evaluation_mirex reads from a folder of estimations. Later records
+        of a file replace earlier ones."""
+        records = self.read(('filename', 'key'))
+        keys = {}
+        for filename, key in zip(records['filename'], records['key']):
+            name = os.path.basename(str(filename))
+            if '.' in name:
+                name = name[:name.rfind('.')]
+            keys[name] = str(key)
+        return keys
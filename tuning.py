@@ -0,0 +1,94 @@
+#!/usr/local/bin/python
+# -*- coding: UTF-8 -*-
+
+"""
+Fast estimation of the tuning of a track, before its chroma is computed.
+
+The spectral peaks of a few frames spread over the track are found with
+the vectorized front-end of batch_hpcp, and the deviation of every peak
+from the nearest tempered semitone (in cents, relative to 440 Hz) is
+averaged on the circle, weighted by its magnitude. The hpcp of the main
+pass can then be computed with the reference frequency of the track, so
+that its bins are aligned with the tempered scale and the chroma does not
+need to be shifted afterwards (see shift_spectrum in key_detector.py).
+
+USAGE: tuning.py <audio file> [<audio file> ...]
+"""
+
+import numpy as np
+import batch_hpcp
+from frame_selection import analysis_range, read_frames
+
+
+def peak_deviations(frames, sample_rate=44100, window_type='hann', min_frequency=25,
+                    max_frequency=3500, max_peaks=60, magnitude_threshold=0.0001,
+                    reference_frequency=440):
+    """returns the deviation in cents of every spectral peak of a matrix of
+    audio frames from the nearest tempered semitone, and its magnitude."""
+    frames = np.asarray(frames, dtype=np.float32)
+    window = batch_hpcp.window_function(window_type, frames.shape[1])
+    spectra = np.abs(np.fft.rfft(frames * window, axis=1))
+    frequencies, magnitudes = batch_hpcp.spectral_peaks(spectra, sample_rate, min_frequency,
+                                                        max_frequency, max_peaks, magnitude_threshold)
+    found = (magnitudes > 0) & (frequencies > 0)
+    cents = 1200 * np.log2(frequencies[found] / float(reference_frequency))
+    return (cents + 50) % 100 - 50, magnitudes[found]
+
+
+def tuning_deviation(frames, **settings):
+    """returns the tuning of a matrix of audio frames, in cents from the
+    tempered scale of the reference frequency (between -50 and 50)."""
+    deviations, magnitudes = peak_deviations(frames, **settings)
+    if len(deviations) == 0:
+        return 0.0
+    centroid = np.sum(magnitudes * np.exp(2j * np.pi * deviations / 100))
+    if abs(centroid) == 0:
+        return 0.0
+    return float(np.angle(centroid) * 100 / (2 * np.pi))
+
+
+def tuned_reference(deviation, reference_frequency=440):
+    """the reference frequency of a track with the given tuning deviation."""
+    return reference_frequency * 2 ** (deviation / 1200.0)
+
+
+def tuning_positions(duration, number_of_frames, window_size=4096, sample_rate=44100,
+                     skip_first_minute=False, first_n_secs=0, avoid_edges=0):
+    """the centre samples of number_of_frames frames evenly spread over the
+    analysed part of a track."""
+    start, end = analysis_range(duration, sample_rate, skip_first_minute, first_n_secs, avoid_edges)
+    candidates = (end - start) / window_size
+    if candidates <= 0:
+        return []
+    count = min(number_of_frames, candidates)
+    indexes = (np.arange(count) * (candidates / float(count))).astype(int)
+    return [start + index * window_size + window_size / 2 for index in indexes]
+
+
+def reader_tuning(reader, number_of_frames=64, window_size=4096, sample_rate=44100,
+                  skip_first_minute=False, first_n_secs=0, avoid_edges=0, **settings):
+    """estimates the tuning deviation of a track from number_of_frames of its
+    frames, read from a frame_selection reader."""
+    positions = tuning_positions(reader.duration, number_of_frames, window_size, sample_rate,
+                                 skip_first_minute, first_n_secs, avoid_edges)
+    if not positions:
+        return 0.0
+    return tuning_deviation(read_frames(reader, positions, window_size),
+                            sample_rate=sample_rate, **settings)
+
+
+if __name__ == "__main__":
+    import sys
+    from frame_selection import open_reader
+    if len(sys.argv) < 2:
+        print "USAGE: tuning.py <audio file> [<audio file> ...]"
+        sys.exit()
+    loader = None
+    for filename in sys.argv[1:]:
+        if not filename.lower().endswith('.wav') and loader is None:
+            import essentia.standard as estd
+            loader = lambda name: estd.MonoLoader(filename=name, sampleRate=44100)()
+        reader = open_reader(filename, 44100, loader)
+        deviation = reader_tuning(reader)
+        reader.close()
+        print "%+6.1f cents  %.2f Hz  %s" % (deviation, tuned_reference(deviation), filename)